@@ -0,0 +1,292 @@
+"""
+Admission control: per-user and per-IP rate limits, and load shedding.
+
+Every request spends tokens from two token buckets, one for the caller's IP
+and, with a session, one for the user. What a request costs depends on its
+route: once GET /metrics has seen MIN_COST_SAMPLES requests of a route, its
+mean Firestore reads per request (READS_PER_TOKEN reads to the token),
+before that DEFAULT_ROUTE_COSTS. So /listings/filter without the replica
+costs far more than GET /listings/<id> from the cache. An empty bucket gets
+429 with Retry-After.
+
+Buckets live in this process (a TTL cache, so idle callers cost nothing)
+unless RATE_LIMIT_BACKEND=redis, which shares them between every worker
+through RATE_LIMIT_REDIS_URL. Redis errors let requests through.
+
+Separately, at most MAX_IN_FLIGHT requests run at once per worker. Up to
+MAX_QUEUE more wait for MAX_QUEUE_MS, and the rest get 503 with Retry-After.
+So do requests that already waited longer than that in front of the app,
+going by the X-Request-Start header a proxy adds.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+from flask import g, jsonify, request
+
+import metrics
+
+try:
+    import redis
+except ImportError:
+    # Only needed for RATE_LIMIT_BACKEND=redis
+    redis = None
+
+log = logging.getLogger(__name__)
+
+RATE_LIMITS = os.environ.get("RATE_LIMITS", "1") != "0"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+if RATE_LIMIT_BACKEND not in ("memory", "redis"):
+    raise Exception(f"Unknown RATE_LIMIT_BACKEND {RATE_LIMIT_BACKEND!r}")
+if RATE_LIMIT_BACKEND == "redis" and redis is None:
+    raise Exception("RATE_LIMIT_BACKEND=redis needs the redis package: pip install redis")
+# Tokens per second and bucket size, per user and per IP
+USER_RATE = float(os.environ.get("RATE_LIMIT_USER_PER_SEC", "10"))
+USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", "100"))
+# Higher: a campus network puts many users behind one address
+IP_RATE = float(os.environ.get("RATE_LIMIT_IP_PER_SEC", "30"))
+IP_BURST = float(os.environ.get("RATE_LIMIT_IP_BURST", "300"))
+# Proxies in front of the app whose X-Forwarded-For entries are trusted (1 on Render)
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+
+READS_PER_TOKEN = 10
+MIN_COST_SAMPLES = 50
+MAX_COST = 50
+# Token cost of a route until its reads have been measured
+DEFAULT_ROUTE_COSTS = {
+    "/listings": 2,
+    "/listings/filter": 10,
+    "/listings/batch": 5,
+    "/listings/user/<email>": 2,
+    "/users/batch": 5,
+    "/messages": 2,
+    "/messages/conversations": 2,
+    "/notifications": 2,
+    "/auth/login": 5,
+    "/auth/register": 10,
+    "/photos": 5,
+    "/admin/listings/import": MAX_COST,
+}
+# ADMISSION_ROUTE_COSTS='{"/listings/filter": 20}' pins costs instead of measuring them
+ROUTE_COSTS = json.loads(os.environ.get("ADMISSION_ROUTE_COSTS", "{}"))
+EXEMPT_ROUTES = frozenset({"/health", "/metrics"})
+
+MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "12"))
+MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+MAX_QUEUE_MS = float(os.environ.get("ADMISSION_MAX_QUEUE_MS", "500"))
+# Long-lived streams would hold a slot for their whole life
+UNLIMITED_ROUTES = frozenset({"/messages/stream"})
+
+rejections = metrics.Counter(
+    "admission_rejections_total", "Requests turned away by admission control.", ("route", "reason"))
+metrics.METRICS.append(rejections)
+
+
+def route_cost(route):
+    if route in ROUTE_COSTS:
+        return ROUTE_COSTS[route]
+    count, mean_reads = metrics.reads_per_request.mean(route)
+    if count >= MIN_COST_SAMPLES:
+        return min(MAX_COST, max(1, math.ceil(mean_reads / READS_PER_TOKEN)))
+    return DEFAULT_ROUTE_COSTS.get(route, 1)
+
+
+#### Token buckets ####
+class MemoryBuckets:
+    """Token buckets of this process."""
+
+    def __init__(self, maxsize=100_000):
+        # An entry idle long enough to refill completely is the same as none
+        idle = max(USER_BURST / USER_RATE, IP_BURST / IP_RATE)
+        self._buckets = TTLCache(maxsize, idle)
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """(allowed, seconds until `cost` tokens are available)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return True, 0.0
+            self._buckets[key] = (tokens, now)
+        return False, (cost - tokens) / rate
+
+
+# KEYS[1] bucket; ARGV cost, rate, burst. Uses the server clock, so every
+# worker refills a bucket the same way.
+_REDIS_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1e6
+local cost, rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens, ts = tonumber(state[1]) or burst, tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring((cost - tokens) / rate)}
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker through Redis."""
+
+    def __init__(self, url):
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.2)
+        self._take = self._redis.register_script(_REDIS_TAKE)
+        # Set while Redis is failing, so an outage is logged once, not per request
+        self._down = False
+
+    def take(self, key, cost, rate, burst):
+        try:
+            allowed, wait = self._take(keys=[f"ratelimit:{key}"], args=[cost, rate, burst])
+        except Exception as e:
+            if not self._down:
+                self._down = True
+                log.warning(f"Rate limiter unavailable, admitting requests until it recovers: {e}")
+            return True, 0.0
+        if self._down:
+            self._down = False
+            log.info("Rate limiter recovered")
+        return bool(allowed), max(0.0, float(wait))
+
+
+_buckets = None
+_buckets_pid = None
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+    """This process's bucket store (created after gunicorn forks)."""
+    global _buckets, _buckets_pid
+    with _buckets_lock:
+        if _buckets is None or _buckets_pid != os.getpid():
+            if RATE_LIMIT_BACKEND == "redis":
+                _buckets = RedisBuckets(RATE_LIMIT_REDIS_URL)
+            else:
+                _buckets = MemoryBuckets()
+            _buckets_pid = os.getpid()
+        return _buckets
+
+
+def check_rate(route, user_id, ip):
+    """None when the request may go ahead, else (reason, seconds to wait)."""
+    if not RATE_LIMITS or route in EXEMPT_ROUTES:
+        return None
+    cost = route_cost(route)
+    buckets = get_buckets()
+    allowed, wait = buckets.take(f"ip:{ip}", cost, IP_RATE, IP_BURST)
+    if not allowed:
+        return "ip", wait
+    if user_id:
+        allowed, wait = buckets.take(f"user:{user_id}", cost, USER_RATE, USER_BURST)
+        if not allowed:
+            return "user", wait
+    return None
+
+
+def client_ip(remote_addr, forwarded_for):
+    """The caller's address, skipping TRUSTED_PROXY_HOPS proxies."""
+    if TRUSTED_PROXY_HOPS and forwarded_for:
+        hops = [part.strip() for part in forwarded_for.split(",") if part.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return remote_addr or "unknown"
+
+
+#### Concurrency ####
+class ConcurrencyLimiter:
+    def __init__(self, limit=MAX_IN_FLIGHT, max_queue=MAX_QUEUE, max_wait=MAX_QUEUE_MS / 1000):
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._max_queue = max_queue
+        self._max_wait = max_wait
+        self.waiting = 0
+
+    def acquire(self):
+        """Take a slot, waiting in line if there is room in it; False if not."""
+        if self._slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            if self.waiting >= self._max_queue:
+                return False
+            self.waiting += 1
+        try:
+            return self._slots.acquire(timeout=self._max_wait)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def release(self):
+        self._slots.release()
+
+
+def queued_ms(request_start, now=None):
+    """
+    Time since a proxy's X-Request-Start ("t=<epoch>" in s, ms or us), or
+    None without a usable header.
+    """
+    if not request_start:
+        return None
+    try:
+        stamp = float(request_start.strip().removeprefix("t="))
+    except ValueError:
+        return None
+    # Tell the units apart by magnitude
+    while stamp > 1e11:
+        stamp /= 1000
+    return ((now or time.time()) - stamp) * 1000
+
+
+limiter = ConcurrencyLimiter()
+
+
+#### Flask integration ####
+def _rejected(route, reason, status, error, wait):
+    rejections.inc(route, reason)
+    return jsonify({"error": error}), status, {"Retry-After": str(max(1, math.ceil(wait)))}
+
+
+def _admit():
+    if request.method == "OPTIONS":
+        return None
+    rule = request.url_rule
+    route = rule.rule if rule is not None else "(unmatched)"
+
+    user_id = g.user.get("sub") if g.get("user") else None
+    limited = check_rate(route, user_id, client_ip(request.remote_addr, request.headers.get("X-Forwarded-For")))
+    if limited is not None:
+        reason, wait = limited
+        return _rejected(route, f"rate_{reason}", 429, "Too many requests", wait)
+
+    if route in EXEMPT_ROUTES or route in UNLIMITED_ROUTES:
+        return None
+    waited = queued_ms(request.headers.get("X-Request-Start"))
+    if waited is not None and waited > MAX_QUEUE_MS:
+        return _rejected(route, "queue_time", 503, "Server busy, retry shortly", 1)
+    if not limiter.acquire():
+        return _rejected(route, "in_flight", 503, "Server busy, retry shortly", 1)
+    g.admission_slot = True
+    return None
+
+
+def _release(exc):
+    if g.pop("admission_slot", False):
+        limiter.release()
+
+
+def install(app):
+    """Admit every request of `app`; register after the hook that sets g.user."""
+    app.before_request(_admit)
+    app.teardown_request(_release)
@@ -1,31 +1,107 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
-from datetime import datetime
+from datetime import datetime, timezone
 from firebase_admin_setup import db
+from listings_replica import get_replica, replica_stats, add_replica_listener
+from doc_cache import doc_cache
+from auth import (HashingBusy, issue_token, verify_token, find_user, find_users, user_doc_id,
+                  user_cache_key, user_changed, user_changes, hash_password, verify_password,
+                  needs_rehash, migrate_user_ids)
+from listing_schema import PHOTO_ID, validate_listing
+from listing_import import FORMATS, guess_format, import_listings
+from availability import availability_fields, interval_index
+from geo import geo_index, location_fields, nearby, query_bounds, query_candidates
+from search_index import search_index
+from listing_queries import parse_criteria, build_predicate, plan_pushdown, apply_pushdown, walk_query, walk_replica
+from pagination import MAX_STREAM_LIMIT, encode_cursor, decode_cursor, parse_limit
+from conversations import (MarkReadFailed, conversation_id, record_sent, mark_read, inbox_page, embed_profiles,
+                           history_page, backfill_conversations, backfill_conversation_ids)
+from bulk_writes import WriteOp, bulk_write
+from message_stream import get_hub, parse_since
+from metrics import install as install_metrics
+from serializers import (install as install_serializers, page_response, project, projected_etag, request_fields,
+                         set_etag)
+from admission import install as install_admission
+from popularity import RANKING_COLLECTION, RANKING_DOC, TOP_N, get_recorder, rank as rank_popular, start_ranker
+from photos import (PHOTO_STORAGE, IMMUTABLE, VARIANT_NAME, PhotoTooLarge, UploadsBusy, get_pipeline,
+                    get_storage, object_key, photo_urls, sniff_type)
+from message_archive import HOT_DAYS, archive_messages, exposition as archive_exposition
+from saved_searches import COLLECTION as SAVED_SEARCHES, NOTIFICATIONS, saved_search_fields, get_notifier
+from preconditions import MAX_ATTEMPTS, encode_version, expected_version, write_option
+import io
+import hmac
 import json
-import hashlib
+import os
+import threading
+import time
+import click
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
 
 app = Flask(__name__)
 CORS(app, origins=["*"], supports_credentials=True)
 
-# This will touch the client. If the something is wrong like credentials, an error will raise
+install_metrics(app)
+install_serializers(app)
+
+# Readiness is one document read, cached for HEALTH_CACHE_SECONDS so frequent
+# probes don't each cost a Firestore round trip
+HEALTH_CACHE_SECONDS = float(os.environ.get("HEALTH_CACHE_SECONDS", "10"))
+_health_lock = threading.Lock()
+_health_check = {"at": None, "error": None}
+
+def firestore_ready():
+    """None when Firestore answered within the last HEALTH_CACHE_SECONDS, else the error."""
+    with _health_lock:
+        checked_at = _health_check["at"]
+        if checked_at is None or time.monotonic() - checked_at >= HEALTH_CACHE_SECONDS:
+            try:
+                db.collection("_health").document("probe").get()
+                _health_check["error"] = None
+            except Exception as e:
+                _health_check["error"] = str(e)
+            _health_check["at"] = time.monotonic()
+        return _health_check["error"]
+
 @app.get("/health")
 def health():
-    try:
-        _ = list(db.collections())
-        return jsonify({"status": "ok", "firebase": "connected"})
-    except Exception as e:
-        return jsonify({"status": "error", "details": str(e)}), 500
+    error = firestore_ready()
+    if error is not None:
+        return jsonify({"status": "error", "details": error}), 500
+    return jsonify({"status": "ok", "firebase": "connected", "listingsReplica": replica_stats(),
+                    "docCache": doc_cache.stats()})
 
 ######### HELPER FUNCTIONS #########
-# users are able to add listings by adding in a json file
-def add_listings(file_path):
-   with open(file_path, "r") as file:
-    data = json.load(file)
-    data["createdAt"] = datetime.utcnow()
-
-    db.collection("listings").add(data)
-    print("Should work?")
+# JSON response with a strong ETag (per encoding and `fields` projection);
+# answers a matching If-None-Match with 304
+def conditional_json(value, etag, fields=None):
+    response = jsonify(value)
+    set_etag(response, projected_etag(etag, fields))
+    # Let browsers keep the body but revalidate it on every use
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+# Most IDs one batch request may ask for; they are fetched with a single get_all
+MAX_BATCH_IDS = 300
+
+def parse_ids(body, field):
+    """The distinct IDs listed in body[field], in request order. Raises ValueError."""
+    ids = body.get(field)
+    if not isinstance(ids, list) or not all(isinstance(i, str) and i for i in ids):
+        raise ValueError(f"{field} must be a list of non-empty strings")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_BATCH_IDS:
+        raise ValueError(f"At most {MAX_BATCH_IDS} {field} per request")
+    return ids
+
+# Uploaded photos go out with the URLs of their sizes
+def format_listing(listing_data):
+    if listing_data.get("photos"):
+        listing_data["photoUrls"] = photo_urls(listing_data["photos"])
+    return listing_data
+
+# A page of listings built in memory, with only the fields asked for
+def listings_json(page, fields):
+    return jsonify({**page, "listings": [project(l, fields) for l in page["listings"]]})
 
 # this method reads all the info from the listings collection
 def read_listings():
@@ -72,45 +148,241 @@ def found_account(email, password):
 
 
 ######### Listings API #########
-# Returns all listing as a JSON array.
+def listings_page(params, query, predicate=None, replica_predicate=None, fields=None):
+    """
+    Respond with one newest-first page of listings. `params` carries the
+    opaque `cursor` and `limit` (up to MAX_STREAM_LIMIT; long pages are
+    streamed as they are read); `query`/`predicate` are used against Firestore
+    and `replica_predicate` against the in-memory replica when it is available.
+    Raises ValueError for a malformed cursor or limit.
+    """
+    cursor = decode_cursor(params.get("cursor"))
+    limit = parse_limit(params.get("limit"), maximum=MAX_STREAM_LIMIT)
+    replica = get_replica(db)
+    if replica is not None:
+        walk = walk_replica(replica, replica_predicate, cursor, limit)
+    else:
+        walk = walk_query(query, predicate, cursor, limit)
+
+    # The walk returns the last listing's sort key, for the cursor
+    def listings():
+        while True:
+            try:
+                listing_data = next(walk)
+            except StopIteration as stop:
+                return stop.value
+            yield format_listing(listing_data)
+
+    def tail(last):
+        return {"nextCursor": encode_cursor(last) if last else None}
+
+    return page_response("listings", listings(), tail, fields)
+
+def nearby_page(params, criteria):
+    """
+    Build one page of the listings within criteria["radiusMiles"] of
+    criteria["near"], nearest first, each with its "distanceMiles".
+    Candidates come from the geohash ranges covering the circle.
+    """
+    cursor = decode_cursor(params.get("cursor"))
+    limit = parse_limit(params.get("limit"))
+    center, radius = criteria["near"], criteria["radiusMiles"]
+    bounds = query_bounds(center, radius)
+    replica = get_replica(db)
+    if replica is not None:
+        candidates = [l for l in map(replica.get, geo_index.candidates(bounds)) if l is not None]
+    else:
+        candidates = query_candidates(db.collection("listings"), bounds)
+    matches = nearby(candidates, center, radius, build_predicate(criteria))
+    if cursor is not None:
+        matches = [l for l in matches if (l["distanceMiles"], l["id"]) > tuple(cursor)]
+    listings = matches[:limit]
+    for listing_data in listings:
+        format_listing(listing_data)
+    next_cursor = None
+    if len(matches) > limit:
+        next_cursor = encode_cursor([listings[-1]["distanceMiles"], listings[-1]["id"]])
+    return {"listings": listings, "nextCursor": next_cursor}
+
+def search_page(params, criteria, replica):
+    """
+    Build one page of the listings matching criteria["q"], best match first,
+    each with its BM25 "score". The other criteria, including a radius, are
+    applied to the ranked candidates.
+    """
+    cursor = decode_cursor(params.get("cursor"))
+    limit = parse_limit(params.get("limit"))
+    predicate = build_predicate(criteria, frozenset({"q"}))
+    after = (-cursor[0], cursor[1]) if cursor is not None else None
+    matches = []
+    for score, doc_id in search_index.search(criteria["q"]):
+        if after is not None and (-score, doc_id) <= after:
+            continue
+        listing_data = replica.get(doc_id)
+        if listing_data is None or (predicate is not None and not predicate(listing_data)):
+            continue
+        if criteria["radiusMiles"] is not None:
+            if not nearby([listing_data], criteria["near"], criteria["radiusMiles"]):
+                continue
+        listing_data["score"] = score
+        matches.append(listing_data)
+        if len(matches) > limit:
+            break
+    listings = matches[:limit]
+    for listing_data in listings:
+        format_listing(listing_data)
+    next_cursor = None
+    if len(matches) > limit:
+        next_cursor = encode_cursor([listings[-1]["score"], listings[-1]["id"]])
+    return {"listings": listings, "nextCursor": next_cursor}
+
+def availability_page(params, criteria, replica):
+    """
+    Build one page of the listings whose availability matches the requested
+    stay, longest overlap first, each with its "overlapDays".
+    """
+    cursor = decode_cursor(params.get("cursor"))
+    limit = parse_limit(params.get("limit"))
+    predicate = build_predicate(criteria, frozenset({"availability"}))
+    matches = []
+    ranked = interval_index.query(criteria["window"], criteria["availability"], criteria["minOverlapDays"],
+                                  after=tuple(cursor) if cursor is not None else None)
+    for overlap, doc_id in ranked:
+        listing_data = replica.get(doc_id)
+        if listing_data is None or (predicate is not None and not predicate(listing_data)):
+            continue
+        listing_data["overlapDays"] = round(overlap / 86400, 2)
+        matches.append((overlap, listing_data))
+        if len(matches) > limit:
+            break
+    listings = [listing_data for _, listing_data in matches[:limit]]
+    for listing_data in listings:
+        format_listing(listing_data)
+    next_cursor = None
+    if len(matches) > limit:
+        next_cursor = encode_cursor([matches[limit - 1][0], listings[-1]["id"]])
+    return {"listings": listings, "nextCursor": next_cursor}
+
+# Returns one page of listings, newest first: {"listings": [...], "nextCursor": ...}
 @app.get("/listings")
 def list_listings():
-    docs = (
-        db.collection("listings")
-          .order_by("createdAt", direction="DESCENDING")
-          .limit(20)
-          .stream()
-    )
-    listings = []
-    for doc in docs:
-        listing_data = doc.to_dict()
-        listing_data["id"] = doc.id
-        # Convert timestamp if present
-        if "createdAt" in listing_data and isinstance(listing_data["createdAt"], datetime):
-            listing_data["createdAt"] = listing_data["createdAt"].isoformat()
-        listings.append(listing_data)
-    return jsonify(listings)
+    try:
+        return listings_page(request.args, db.collection("listings"), fields=request_fields())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+# GET /listings/suggest?q=... - Typeahead completions for the search box
+@app.get("/listings/suggest")
+def suggest_listings():
+    """
+    Complete the last word of `q` from the words in listing titles,
+    descriptions, notes and addresses, most common first.
+    """
+    q = request.args.get("q", "")
+    try:
+        limit = min(parse_limit(request.args.get("limit") or "8"), 20)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if get_replica(db) is None:
+        return jsonify({"error": "Search index is not available"}), 503, {"Retry-After": "5"}
+    return jsonify({"suggestions": search_index.suggest(q, limit)}), 200
+
+# POST /listings/batch - Get many listings by ID
+@app.post("/listings/batch")
+def get_listings_batch():
+    """
+    Get up to MAX_BATCH_IDS listings in one call. Body: {"ids": [...]}.
+    Returns {"listings": {id: listing}, "missing": [ids not found]}; read
+    from the listings replica, or with a single get_all without it.
+    """
+    body = request.get_json(force=True) or {}
+    try:
+        ids = parse_ids(body, "ids")
+        fields = request_fields(body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        listings = {}
+        replica = get_replica(db)
+        if replica is not None:
+            for doc_id in ids:
+                listing_data = replica.get(doc_id)
+                if listing_data is not None:
+                    listings[doc_id] = listing_data
+        elif ids:
+            collection = db.collection("listings")
+            for doc in db.get_all([collection.document(doc_id) for doc_id in ids]):
+                if doc.exists:
+                    listing_data = doc.to_dict()
+                    listing_data["id"] = doc.id
+                    listings[doc.id] = listing_data
+        listings = {doc_id: project(format_listing(l), fields) for doc_id, l in listings.items()}
+        missing = [doc_id for doc_id in ids if doc_id not in listings]
+        return jsonify({"listings": listings, "missing": missing}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# GET /listings/popular - Most viewed and contacted listings
+@app.get("/listings/popular")
+def popular_listings():
+    """
+    The most popular listings by recent views and contacts, most popular
+    first. Served from the ranking document the background ranker keeps
+    current, through the document cache.
+    """
+    try:
+        limit = parse_limit(request.args.get("limit") or "12", maximum=TOP_N)
+        fields = request_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    start_ranker(db)
+
+    def load():
+        doc = db.collection(RANKING_COLLECTION).document(RANKING_DOC).get()
+        ranking = doc.to_dict() if doc.exists else {}
+        return {"listings": ranking.get("listings", []), "computedAt": ranking.get("computedAt")}
+
+    try:
+        ranking, _ = doc_cache.get((RANKING_COLLECTION, RANKING_DOC), load)
+        return jsonify({**ranking, "listings": [project(l, fields) for l in ranking["listings"][:limit]]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 # GET /listings/<id> - Get a single listing by ID
 @app.get("/listings/<id>")
 def get_listing(id):
     """
-    Get a single listing by its document ID.
+    Get a single listing by its document ID. Served from the document cache
+    (backed by the listings replica when it is running) with an ETag.
     """
     try:
-        doc_ref = db.collection("listings").document(id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
+        fields = request_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def load():
+        replica = get_replica(db)
+        if replica is not None:
+            listing_data, update_time = replica.get_versioned(id)
+        else:
+            doc = db.collection("listings").document(id).get()
+            if not doc.exists:
+                return None, None
+            listing_data, update_time = doc.to_dict(), doc.update_time
+            listing_data["id"] = doc.id
+        if listing_data is None:
+            return None, None
+        format_listing(listing_data)
+        # The ETag is the version to send back in If-Match
+        return listing_data, encode_version(update_time)
+
+    try:
+        listing_data, etag = doc_cache.get(("listings", id), load, versioned=True)
+        if listing_data is None:
             return jsonify({"error": "Listing not found"}), 404
-        
-        listing_data = doc.to_dict()
-        listing_data["id"] = doc.id
-        # Convert timestamp if present
-        if "createdAt" in listing_data and isinstance(listing_data["createdAt"], datetime):
-            listing_data["createdAt"] = listing_data["createdAt"].isoformat()
-        
-        return jsonify(listing_data), 200
+        get_recorder(db).record(id, "view")
+        return conditional_json(project(listing_data, fields), etag, fields)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -118,38 +390,60 @@ def get_listing(id):
 @app.put("/listings/<id>")
 def update_listing(id):
     """
-    Update a listing by its document ID.
+    Update a listing by its document ID. The write carries a last-update-time
+    precondition, so the listing is not read back: the response is the
+    pre-image (from the replica, or one read) plus the updates. Send the
+    listing's ETag as If-Match to get 412 instead of overwriting a newer edit.
     """
     try:
         body = request.get_json(force=True) or {}
-        doc_ref = db.collection("listings").document(id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            return jsonify({"error": "Listing not found"}), 404
-        
-        # Update the listing
-        updates = {}
-        allowed_fields = ["title", "price", "address", "contactName", "contactEmail", 
-                         "availableFrom", "availableTo", "parking", "furnished", "notes"]
-        
-        for field in allowed_fields:
-            if field in body:
-                updates[field] = body[field]
+        try:
+            expected = expected_version(request)
+            # Only schema fields are accepted
+            updates = validate_listing(body, partial=True)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         if not updates:
             return jsonify({"error": "No valid fields to update"}), 400
+        if "address" in updates:
+            updates.update(location_fields(updates["address"]))
         
-        doc_ref.update(updates)
-        
-        # Get updated listing
-        updated_doc = doc_ref.get()
-        listing_data = updated_doc.to_dict()
-        listing_data["id"] = updated_doc.id
-        if "createdAt" in listing_data and isinstance(listing_data["createdAt"], datetime):
-            listing_data["createdAt"] = listing_data["createdAt"].isoformat()
+        doc_ref = db.collection("listings").document(id)
+        replica = get_replica(db)
+        for attempt in range(MAX_ATTEMPTS):
+            listing_data, update_time = None, None
+            if attempt == 0 and replica is not None:
+                listing_data, update_time = replica.get_versioned(id)
+            if listing_data is None or (expected is not None and update_time != expected):
+                # No replica, or it may be behind the version the client saw
+                doc = doc_ref.get()
+                if not doc.exists:
+                    return jsonify({"error": "Listing not found"}), 404
+                listing_data, update_time = doc.to_dict(), doc.update_time
+                listing_data["id"] = doc.id
+            if expected is not None and update_time != expected:
+                return jsonify({"error": "Listing was changed by someone else"}), 412
+            
+            changes = dict(updates)
+            if "availableFrom" in changes or "availableTo" in changes:
+                changes.update(availability_fields({**listing_data, **changes}))
+            try:
+                result = doc_ref.update(changes, option=write_option(db, update_time))
+                break
+            except FailedPrecondition:
+                if expected is not None:
+                    return jsonify({"error": "Listing was changed by someone else"}), 412
+                # The pre-image went stale before the write landed; read it again
+        else:
+            return jsonify({"error": "Listing is being edited concurrently, retry"}), 409
+        doc_cache.invalidate(("listings", id))
         
-        return jsonify({"message": "Listing updated", "listing": listing_data}), 200
+        listing_data.update(changes)
+        format_listing(listing_data)
+        response = jsonify({"message": "Listing updated", "listing": listing_data})
+        response.set_etag(encode_version(result.update_time))
+        return response, 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -157,16 +451,21 @@ def update_listing(id):
 @app.delete("/listings/<id>")
 def delete_listing(id):
     """
-    Delete a listing by its document ID.
+    Delete a listing by its document ID, in one precondition-checked write.
+    With If-Match the listing must still be at that version.
     """
     try:
-        doc_ref = db.collection("listings").document(id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
+        try:
+            expected = expected_version(request)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            db.collection("listings").document(id).delete(option=write_option(db, expected))
+        except NotFound:
             return jsonify({"error": "Listing not found"}), 404
-        
-        doc_ref.delete()
+        except FailedPrecondition:
+            return jsonify({"error": "Listing was changed or deleted by someone else"}), 412
+        doc_cache.invalidate(("listings", id))
         return jsonify({"message": "Listing deleted"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -174,47 +473,108 @@ def delete_listing(id):
 # POST /listings. make a "created at" timestampe for consistency
 @app.post("/listings")
 def create_listing():
-    data = request.get_json(force=True)
-    data = data or {}
-    data["createdAt"] = datetime.utcnow()
+    try:
+        data = validate_listing(request.get_json(force=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    data.update(location_fields(data.get("address")))
+    data.update(availability_fields(data))
+    data["createdAt"] = datetime.now(timezone.utc)
     doc_ref = db.collection("listings").add(data)
     # Return the created listing with its ID
     listing_data = data.copy()
     listing_data["id"] = doc_ref[1].id
-    if isinstance(listing_data.get("createdAt"), datetime):
-        listing_data["createdAt"] = listing_data["createdAt"].isoformat()
+    doc_cache.invalidate(("listings", listing_data["id"]))
+    # Saved-search alerts are matched and written in the background
+    get_notifier(db).submit(listing_data["id"], data)
+    format_listing(listing_data)
     return jsonify({"ok": True, "listing": listing_data}), 201
 
 # GET /listings/user/<email> - Get all listings created by a user
 @app.get("/listings/user/<email>")
 def get_user_listings(email):
     """
-    Get all listings created by a specific user (by contactEmail).
+    Get the listings created by a specific user (by contactEmail), most recent
+    first, one page at a time.
     """
     try:
-        listings_ref = db.collection("listings")
-        docs = listings_ref.where("contactEmail", "==", email).stream()
-        
-        listings = []
-        for doc in docs:
-            listing_data = doc.to_dict()
-            listing_data["id"] = doc.id
-            # Convert timestamp if present
-            if "createdAt" in listing_data and isinstance(listing_data["createdAt"], datetime):
-                listing_data["createdAt"] = listing_data["createdAt"].isoformat()
-            listings.append(listing_data)
-        
-        # Sort by createdAt, most recent first
-        listings.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
-        
-        return jsonify(listings), 200
+        return listings_page(
+            request.args,
+            db.collection("listings").where("contactEmail", "==", email),
+            replica_predicate=lambda l: l.get("contactEmail") == email,
+            fields=request_fields(),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Listing edits made through any worker reach this one via the replica
+def invalidate_listing_cache(change, doc_id, data):
+    if change != "ADDED":
+        doc_cache.invalidate(("listings", doc_id))
+
+add_replica_listener(invalidate_listing_cache)
+# Radius searches look candidates up in the replica's geohash index
+add_replica_listener(geo_index.on_change)
+# Text searches rank candidates from the replica's inverted index
+add_replica_listener(search_index.on_change)
+# Date searches look candidates up in the replica's interval index
+add_replica_listener(interval_index.on_change)
+
 #### AUTHENTICATION ####
-def hash_password(password):
-    """Hash password using SHA-256 (for production, use bcrypt or similar)"""
-    return hashlib.sha256(password.encode()).hexdigest()
+# Verify the session token, if any, without touching Firestore. A bad or
+# expired token counts as no session, so public routes and login still
+# work; routes that act for a user answer 401 (session_error). Set
+# REQUIRE_SESSION=1 to also reject those requests when they carry no token.
+REQUIRE_SESSION = os.environ.get("REQUIRE_SESSION", "0") == "1"
+
+@app.before_request
+def load_session():
+  g.user = None
+  g.session_rejected = False
+  header = request.headers.get("Authorization", "")
+  token = header[len("Bearer "):] if header.startswith("Bearer ") else None
+  if token is None and request.path == "/messages/stream":
+    # EventSource can't set headers, so the stream takes the token in the URL
+    token = request.args.get("access_token")
+  if token:
+    claims = verify_token(token)
+    if claims is None:
+      g.session_rejected = True
+    else:
+      g.user = claims
+
+def session_error():
+  """The 401 response for a route that acts for a user, or None when it may go ahead."""
+  if g.session_rejected:
+    return jsonify({"error": "Invalid or expired session"}), 401
+  if g.user is None and REQUIRE_SESSION:
+    return jsonify({"error": "Login required"}), 401
+  return None
+
+def acting_email(claimed, name="user_email"):
+  """
+  The user a request acts for: the session's user, or `claimed` (the
+  request's `name` field) when there is no session. Returns (email, error response).
+  """
+  error = session_error()
+  if error is not None:
+    return None, error
+  if g.user is not None:
+    if claimed and claimed.lower() != g.user["email"].lower():
+      return None, (jsonify({"error": "Cannot act for another user"}), 403)
+    return g.user["email"], None
+  if not claimed:
+    return None, (jsonify({"error": f"{name} is required"}), 400)
+  return claimed, None
+
+# Rate limits and load shedding (admission.py), keyed by the session above
+install_admission(app)
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+  return jsonify({"error": "Server busy, retry shortly"}), 503, {"Retry-After": "1"}
 
 @app.post("/auth/register")
 def register_user():
@@ -235,8 +595,7 @@ def register_user():
       return jsonify({"error": "Password must be at least 6 characters"}), 400
 
   # See if a user doc with this email already exists
-  existing = db.collection("users").where("email", "==", email).limit(1).get()
-  if existing:
+  if find_user(db, email) is not None:
       return jsonify({"error": "User already exists"}), 400
 
   # Hash password before storing
@@ -249,10 +608,15 @@ def register_user():
       "lastName": lastName,
       "dob": dob,
       "gender": gender,
-      "createdAt": datetime.utcnow()
+      "createdAt": datetime.now(timezone.utc)
   }
-  doc_ref = db.collection("users").add(user_doc)
-  user_doc["id"] = doc_ref[1].id
+  # Users are keyed by email; create() fails if a concurrent registration won
+  doc_ref = db.collection("users").document(user_doc_id(email))
+  try:
+    doc_ref.create(user_doc)
+  except AlreadyExists:
+    return jsonify({"error": "User already exists"}), 400
+  user_doc["id"] = doc_ref.id
   # Don't return password in response
   user_response = {k: v for k, v in user_doc.items() if k != "password"}
 
@@ -271,44 +635,80 @@ def login_user():
       return jsonify({"error": "Password is required"}), 400
 
   # Look up that user in Firestore
-  found = db.collection("users").where("email", "==", email).limit(1).get()
-  if not found:
+  found = find_user(db, email)
+  if found is None:
       return jsonify({"error": "Invalid email or password"}), 401
 
-  user_data = found[0].to_dict()
+  user_data = found.to_dict()
   stored_password = user_data.get("password")
   
   # Verify password
-  hashed_input = hash_password(password)
-  if stored_password != hashed_input:
+  if not verify_password(password, stored_password):
       return jsonify({"error": "Invalid email or password"}), 401
 
+  # Upgrade legacy SHA-256 (or outdated scrypt) hashes now that we know the password
+  if needs_rehash(stored_password):
+      found.reference.update(user_changed({"password": hash_password(password)}))
+      # The profile's version changed with it
+      doc_cache.invalidate(user_cache_key(email))
+
   # Don't return password in response
   user_response = {k: v for k, v in user_data.items() if k != "password"}
-  user_response["id"] = found[0].id
+  user_response["id"] = found.id
 
-  return jsonify({"message": "Login ok", "user": user_response}), 200
+  return jsonify({
+      "message": "Login ok",
+      "user": user_response,
+      "token": issue_token(found.id, user_data.get("email", email)),
+  }), 200
 
 
 @app.get("/users/<email>")
 def get_user_profile(email):
   """
-  Get user profile by email.
+  Get user profile by email, served from the document cache with an ETag.
   """
+  def load():
+    user = find_user(db, email)
+    if user is None:
+      return None, None
+    # The ETag is the version to send back in If-Match
+    return public_profile(user), encode_version(user.update_time)
+
   try:
-    users = db.collection("users").where("email", "==", email).limit(1).get()
-    if not users:
+    user_changes.ensure_started(db)
+    user_response, etag = doc_cache.get(user_cache_key(email), load, versioned=True)
+    if user_response is None:
       return jsonify({"error": "User not found"}), 404
-    
-    user_data = users[0].to_dict()
-    user_data["id"] = users[0].id
-    # Don't return password
-    user_response = {k: v for k, v in user_data.items() if k != "password"}
-    # Convert timestamp if present
-    if "createdAt" in user_response and isinstance(user_response["createdAt"], datetime):
-      user_response["createdAt"] = user_response["createdAt"].isoformat()
-    
-    return jsonify(user_response), 200
+    return conditional_json(user_response, etag)
+  except Exception as e:
+    return jsonify({"error": str(e)}), 500
+
+
+def public_profile(user):
+  """A user snapshot as returned by the profile endpoints."""
+  user_data = user.to_dict()
+  user_data["id"] = user.id
+  # Don't return password
+  return {k: v for k, v in user_data.items() if k != "password"}
+
+
+@app.post("/users/batch")
+def get_users_batch():
+  """
+  Get up to MAX_BATCH_IDS user profiles in one call. Body: {"emails": [...]}.
+  Returns {"users": {email: profile}, "missing": [emails not found]}.
+  """
+  try:
+    emails = parse_ids(request.get_json(force=True) or {}, "emails")
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+
+  try:
+    found = find_users(db, emails)
+    users = {email: public_profile(found[email]) for email in emails if email in found}
+    missing = [email for email in emails if email not in users]
+    return jsonify({"users": users, "missing": missing}), 200
   except Exception as e:
     return jsonify({"error": str(e)}), 500
 
@@ -317,17 +717,24 @@ def get_user_profile(email):
 def update_user_profile(email):
   """
   Update user profile. Requires email in URL and updated fields in body.
+  A session token, when sent, must belong to that user. One write to the
+  email-keyed document, with If-Match as its precondition (a concurrent
+  edit gets 412); the profile is only read when that document is missing,
+  for users still stored under a legacy ID. Returns the updated fields.
   """
   body = request.get_json(force=True) or {}
+
+  error = session_error()
+  if error is not None:
+    return error
+  if g.user is not None and g.user["email"].lower() != email.lower():
+    return jsonify({"error": "Cannot update another user's profile"}), 403
+  try:
+    expected = expected_version(request)
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
   
   try:
-    users = db.collection("users").where("email", "==", email).limit(1).get()
-    if not users:
-      return jsonify({"error": "User not found"}), 404
-    
-    user_doc = users[0]
-    user_data = user_doc.to_dict()
-    
     # Update allowed fields (don't allow password or email changes here)
     allowed_fields = ["firstName", "lastName", "dob", "gender", "phone", "bio", "profilepic", "university"]
     updates = {}
@@ -345,16 +752,35 @@ def update_user_profile(email):
     if not updates:
       return jsonify({"error": "No valid fields to update"}), 400
     
-    # Update in Firestore
-    user_doc.reference.update(updates)
+    # Write straight to the email-keyed document, unless it changed since If-Match
+    option = write_option(db, expected)
+    user_ref = db.collection("users").document(user_doc_id(email))
+    try:
+      result = user_ref.update(user_changed(updates), option=option)
+    except (NotFound, FailedPrecondition):
+      # A stale If-Match, or a user still stored under a legacy ID
+      user_doc = find_user(db, email)
+      if user_doc is None:
+        return jsonify({"error": "User not found"}), 404
+      if user_doc.reference.path == user_ref.path:
+        return jsonify({"error": "Profile was changed by someone else"}), 412
+      user_ref = user_doc.reference
+      try:
+        result = user_ref.update(user_changed(updates), option=option)
+      except (NotFound, FailedPrecondition):
+        return jsonify({"error": "Profile was changed by someone else"}), 412
+    doc_cache.invalidate(user_cache_key(email))
     
-    # Get updated user data
-    updated_user = user_doc.reference.get().to_dict()
-    updated_user["id"] = user_doc.id
     # Don't return password
-    user_response = {k: v for k, v in updated_user.items() if k != "password"}
+    user_response = {k: v for k, v in updates.items() if k != "password"}
+    user_response["id"] = user_ref.id
+    user_response["email"] = email
     
-    return jsonify({"message": "Profile updated", "user": user_response}), 200
+    response = jsonify({"message": "Profile updated", "user": user_response})
+    response.set_etag(encode_version(result.update_time))
+    return response, 200
+  except HashingBusy:
+    raise
   except Exception as e:
     return jsonify({"error": str(e)}), 500
 
@@ -363,82 +789,44 @@ def update_user_profile(email):
 def filter_listings():
     try:
         body = request.get_json(force=True) or {}
-        title = body.get("title", "").strip()
-        max_price = body.get("maxPrice")
-        furnished = body.get("furnished")
-        parking = body.get("parking")
-        start_date = body.get("startDate")
-        end_date = body.get("endDate")
-
-        coll = db.collection("listings")
-
-        # Start building the query
-        query = coll
-
-        # Max price filter
-        if max_price:
-            try:
-                max_price_int = int(max_price)
-                query = query.where("price", "<=", max_price_int)
-            except (ValueError, TypeError):
-                pass  # Skip invalid price
-
-        # Get all results first (Firestore has limitations on multiple where clauses)
-        # We'll apply most filters client-side to avoid query complexity
-        docs = query.stream()
-        results = []
-        for doc in docs:
-            listing_data = doc.to_dict()
-            listing_data["id"] = doc.id
-            results.append(listing_data)
-
-        # Apply client-side filters
-        
-        # Title filter (case-insensitive search)
-        if title:
-            title_lower = title.lower()
-            results = [r for r in results if title_lower in (r.get("title", "") or "").lower()]
-
-        # Furnished filter (handle both boolean True and truthy values)
-        if furnished is True:
-            results = [r for r in results if r.get("furnished") is True]
-
-        # Parking filter (handle string values like "included", "additional-fee", "none")
-        if parking == "yes":
-            results = [r for r in results if r.get("parking") in [True, "included", "yes", "available"]]
-        elif parking == "no":
-            results = [r for r in results if r.get("parking") in [False, "none", "no", None]]
-
-        # Date filtering (using availableFrom and availableTo fields)
-        if start_date:
-            try:
-                start_date_obj = datetime.fromisoformat(start_date.replace("Z", "+00:00"))
-                results = [r for r in results if r.get("availableFrom")]
-                results = [
-                    r for r in results 
-                    if datetime.fromisoformat(r["availableFrom"].replace("Z", "+00:00")) >= start_date_obj
-                ]
-            except (ValueError, KeyError, TypeError) as e:
-                print(f"Error parsing start_date: {e}")
-
-        if end_date:
-            try:
-                end_date_obj = datetime.fromisoformat(end_date.replace("Z", "+00:00"))
-                results = [r for r in results if r.get("availableTo")]
-                results = [
-                    r for r in results 
-                    if datetime.fromisoformat(r["availableTo"].replace("Z", "+00:00")) <= end_date_obj
-                ]
-            except (ValueError, KeyError, TypeError) as e:
-                print(f"Error parsing end_date: {e}")
-
-        # Convert timestamps to ISO strings for JSON serialization
-        for r in results:
-            if "createdAt" in r and isinstance(r["createdAt"], datetime):
-                r["createdAt"] = r["createdAt"].isoformat()
-
-        print(f"Filtered results: {len(results)} listings found")
-        return jsonify(results), 200
+        criteria = parse_criteria(body)
+        fields = request_fields(body)
+
+        replica = get_replica(db) if criteria["q"] else None
+        if replica is not None:
+            # Ranked text search over the in-process index
+            page = search_page(body, criteria, replica)
+            app.logger.debug(f"Filtered results: {len(page['listings'])} listings matching {criteria['q']!r}")
+            return listings_json(page, fields), 200
+
+        if criteria["window"] is not None and criteria["radiusMiles"] is None:
+            replica = get_replica(db)
+            if replica is not None:
+                # Date search over the replica's interval index
+                page = availability_page(body, criteria, replica)
+                app.logger.debug(f"Filtered results: {len(page['listings'])} listings available ({criteria['availability']})")
+                return listings_json(page, fields), 200
+
+        if criteria["radiusMiles"] is not None:
+            # Distance search: geohash range queries, every other criterion in Python
+            page = nearby_page(body, criteria)
+            app.logger.debug(f"Filtered results: {len(page['listings'])} listings within {criteria['radiusMiles']} miles")
+            return listings_json(page, fields), 200
+
+        # Push the predicates a composite index can serve into the query;
+        # the rest (title, price range, dates) are checked while paging
+        pushed = plan_pushdown(criteria)
+        query = apply_pushdown(db.collection("listings"), criteria, pushed)
+        app.logger.debug(f"Filtered results: paging listings (pushed down: {', '.join(sorted(pushed)) or 'nothing'})")
+        return listings_page(
+            body,
+            query,
+            predicate=build_predicate(criteria, pushed),
+            replica_predicate=build_predicate(criteria),
+            fields=fields,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error in filter_listings: {e}")
         import traceback
@@ -449,114 +837,123 @@ def filter_listings():
 @app.post("/messages")
 def send_message():
   body = request.get_json(force=True) or {}
-  sender = body.get("sender_email")
+  sender, error = acting_email(body.get("sender_email"), "sender_email")
+  if error:
+    return error
   receiver = body.get("receiver_email")
   text = body.get("text")
+  # The listing the message is about, if it was sent from one
+  listing_id = body.get("listing_id")
 
-  if not sender or not receiver or not text:
-      return jsonify({"error": "sender_email, receiver_email, and text are required"}), 400
+  if not receiver or not text:
+      return jsonify({"error": "receiver_email and text are required"}), 400
+  if listing_id is not None and (not isinstance(listing_id, str) or not listing_id):
+      return jsonify({"error": "listing_id must be a non-empty string"}), 400
 
   msg = {
       "sender": sender,
       "receiver": receiver,
+      "conversationId": conversation_id(sender, receiver),
       "text": text,
-      "timestamp": datetime.utcnow(),
+      "timestamp": datetime.now(timezone.utc),
       "read": False
   }
-  doc_ref = db.collection("messages").add(msg)
-  msg["id"] = doc_ref[1].id
-  # Convert timestamp to ISO format string for JSON serialization
-  msg["timestamp"] = msg["timestamp"].isoformat()
+  if listing_id:
+    msg["listingId"] = listing_id
+  # Write the message and its conversation summary atomically
+  doc_ref = db.collection("messages").document()
+  batch = db.batch()
+  batch.set(doc_ref, msg)
+  record_sent(batch, db, msg)
+  batch.commit()
+  if listing_id:
+    get_recorder(db).record(listing_id, "contact")
+  msg["id"] = doc_ref.id
   return jsonify({"message": "sent", "data": msg}), 201
 
 
 @app.get("/messages")
 def get_conversation():
-  a = request.args.get("sender")
+  """
+  The latest `limit` messages between `sender` and `receiver`, oldest
+  first. Pass the returned `before` cursor back to load older ones.
+  `sender` must be the session's user.
+  """
+  a, error = acting_email(request.args.get("sender"), "sender")
+  if error:
+    return error
   b = request.args.get("receiver")
-  if not a or not b:
-      return jsonify({"error": "Query params 'sender' and 'receiver' are required"}), 400
+  if not b:
+      return jsonify({"error": "Query param 'receiver' is required"}), 400
 
-  coll = db.collection("messages")
+  try:
+    before = decode_cursor(request.args.get("before"))
+    limit = parse_limit(request.args.get("limit"), default=50)
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
 
-  # Query 1: messages sent A -> B
-  q1 = coll.where("sender", "==", a).where("receiver", "==", b).stream()
-  # Query 2: messages sent B -> A
-  q2 = coll.where("sender", "==", b).where("receiver", "==", a).stream()
+  return jsonify(history_page(db, a, b, before, limit)), 200
 
-  msgs = []
-  for doc in list(q1) + list(q2):
-    msg_data = doc.to_dict()
-    msg_data["id"] = doc.id
-    # Convert timestamp to ISO format string if it's a datetime object
-    if isinstance(msg_data.get("timestamp"), datetime):
-      msg_data["timestamp"] = msg_data["timestamp"].isoformat()
-    msgs.append(msg_data)
 
-  msgs.sort(key=lambda m: m.get("timestamp", ""))
+@app.get("/messages/stream")
+def stream_messages():
+  """
+  Server-Sent Events stream of new messages and read receipts between
+  `sender` and `receiver`. Sends the latest messages, or those after
+  `since` (or the Last-Event-ID header on reconnect), first, then live
+  events. A message's event id is a `before` cursor for GET /messages.
+  `sender` must be the session's user; pass the token as `access_token`.
+  """
+  a, error = acting_email(request.args.get("sender"), "sender")
+  if error:
+    return error
+  b = request.args.get("receiver")
+  if not b:
+      return jsonify({"error": "Query param 'receiver' is required"}), 400
+
+  try:
+    since = parse_since(request.headers.get("Last-Event-ID") or request.args.get("since"))
+  except ValueError:
+    return jsonify({"error": "since must be an ISO 8601 timestamp or an event id"}), 400
+
+  hub = get_hub(db)
+  subscription = hub.subscribe(a, b)
+  if subscription is None:
+    return jsonify({"error": "Too many open message streams, retry shortly"}), 503, {"Retry-After": "5"}
 
-  return jsonify(msgs), 200
+  feed, subscriber = subscription
+  return Response(
+    hub.stream(feed, subscriber, since),
+    mimetype="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+  )
 
 
 @app.get("/messages/conversations")
 def get_conversations():
   """
-  Get all conversations for a user.
-  Returns a list of conversations with the other participant's email and last message.
+  Get a user's conversations, most recent first, one page at a time.
+  Each entry has the other participant's email, the last message and the
+  unread count, read from the denormalized conversation summaries.
+  With include=profiles each entry also has "other_user", that
+  participant's name and picture, fetched for the whole page at once.
   """
-  user_email = request.args.get("user_email")
-  if not user_email:
-      return jsonify({"error": "Query param 'user_email' is required"}), 400
+  user_email, error = acting_email(request.args.get("user_email"))
+  if error:
+    return error
 
-  coll = db.collection("messages")
-  
-  # Get all messages where user is sender or receiver
-  all_messages = coll.where("sender", "==", user_email).stream()
-  all_messages = list(all_messages) + list(coll.where("receiver", "==", user_email).stream())
-  
-  # Build a map of other participants to their conversation data
-  conversations_map = {}
-  
-  # First pass: build conversation structure and find last message
-  for doc in all_messages:
-    msg_data = doc.to_dict()
-    other_participant = msg_data["receiver"] if msg_data["sender"] == user_email else msg_data["sender"]
-    
-    # Convert timestamp if needed
-    timestamp = msg_data.get("timestamp")
-    if isinstance(timestamp, datetime):
-      timestamp = timestamp.isoformat()
-    elif hasattr(timestamp, 'isoformat'):
-      timestamp = timestamp.isoformat()
-    
-    # Initialize conversation if needed
-    if other_participant not in conversations_map:
-      conversations_map[other_participant] = {
-        "other_user_email": other_participant,
-        "last_message": "",
-        "last_timestamp": "",
-        "unread_count": 0
-      }
-    
-    # Update last message if this is newer
-    current_last = conversations_map[other_participant]["last_timestamp"]
-    if not current_last or timestamp > current_last:
-      conversations_map[other_participant]["last_message"] = msg_data.get("text", "")
-      conversations_map[other_participant]["last_timestamp"] = timestamp
-  
-  # Second pass: count unread messages for each conversation
-  for other_participant in conversations_map.keys():
-    unread_query = coll.where("sender", "==", other_participant)\
-                       .where("receiver", "==", user_email)\
-                       .where("read", "==", False)\
-                       .stream()
-    conversations_map[other_participant]["unread_count"] = len(list(unread_query))
-  
-  # Convert to list and sort by last timestamp (most recent first)
-  conversations = list(conversations_map.values())
-  conversations.sort(key=lambda c: c.get("last_timestamp", ""), reverse=True)
-  
-  return jsonify(conversations), 200
+  try:
+    cursor = decode_cursor(request.args.get("cursor"))
+    limit = parse_limit(request.args.get("limit"))
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+
+  inbox = inbox_page(db, user_email, cursor, limit)
+  if request.args.get("include") == "profiles":
+    others = list(dict.fromkeys(entry["other_user_email"] for entry in inbox["conversations"]))
+    found = find_users(db, others)
+    embed_profiles(inbox, {email: doc.to_dict() for email, doc in found.items()})
+  return jsonify(inbox), 200
 
 
 @app.put("/messages/read")
@@ -565,11 +962,13 @@ def mark_messages_read():
   Mark messages as read for a conversation between two users.
   """
   body = request.get_json(force=True) or {}
-  user_email = body.get("user_email")
+  user_email, error = acting_email(body.get("user_email"))
+  if error:
+    return error
   other_user_email = body.get("other_user_email")
   
-  if not user_email or not other_user_email:
-      return jsonify({"error": "user_email and other_user_email are required"}), 400
+  if not other_user_email:
+      return jsonify({"error": "other_user_email is required"}), 400
 
   coll = db.collection("messages")
   
@@ -579,14 +978,281 @@ def mark_messages_read():
                         .where("read", "==", False)\
                         .stream()
   
-  updated_count = 0
-  for doc in unread_messages:
-    doc.reference.update({"read": True})
-    updated_count += 1
+  # Only the messages this call flips are taken off the unread counter
+  try:
+    updated_count = mark_read(db, user_email, other_user_email, list(unread_messages))
+  except MarkReadFailed as e:
+    app.logger.warning(f"Marking messages read failed after {e.marked}: {e}")
+    return jsonify({"error": "Could not mark every message read, try again", "count": e.marked}), 503
+  app.logger.debug(f"Marked {updated_count} messages read")
   
   return jsonify({"message": "marked as read", "count": updated_count}), 200
 
 
+#### SAVED SEARCHES ####
+def saved_search_response(doc_id, data):
+  return {"id": doc_id, "name": data.get("name", ""), "criteria": data.get("criteria", {}),
+          "createdAt": data.get("createdAt")}
+
+@app.post("/saved-searches")
+def create_saved_search():
+  """
+  Save /listings/filter criteria; the user is notified of new listings that
+  match them. Body: {"user_email", "name", "criteria"}.
+  """
+  body = request.get_json(force=True) or {}
+  email, error = acting_email(body.get("user_email"))
+  if error:
+    return error
+  try:
+    fields = saved_search_fields(body)
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+
+  fields["userEmail"] = email
+  fields["createdAt"] = datetime.now(timezone.utc)
+  _, doc_ref = db.collection(SAVED_SEARCHES).add(fields)
+  return jsonify(saved_search_response(doc_ref.id, fields)), 201
+
+@app.get("/saved-searches")
+def list_saved_searches():
+  email, error = acting_email(request.args.get("user_email"))
+  if error:
+    return error
+  docs = db.collection(SAVED_SEARCHES).where("userEmail", "==", email).stream()
+  searches = [saved_search_response(doc.id, doc.to_dict()) for doc in docs]
+  searches.sort(key=lambda s: str(s["createdAt"] or ""), reverse=True)
+  return jsonify({"savedSearches": searches}), 200
+
+@app.delete("/saved-searches/<id>")
+def delete_saved_search(id):
+  email, error = acting_email(request.args.get("user_email"))
+  if error:
+    return error
+  doc_ref = db.collection(SAVED_SEARCHES).document(id)
+  doc = doc_ref.get()
+  if not doc.exists:
+    return jsonify({"error": "Saved search not found"}), 404
+  if doc.to_dict().get("userEmail", "").lower() != email.lower():
+    return jsonify({"error": "Cannot delete another user's saved search"}), 403
+  doc_ref.delete(option=write_option(db, doc.update_time))
+  return jsonify({"message": "Saved search deleted"}), 200
+
+@app.get("/notifications")
+def list_notifications():
+  """A user's saved-search alerts, newest first, one page at a time."""
+  email, error = acting_email(request.args.get("user_email"))
+  if error:
+    return error
+  try:
+    cursor = decode_cursor(request.args.get("cursor"))
+    limit = parse_limit(request.args.get("limit"))
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+
+  query = (
+    db.collection(NOTIFICATIONS)
+      .where("userEmail", "==", email)
+      .order_by("createdAt", direction="DESCENDING")
+      .order_by("__name__", direction="DESCENDING")
+  )
+  if cursor is not None:
+    query = query.start_after({"createdAt": cursor[0], "__name__": cursor[1]})
+  docs = list(query.limit(limit).stream())
+  notifications = []
+  for doc in docs:
+    data = doc.to_dict()
+    data["id"] = doc.id
+    notifications.append(data)
+  next_cursor = None
+  if len(docs) == limit:
+    next_cursor = encode_cursor([docs[-1].to_dict().get("createdAt"), docs[-1].id])
+  return jsonify({"notifications": notifications, "nextCursor": next_cursor}), 200
+
+
+#### PHOTOS ####
+@app.post("/photos")
+def upload_photo():
+  """
+  Upload a listing photo, as the "file" field of a multipart form or as the
+  raw body. Returns {"id", "status", "photoUrls"}; put the id in a
+  listing's "photos". The sizes are rendered in the background, so
+  "status" is "processing" until they exist. Uploading the same bytes again
+  returns the stored photo (200 instead of 201).
+  """
+  error = session_error()
+  if error is not None:
+    return error
+  if request.mimetype == "multipart/form-data":
+    upload = request.files.get("file")
+    if upload is None:
+      return jsonify({"error": "file is required"}), 400
+    stream = upload.stream
+  else:
+    stream = request.stream
+
+  try:
+    photo, created = get_pipeline(db).upload(stream, g.user["email"] if g.user else None)
+  except PhotoTooLarge:
+    return jsonify({"error": "Photo is too large"}), 413
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+  except UploadsBusy:
+    return jsonify({"error": "Too many photos are being processed, try again shortly"}), 503, {"Retry-After": "5"}
+  return jsonify({"id": photo["id"], "status": photo.get("status"),
+                  "photoUrls": photo_urls([photo["id"]])[0]}), 201 if created else 200
+
+@app.get("/photos/<photo_id>")
+def get_photo(photo_id):
+  """A photo's status ("processing", "ready" or "failed"), size and URLs."""
+  if not PHOTO_ID.match(photo_id):
+    return jsonify({"error": "Photo not found"}), 404
+  doc = db.collection("photos").document(photo_id).get()
+  if not doc.exists:
+    return jsonify({"error": "Photo not found"}), 404
+  photo = doc.to_dict()
+  return jsonify({"id": photo_id, "status": photo.get("status"), "width": photo.get("width"),
+                  "height": photo.get("height"), "photoUrls": photo_urls([photo_id])[0]}), 200
+
+@app.get("/photos/<photo_id>/<name>")
+def serve_photo(photo_id, name):
+  """Serve a stored photo object from local storage (Cloud Storage serves its own)."""
+  if PHOTO_STORAGE != "local" or not PHOTO_ID.match(photo_id) or not VARIANT_NAME.match(name):
+    return jsonify({"error": "Photo not found"}), 404
+  path = get_storage().path(object_key(photo_id, name))
+  if not os.path.exists(path):
+    # Probably a size still being rendered; don't let it be cached
+    return jsonify({"error": "Photo not found"}), 404, {"Cache-Control": "no-store"}
+  with open(path, "rb") as f:
+    mimetype = sniff_type(f.read(16))
+  # The object behind a URL never changes, so its name is a fine ETag
+  response = send_file(path, mimetype=mimetype, etag=f"{photo_id}-{name}", conditional=True)
+  response.headers["Cache-Control"] = IMMUTABLE
+  return response
+
+
+#### ADMIN ####
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def is_admin():
+  token = request.headers.get("X-Admin-Token", "")
+  return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@app.post("/admin/listings/import")
+def admin_import_listings():
+  """
+  Stream an NDJSON or CSV body (?format=ndjson|csv, default from the
+  Content-Type) into the listings collection. Returns the import report.
+  """
+  if not is_admin():
+    return jsonify({"error": "Admin token required"}), 403
+  fmt = request.args.get("format") or ("csv" if "csv" in (request.content_type or "") else "ndjson")
+  if fmt not in FORMATS:
+    return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+  source = request.args.get("source", "import")
+
+  # Read the body as it arrives instead of buffering it
+  stream = io.TextIOWrapper(request.stream, encoding="utf-8", errors="replace", newline="")
+  report = import_listings(db, stream, fmt, source)
+  doc_cache.clear()
+  app.logger.info(f"Imported {report.imported}/{report.rows} listings in {report.seconds:.2f}s")
+  return jsonify(report.to_dict()), 200
+
+
+#### Maintenance commands ####
+@app.cli.command("import-listings")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="Defaults to csv for *.csv, else ndjson.")
+@click.option("--source", default="import", help="Namespace for the generated document IDs.")
+def import_listings_command(path, fmt, source):
+  """Import listings from an NDJSON or CSV file."""
+  with open(path, encoding="utf-8", errors="replace", newline="") as f:
+    report = import_listings(db, f, fmt or guess_format(path), source)
+  result = report.to_dict()
+  print(f"Imported {result['imported']} of {result['rows']} rows in {result['seconds']}s "
+        f"({result['rowsPerSecond']} rows/s, {result['chunks']} chunks)")
+  for error in report.errors:
+    print(f"  line {error['line']}: {error['error']}")
+  if report.error_count > len(report.errors):
+    print(f"  ... {report.error_count - len(report.errors)} more errors")
+
+@app.cli.command("backfill-geohash")
+def backfill_geohash_command():
+  """Geocode every listing and store its location and geohash."""
+  listings = db.collection("listings")
+  result = bulk_write(db, (
+      WriteOp("update", doc.reference, location_fields(doc.to_dict().get("address")))
+      for doc in listings.select(["address"]).stream()
+  ))
+  doc_cache.clear()
+  print(f"Geocoded {result.writes} listings in {len(result.chunks)} chunks")
+
+@app.cli.command("backfill-availability")
+def backfill_availability_command():
+  """Store availableStart/availableEnd timestamps parsed from every listing's dates."""
+  listings = db.collection("listings")
+  result = bulk_write(db, (
+      WriteOp("update", doc.reference, availability_fields(doc.to_dict()))
+      for doc in listings.select(["availableFrom", "availableTo"]).stream()
+  ))
+  doc_cache.clear()
+  print(f"Normalized availability of {result.writes} listings in {len(result.chunks)} chunks")
+
+@app.cli.command("migrate-user-ids")
+def migrate_user_ids_command():
+  """Re-key legacy user documents by email."""
+  result = migrate_user_ids(db)
+  print(f"Migrated {result.writes // 2} users in {len(result.chunks)} chunks")
+
+
+@app.cli.command("backfill-conversations")
+def backfill_conversations_command():
+  """Build conversation summaries from the existing messages."""
+  result = backfill_conversations(db)
+  print(f"Wrote {result.writes} conversation summaries in {len(result.chunks)} chunks")
+  for chunk in result.chunks:
+    print(f"  chunk {chunk['chunk']}: {chunk['writes']} writes, {chunk['attempts']} attempt(s), {chunk['seconds']}s")
+
+@app.cli.command("backfill-conversation-ids")
+@click.option("--page-size", default=1000, show_default=True, help="Messages read per query.")
+def backfill_conversation_ids_command(page_size):
+  """Tag existing messages with their conversationId."""
+  scanned, updated = backfill_conversation_ids(db, page_size)
+  print(f"Scanned {scanned} messages, tagged {updated} with a conversationId")
+
+@app.cli.command("archive-messages")
+@click.option("--hot-days", type=float, default=HOT_DAYS, show_default=True,
+              help="Messages older than this many days are archived.")
+@click.option("--dry-run", is_flag=True, help="Count what would be archived without writing anything.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint of an unfinished run.")
+@click.option("--metrics-file", type=click.Path(dir_okay=False),
+              help="Also write the archival counters there in Prometheus text format.")
+def archive_messages_command(hot_days, dry_run, restart, metrics_file):
+  """Fold old messages into per-conversation archive chunks."""
+  totals = archive_messages(db, hot_days, dry_run=dry_run, restart=restart)
+  verb = "Would archive" if dry_run else "Archived"
+  print(f"{verb} {totals['messages']} messages older than {totals['cutoff'].isoformat()} from "
+        f"{totals['conversations']} conversations into {totals['chunks']} chunks "
+        f"({totals['reclaimed']} documents reclaimed)")
+  if metrics_file:
+    with open(metrics_file, "w") as f:
+      f.write(archive_exposition())
+
+@app.cli.command("rank-popular-listings")
+def rank_popular_listings_command():
+  """Recompute the popular-listings ranking now."""
+  changed = rank_popular(db, force=True)
+  print(f"Re-ranked popular listings; {changed} listings had new views or contacts")
+
+@app.cli.command("rerender-photos")
+def rerender_photos_command():
+  """Render the sizes of every photo whose resizing failed."""
+  pipeline = get_pipeline(db)
+  failed = [doc.id for doc in db.collection("photos").where("status", "==", "failed").stream()]
+  for photo_id in failed:
+    pipeline.rerender(photo_id).result()
+  print(f"Re-rendered {pipeline.rendered} of {len(failed)} failed photos")
 
 
 if __name__ == "__main__":
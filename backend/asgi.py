@@ -0,0 +1,227 @@
+"""
+ASGI entry point: the Flask app plus async versions of the messaging read
+endpoints.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
+
+GET /messages and GET /messages/conversations are served here with the
+Firestore AsyncClient, so a worker keeps serving other requests while it
+waits on Firestore. Every other request goes to the unchanged Flask app through
+asgiref's WsgiToAsgi adapter, which runs it on a thread pool. `gunicorn
+app:app` keeps working as before.
+"""
+import asyncio
+import math
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from admission import check_rate, client_ip, rejections
+from app import REQUIRE_SESSION, app as flask_app
+from auth import IN_FILTER_LIMIT, LEGACY_FALLBACK, user_doc_id, verify_token
+from conversations import (archive_boundary, conversation_id, embed_profiles, history_query, history_result,
+                           inbox_query, inbox_result, with_archived)
+from firebase_admin_setup import async_client
+from message_archive import archive_query, is_archived
+from metrics import READS_HEADER, end_request, finish_request, firestore_rpc_latency, record, start_request
+from pagination import decode_cursor, parse_limit
+from serializers import COMPRESS_MIN_BYTES, compress, negotiate
+
+_wsgi = WsgiToAsgi(flask_app)
+_adb = None
+
+
+def get_async_db():
+    # Created inside the running event loop; gRPC channels bind to it
+    global _adb
+    if _adb is None:
+        _adb = async_client()
+    return _adb
+
+
+async def _collect(query):
+    started = time.perf_counter()
+    docs = [doc async for doc in query.stream()]
+    firestore_rpc_latency.observe(time.perf_counter() - started, "query")
+    record(reads=max(1, len(docs)), queries=1)
+    return docs
+
+
+async def _get(query):
+    # limit_to_last queries can't be streamed
+    started = time.perf_counter()
+    docs = list(await query.get())
+    firestore_rpc_latency.observe(time.perf_counter() - started, "query")
+    record(reads=max(1, len(docs)), queries=1)
+    return docs
+
+
+def _acting_email(session, claimed, name):
+    """app.acting_email for these routes: (email, None) or (None, (status, error body))."""
+    claims, rejected = session
+    if rejected:
+        return None, (401, {"error": "Invalid or expired session"})
+    if claims is None:
+        if REQUIRE_SESSION:
+            return None, (401, {"error": "Login required"})
+        if not claimed:
+            return None, (400, {"error": f"{name} is required"})
+        return claimed, None
+    if claimed and claimed.lower() != claims["email"].lower():
+        return None, (403, {"error": "Cannot act for another user"})
+    return claims["email"], None
+
+
+async def get_conversation(params, session):
+    a, error = _acting_email(session, params.get("sender"), "sender")
+    if error:
+        return error
+    b = params.get("receiver")
+    if not b:
+        return 400, {"error": "Query param 'receiver' is required"}
+    try:
+        before = decode_cursor(params.get("before"))
+        limit = parse_limit(params.get("limit"), default=50)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    docs = [] if is_archived(before) else await _get(history_query(get_async_db(), a, b, before, limit))
+    result = history_result(docs, limit)
+    if len(docs) < limit:
+        # Scrolled past the hot messages; same as conversations.history_page
+        boundary = archive_boundary(result, before)
+        chunks = await _collect(archive_query(get_async_db(), conversation_id(a, b), boundary, limit - len(docs)))
+        result = with_archived(result, chunks, boundary, limit)
+    return 200, result
+
+
+async def get_conversations(params, session):
+    user_email, error = _acting_email(session, params.get("user_email"), "user_email")
+    if error:
+        return error
+    try:
+        cursor = decode_cursor(params.get("cursor"))
+        limit = parse_limit(params.get("limit"))
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    docs = await _collect(inbox_query(get_async_db(), user_email, cursor, limit))
+    inbox = inbox_result(docs, user_email, limit)
+    if params.get("include") == "profiles":
+        others = list(dict.fromkeys(entry["other_user_email"] for entry in inbox["conversations"]))
+        embed_profiles(inbox, await _find_users(others))
+    return 200, inbox
+
+
+async def _find_users(emails):
+    """
+    Async auth.find_users: {email: user dict} with one get_all, plus the
+    legacy "in" queries run concurrently.
+    """
+    adb = get_async_db()
+    users = adb.collection("users")
+    by_id = {}
+    for email in emails:
+        by_id.setdefault(user_doc_id(email), []).append(email)
+    found = {}
+    if by_id:
+        started = time.perf_counter()
+        docs = [doc async for doc in adb.get_all([users.document(doc_id) for doc_id in by_id])]
+        firestore_rpc_latency.observe(time.perf_counter() - started, "get_all")
+        record(reads=len(docs))
+        for doc in docs:
+            if doc.exists:
+                for email in by_id[doc.id]:
+                    found[email] = doc.to_dict()
+    missing = [email for email in emails if email not in found]
+    if LEGACY_FALLBACK and missing:
+        pages = await asyncio.gather(*(
+            _collect(users.where("email", "in", missing[start:start + IN_FILTER_LIMIT]))
+            for start in range(0, len(missing), IN_FILTER_LIMIT)
+        ))
+        for docs in pages:
+            for doc in docs:
+                data = doc.to_dict()
+                found.setdefault(data.get("email"), data)
+    return found
+
+
+ROUTES = {
+    ("GET", "/messages"): get_conversation,
+    ("GET", "/messages/conversations"): get_conversations,
+}
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _cors_headers(scope):
+    # Same answer flask-cors gives for origins="*" with supports_credentials
+    origin = _header(scope, b"origin")
+    if not origin:
+        return []
+    return [
+        (b"access-control-allow-origin", origin.encode("latin-1")),
+        (b"access-control-allow-credentials", b"true"),
+        (b"vary", b"Origin"),
+    ]
+
+
+async def _send_json(send, scope, status, value, headers=()):
+    # Encoded and compressed like the Flask routes' responses (serializers.py)
+    body = flask_app.json.dumps(value, separators=(",", ":")).encode()
+    headers = [(b"vary", b"Accept-Encoding")] + list(headers)
+    encoding = negotiate(_header(scope, b"accept-encoding"))
+    if encoding is not None and len(body) >= COMPRESS_MIN_BYTES:
+        body = compress(body, encoding)
+        headers.append((b"content-encoding", encoding.encode()))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())] + _cors_headers(scope) + headers,
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def app(scope, receive, send):
+    handler = None
+    if scope["type"] == "http":
+        handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        return await _wsgi(scope, receive, send)
+
+    # Mirror app.load_session; the handlers check the session like app.acting_email
+    authorization = _header(scope, b"authorization") or ""
+    claims = None
+    rejected = False
+    if authorization.startswith("Bearer "):
+        claims = verify_token(authorization[len("Bearer "):])
+        rejected = claims is None
+
+    # Same buckets as the Flask routes; these never wait on the thread pool, so
+    # the concurrency limit doesn't apply
+    remote = (scope.get("client") or (None,))[0]
+    limited = check_rate(scope["path"], claims and claims.get("sub"),
+                         client_ip(remote, _header(scope, b"x-forwarded-for")))
+    if limited is not None:
+        reason, wait = limited
+        rejections.inc(scope["path"], f"rate_{reason}")
+        return await _send_json(send, scope, 429, {"error": "Too many requests"},
+                                [(b"retry-after", str(max(1, math.ceil(wait))).encode())])
+
+    params = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+    started = time.perf_counter()
+    usage, token = start_request(scope["path"])
+    try:
+        status, value = await handler(params, (claims, rejected))
+    except Exception as e:
+        status, value = 500, {"error": str(e)}
+    finally:
+        end_request(token)
+    finish_request(usage, scope["method"], status, time.perf_counter() - started)
+    headers = [(b"x-firestore-reads", str(usage.reads).encode())] if READS_HEADER else []
+    await _send_json(send, scope, status, value, headers)
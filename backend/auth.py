@@ -0,0 +1,198 @@
+"""
+Session tokens, the email-keyed user directory and password hashing.
+
+- Login issues an HS256 session token (PyJWT) that the before-request hook
+  verifies locally, without a Firestore read.
+- User documents are keyed by their normalized email, so a lookup is one
+  document().get(). Users created before that are still found through the
+  old where("email") query until `flask migrate-user-ids` has run and
+  USER_DIRECTORY_LEGACY_FALLBACK=0 is set.
+- Passwords are hashed with scrypt on a small, bounded thread pool so a burst
+  of logins cannot tie up every request thread. Legacy SHA-256 hashes are
+  still accepted and upgraded on the next successful login.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+import jwt
+
+from firebase_admin import firestore
+
+from bulk_writes import WriteOp, bulk_write
+from doc_cache import UPDATED_FIELD, ChangeFeed
+from firebase_admin_setup import STORAGE_BACKEND
+
+SESSION_SECRET = os.environ.get("SESSION_SECRET")
+if not SESSION_SECRET:
+    # A random secret only verifies tokens in the process that issued them,
+    # so every other worker (and every restart) would log users out
+    if STORAGE_BACKEND != "memory":
+        raise Exception("SESSION_SECRET is not set")
+    print("SESSION_SECRET is not set; using a random per-process secret")
+    SESSION_SECRET = secrets.token_hex(32)
+TOKEN_ALGORITHM = "HS256"
+TOKEN_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+
+LEGACY_FALLBACK = os.environ.get("USER_DIRECTORY_LEGACY_FALLBACK", "1") != "0"
+# Firestore's limit on the values of an "in" filter
+IN_FILTER_LIMIT = 30
+
+# scrypt cost parameters; n=2**14, r=8 takes ~16 MB and tens of ms per hash
+SCRYPT_N = int(os.environ.get("PASSWORD_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("PASSWORD_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("PASSWORD_SCRYPT_P", "1"))
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", "8"))
+HASH_WAIT_SECONDS = 2.0
+
+
+class HashingBusy(Exception):
+    """Raised when the password-hashing pool is saturated."""
+
+
+#### Session tokens ####
+def issue_token(user_id, email):
+    now = int(time.time())
+    claims = {"sub": user_id, "email": email, "iat": now, "exp": now + TOKEN_TTL_SECONDS}
+    return jwt.encode(claims, SESSION_SECRET, algorithm=TOKEN_ALGORITHM)
+
+
+def verify_token(token):
+    """Return the token's claims, or None if it is invalid or expired."""
+    try:
+        return jwt.decode(token, SESSION_SECRET, algorithms=[TOKEN_ALGORITHM],
+                          options={"require": ["sub", "email", "exp"]})
+    except jwt.InvalidTokenError:
+        return None
+
+
+#### User directory ####
+def user_doc_id(email):
+    """Document ID of the user with this email: the normalized email itself."""
+    return quote(email.strip().lower(), safe="@+")
+
+
+def user_cache_key(email):
+    """doc_cache key of a user's profile."""
+    return ("users", user_doc_id(email))
+
+
+def user_changed(fields):
+    """`fields` plus the UPDATED_FIELD stamp every write to an existing user carries."""
+    return {**fields, UPDATED_FIELD: firestore.SERVER_TIMESTAMP}
+
+
+# Drops cached profiles written through any worker
+user_changes = ChangeFeed(
+    "users", lambda doc: user_cache_key((doc.to_dict() or {}).get("email") or unquote(doc.id)))
+
+
+def find_user(db, email):
+    """Return the user's DocumentSnapshot, or None."""
+    doc = db.collection("users").document(user_doc_id(email)).get()
+    if doc.exists:
+        return doc
+    if LEGACY_FALLBACK:
+        found = db.collection("users").where("email", "==", email).limit(1).get()
+        if found:
+            return found[0]
+    return None
+
+
+def find_users(db, emails):
+    """
+    Return {email: DocumentSnapshot} for those of `emails` that have a user,
+    fetched with one get_all (plus "in" queries for legacy user IDs).
+    """
+    users = db.collection("users")
+    by_id = {}
+    for email in emails:
+        by_id.setdefault(user_doc_id(email), []).append(email)
+    found = {}
+    if by_id:
+        for doc in db.get_all([users.document(doc_id) for doc_id in by_id]):
+            if doc.exists:
+                for email in by_id[doc.id]:
+                    found[email] = doc
+    missing = [email for email in emails if email not in found]
+    if LEGACY_FALLBACK:
+        for start in range(0, len(missing), IN_FILTER_LIMIT):
+            for doc in users.where("email", "in", missing[start:start + IN_FILTER_LIMIT]).stream():
+                found.setdefault(doc.to_dict().get("email"), doc)
+    return found
+
+
+def migrate_user_ids(db):
+    """Move users stored under auto-generated IDs to email-keyed documents."""
+    users = db.collection("users")
+
+    def ops():
+        for doc in users.stream():
+            data = doc.to_dict()
+            email = data.get("email")
+            if not email or doc.id == user_doc_id(email):
+                continue
+            yield WriteOp("set", users.document(user_doc_id(email)), user_changed(data))
+            yield WriteOp("delete", doc.reference)
+
+    # A user's copy and delete stay in the same 500-write chunk
+    return bulk_write(db, ops(), chunk_size=500)
+
+
+#### Password hashing ####
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+
+
+def _run_bounded(fn, *args):
+    if not _hash_slots.acquire(timeout=HASH_WAIT_SECONDS):
+        raise HashingBusy()
+    try:
+        return _hash_pool.submit(fn, *args).result()
+    finally:
+        _hash_slots.release()
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * 1024 * 1024)
+
+
+def _hash(password):
+    salt = secrets.token_bytes(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def _verify(password, stored):
+    if not stored:
+        return False
+    if stored.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, digest = stored.split("$")
+            actual = _scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p))
+        except ValueError:
+            return False
+        return hmac.compare_digest(actual.hex(), digest)
+    # Legacy unsalted SHA-256
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+
+def hash_password(password):
+    """scrypt hash in the bounded pool. Raises HashingBusy when saturated."""
+    return _run_bounded(_hash, password)
+
+
+def verify_password(password, stored):
+    """Check a password against a stored hash. Raises HashingBusy when saturated."""
+    return _run_bounded(_verify, password, stored)
+
+
+def needs_rehash(stored):
+    """True for legacy SHA-256 hashes and scrypt hashes with outdated parameters."""
+    return not (stored or "").startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
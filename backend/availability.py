@@ -0,0 +1,252 @@
+"""
+Availability windows: normalized timestamps and an interval index.
+
+Listings keep the ISO strings the frontend sends in availableFrom /
+availableTo and, since this module, also store them parsed once at write
+time as UTC timestamps:
+
+    availableStart   datetime or None
+    availableEnd     datetime or None
+
+A date filter compares a listing's [start, end] window with the requested
+one in one of three modes:
+
+    overlap  the windows share at least minOverlapDays days (the default)
+    covers   the listing is available for the whole requested window
+    within   the listing's window lies inside the requested one
+
+IntervalIndex keeps every replicated listing's window in a treap ordered by
+start and augmented with the largest and smallest end in each subtree. Each
+mode bounds the start from one side and the end from the other, so a query
+descends only into subtrees that can hold a match: finding the k matching
+listings visits O(log n + k) nodes in the usual case and O((k + 1) log n) at
+worst, however many listings fall on either side of the requested dates.
+The matches come back in order of overlap length from a heap, so a page
+costs that search plus O(log k) per listing returned.
+"""
+import math
+import random
+import threading
+from heapq import heapify, heappop
+from datetime import datetime, timezone
+
+MODES = ("overlap", "covers", "within")
+DEFAULT_MODE = "overlap"
+DAY_SECONDS = 86400
+
+
+def to_timestamp(value):
+    """UTC datetime for an ISO string or datetime; naive values count as UTC. None if unparseable."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def availability_fields(listing):
+    """The availableStart/availableEnd fields to store for a listing."""
+    return {
+        "availableStart": to_timestamp(listing.get("availableFrom")),
+        "availableEnd": to_timestamp(listing.get("availableTo")),
+    }
+
+
+def listing_window(listing):
+    """(start, end) epoch seconds of a listing, or None when either end is unknown."""
+    start = listing.get("availableStart")
+    end = listing.get("availableEnd")
+    if not isinstance(start, datetime) or not isinstance(end, datetime):
+        # Listings written before the timestamps existed
+        start, end = to_timestamp(listing.get("availableFrom")), to_timestamp(listing.get("availableTo"))
+        if start is None or end is None:
+            return None
+    start, end = to_timestamp(start).timestamp(), to_timestamp(end).timestamp()
+    return (start, end) if start <= end else None
+
+
+def request_window(start, end):
+    """(start, end) epoch seconds of a requested window; a missing side is open."""
+    return (
+        to_timestamp(start).timestamp() if start is not None else -math.inf,
+        to_timestamp(end).timestamp() if end is not None else math.inf,
+    )
+
+
+def overlap_seconds(window, wanted):
+    return min(window[1], wanted[1]) - max(window[0], wanted[0])
+
+
+def window_matches(window, wanted, mode, min_overlap_days=1):
+    if window is None:
+        return False
+    if mode == "covers":
+        return window[0] <= wanted[0] and window[1] >= wanted[1]
+    if mode == "within":
+        return window[0] >= wanted[0] and window[1] <= wanted[1]
+    return overlap_seconds(window, wanted) >= min_overlap_days * DAY_SECONDS
+
+
+def parse_mode(body):
+    """(mode, minOverlapDays) of a filter body. Raises ValueError."""
+    mode = body.get("availability") or DEFAULT_MODE
+    if mode not in MODES:
+        raise ValueError(f"availability must be one of {', '.join(MODES)}")
+    raw = body.get("minOverlapDays")
+    if raw in (None, ""):
+        return mode, 1
+    try:
+        days = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError("minOverlapDays must be an integer")
+    if days < 0:
+        raise ValueError("minOverlapDays must not be negative")
+    return mode, days
+
+
+class _Node:
+    __slots__ = ("key", "end", "priority", "left", "right", "max_end", "min_end")
+
+    def __init__(self, start, end, doc_id):
+        self.key = (start, doc_id)
+        self.end = end
+        self.priority = random.random()
+        self.left = self.right = None
+        self.max_end = self.min_end = end
+
+
+def _update(node):
+    node.max_end = node.min_end = node.end
+    for child in (node.left, node.right):
+        if child is not None:
+            if child.max_end > node.max_end:
+                node.max_end = child.max_end
+            if child.min_end < node.min_end:
+                node.min_end = child.min_end
+
+
+def _split(node, key):
+    """(nodes with keys < key, the rest)."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, rest = _split(node.right, key)
+        _update(node)
+        return node, rest
+    lower, node.left = _split(node.left, key)
+    _update(node)
+    return lower, node
+
+
+def _merge(lower, upper):
+    """Join two treaps, every key of `lower` below every key of `upper`."""
+    if lower is None:
+        return upper
+    if upper is None:
+        return lower
+    if lower.priority > upper.priority:
+        lower.right = _merge(lower.right, upper)
+        _update(lower)
+        return lower
+    upper.left = _merge(lower, upper.left)
+    _update(upper)
+    return upper
+
+
+def _delete(node, key):
+    if node is None:
+        return None
+    if node.key == key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _delete(node.left, key)
+    else:
+        node.right = _delete(node.right, key)
+    _update(node)
+    return node
+
+
+class IntervalIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._root = None
+
+    def on_change(self, change, doc_id, data):
+        with self._lock:
+            old = self._windows.pop(doc_id, None)
+            if old is not None:
+                self._root = _delete(self._root, (old[0], doc_id))
+            window = listing_window(data) if change != "REMOVED" and data is not None else None
+            if window is not None:
+                self._windows[doc_id] = window
+                node = _Node(window[0], window[1], doc_id)
+                lower, upper = _split(self._root, node.key)
+                self._root = _merge(_merge(lower, node), upper)
+
+    def _starting_by(self, latest_start, earliest_end):
+        """Windows with start <= latest_start and end >= earliest_end."""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.max_end < earliest_end:
+                continue
+            stack.append(node.left)
+            if node.key[0] <= latest_start:
+                stack.append(node.right)
+                if node.end >= earliest_end:
+                    yield node.key[0], node.end, node.key[1]
+
+    def _inside(self, earliest_start, latest_end):
+        """Windows with start >= earliest_start and end <= latest_end."""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.min_end > latest_end:
+                continue
+            stack.append(node.right)
+            if node.key[0] >= earliest_start:
+                stack.append(node.left)
+                if node.end <= latest_end:
+                    yield node.key[0], node.end, node.key[1]
+
+    def query(self, wanted, mode=DEFAULT_MODE, min_overlap_days=1, after=None):
+        """
+        Yield (overlap_seconds, doc_id) for the listings whose window matches
+        `wanted` in `mode`, longest overlap first (ties by id). `after` is the
+        last (overlap_seconds, doc_id) of the previous page.
+        """
+        lo, hi = wanted
+        min_overlap = min_overlap_days * DAY_SECONDS
+        with self._lock:
+            if mode == "covers":
+                found = self._starting_by(lo, hi)
+            elif mode == "within":
+                found = self._inside(lo, hi)
+            else:
+                found = self._starting_by(hi - min_overlap, lo + min_overlap)
+            heap = []
+            for start, end, doc_id in found:
+                overlap = (end if end < hi else hi) - (start if start > lo else lo)
+                # Overlap mode still drops windows shorter than min_overlap
+                if mode != "overlap" or overlap >= min_overlap:
+                    heap.append((-overlap, doc_id))
+        if after is not None:
+            cut = (-after[0], after[1])
+            heap = [key for key in heap if key > cut]
+        # Pages usually need only the first few; pop them instead of sorting all
+        heapify(heap)
+        while heap:
+            negative, doc_id = heappop(heap)
+            yield -negative, doc_id
+
+    def __len__(self):
+        return len(self._windows)
+
+
+interval_index = IntervalIndex()
@@ -0,0 +1,5 @@
+"""
+Benchmarks that run the backend against the in-memory store.
+
+Run them from the backend directory, e.g. `python -m bench.endpoints`.
+"""
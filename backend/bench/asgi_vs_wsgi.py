@@ -0,0 +1,167 @@
+"""
+Throughput and tail latency of the two deployment modes under load.
+
+Starts the app on the in-memory store twice, as `gunicorn app:app` with the
+Procfile's gthread worker and as `uvicorn asgi:app`, and drives the
+endpoints that asgi.py serves asynchronously (GET /messages and GET
+/messages/conversations) with 50 to 500 concurrent clients over real HTTP:
+
+    python -m bench.asgi_vs_wsgi --latency-ms 5 --concurrency 50 100 250 500
+
+The simulated Firestore latency matters here: the async mode only helps
+when requests spend their time waiting on Firestore round trips.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.common import BACKEND_DIR, load_app, percentile, seed
+
+MODES = {
+    "wsgi": ["gunicorn", "bench.asgi_vs_wsgi:wsgi_app()", "--worker-class", "gthread",
+             "--threads", "16", "--workers", "1", "--bind", "127.0.0.1:{port}"],
+    "asgi": ["uvicorn", "bench.asgi_vs_wsgi:asgi_app", "--factory", "--workers", "1",
+             "--host", "127.0.0.1", "--port", "{port}", "--log-level", "warning", "--no-access-log"],
+}
+
+
+#### Server side ####
+def _seeded_app():
+    app, db = load_app(float(os.environ.get("BENCH_LATENCY_MS", "0")))
+    fixtures = seed(db, int(os.environ.get("BENCH_SIZE", "10000")))
+    db.latency = float(os.environ.get("BENCH_LATENCY_MS", "0")) / 1000
+    return app, fixtures
+
+
+def wsgi_app():
+    app, _ = _seeded_app()
+    return app
+
+
+def asgi_app():
+    _seeded_app()
+    import asgi
+    return asgi.app
+
+
+#### Client side ####
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, size, latency_ms):
+    port = _free_port()
+    command = [sys.executable, "-m"] + [part.format(port=port) for part in MODES[mode]]
+    env = dict(os.environ, BENCH_SIZE=str(size), BENCH_LATENCY_MS=str(latency_ms))
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"{mode} server exited with {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return server, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def request_paths(count):
+    # Same fixtures as bench.common.seed: user 0 talks to users 1-10
+    busy = "student0@ufl.edu"
+    paths = []
+    for i in range(count):
+        if i % 2:
+            paths.append(f"/messages/conversations?user_email={busy}")
+        else:
+            paths.append(f"/messages?sender={busy}&receiver=student{1 + i % 10}@ufl.edu")
+    return paths
+
+
+async def drive(base_url, concurrency, requests):
+    paths = request_paths(requests)
+    latencies = []
+    errors = 0
+    next_index = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal next_index, errors
+            while next_index < len(paths):
+                path = paths[next_index]
+                next_index += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "throughputRps": round(len(latencies) / elapsed, 1),
+        "p50Ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99Ms": round(percentile(latencies, 99) * 1000, 2),
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 100, 250, 500])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    parser.add_argument("--size", type=int, default=10000, help="seeded listings and messages")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated latency per Firestore RPC")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=["wsgi", "asgi"])
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for mode in args.modes:
+        server, base_url = start_server(mode, args.size, args.latency_ms)
+        try:
+            # Warm-up round so lazily started caches don't count
+            asyncio.run(drive(base_url, 10, 100))
+            results[mode] = {}
+            for concurrency in args.concurrency:
+                summary = asyncio.run(drive(base_url, concurrency, max(args.requests, concurrency)))
+                results[mode][str(concurrency)] = summary
+                print(f"  {mode} c={concurrency:<4} {summary['throughputRps']:>8} req/s  "
+                      f"p50 {summary['p50Ms']:>8} ms  p99 {summary['p99Ms']:>8} ms  "
+                      f"errors {summary['errors']}", file=sys.stderr)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "meta": {"size": args.size, "latencyMs": args.latency_ms, "requests": args.requests},
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Shared helpers for the benchmarks: in-memory app setup, synthetic data and
+latency statistics.
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(latency_ms=0.0):
+    """Import the Flask app on top of a fresh in-memory store; returns (app, db)."""
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["MEMORY_STORE_LATENCY_MS"] = str(latency_ms)
+    # The benchmarks send far more than one client's share of requests
+    os.environ["RATE_LIMITS"] = "0"
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import app as app_module
+    return app_module.app, app_module.db
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, reads, rpcs, errors):
+    count = len(latencies)
+    return {
+        "requests": count,
+        "p50Ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99Ms": round(percentile(latencies, 99) * 1000, 3),
+        "throughputRps": round(count / elapsed, 1) if elapsed else None,
+        "readsPerRequest": round(reads / count, 2),
+        "rpcsPerRequest": round(rpcs / count, 2),
+        "errors": errors,
+    }
+
+
+def user_email(i):
+    return f"student{i}@ufl.edu"
+
+
+def synthetic_listing(i, rng, created_at):
+    from geo import location_fields
+
+    start = datetime(2025, 1, 1) + timedelta(days=rng.randrange(0, 240))
+    end = start + timedelta(days=rng.choice([30, 60, 90, 120, 180]))
+    title = (f"{rng.choice(['Cozy', 'Spacious', 'Modern', 'Quiet', 'Sunny'])} "
+             f"{rng.choice(['studio', '1BR', '2BR', '3BR', 'townhouse'])} near "
+             f"{rng.choice(['Midtown', 'Archer', 'Butler Plaza', 'Downtown', 'Campus'])} #{i}")
+    price = rng.randrange(400, 1800, 25)
+    address = (f"{rng.randrange(100, 4000)} {rng.choice(['W University Ave', 'SW 13th St', 'NW 17th St', 'SW Archer Rd'])}"
+               f", Gainesville")
+    return {
+        "title": title,
+        "price": price,
+        "address": address,
+        **location_fields(address),
+        "contactName": f"Student {i % 997}",
+        "contactEmail": user_email(i % 997),
+        "availableFrom": start.strftime("%Y-%m-%dT00:00:00.000Z"),
+        "availableTo": end.strftime("%Y-%m-%dT00:00:00.000Z"),
+        "parking": rng.choice(["included", "additional-fee", "none"]),
+        "furnished": rng.random() < 0.5,
+        "notes": "Utilities included. " * rng.randrange(0, 4),
+        "description": "Close to bus routes and grocery stores.",
+        "photos": [f"https://example.com/photos/{i}/{n}.jpg" for n in range(rng.randrange(1, 5))],
+        "createdAt": created_at,
+    }
+
+
+def seed(db, size, seed_value=7):
+    """
+    Load `size` listings and `size` messages (plus users and conversation
+    summaries) straight into the store. Returns a dict of handy fixture values.
+    """
+    from bulk_writes import WriteOp, bulk_write
+    from conversations import backfill_conversations, conversation_id
+
+    rng = random.Random(seed_value)
+    now = datetime.now(timezone.utc)
+    user_count = max(50, size // 100)
+
+    from auth import user_doc_id
+
+    # Keyed by email, as `flask migrate-user-ids` leaves them
+    users = db.collection("users")
+    bulk_write(db, (
+        WriteOp("set", users.document(user_doc_id(user_email(i))), {
+            "email": user_email(i),
+            "password": "seeded",
+            "firstName": "Student",
+            "lastName": str(i),
+            "createdAt": now,
+        }) for i in range(user_count)
+    ))
+
+    listings = db.collection("listings")
+    bulk_write(db, (
+        WriteOp("set", listings.document(f"listing-{i}"),
+                synthetic_listing(i, rng, now - timedelta(minutes=size - i)))
+        for i in range(size)
+    ))
+
+    messages = db.collection("messages")
+    # Messages cluster on a handful of busy pairs plus a long tail
+    pairs = [(user_email(0), user_email(j)) for j in range(1, 11)]
+
+    def message(i):
+        if rng.random() < 0.5:
+            a, b = rng.choice(pairs)
+        else:
+            a, b = user_email(rng.randrange(user_count)), user_email(rng.randrange(user_count))
+        if rng.random() < 0.5:
+            a, b = b, a
+        return {
+            "sender": a,
+            "receiver": b,
+            "conversationId": conversation_id(a, b),
+            "text": f"message {i}",
+            "timestamp": now - timedelta(seconds=size - i),
+            "read": rng.random() < 0.8,
+        }
+
+    bulk_write(db, (WriteOp("set", messages.document(f"message-{i}"), message(i)) for i in range(size)))
+    backfill_conversations(db)
+    db.stats.reset()
+    return {"busy_user": user_email(0), "busy_peer": user_email(1), "user_count": user_count}
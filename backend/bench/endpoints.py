@@ -0,0 +1,195 @@
+"""
+Per-endpoint latency benchmark against the in-memory store.
+
+Seeds synthetic datasets (1k, 10k and 100k listings and messages by
+default), drives every HTTP endpoint through the Flask test client and
+reports p50/p99 latency, throughput and Firestore document reads per
+request. Results can be saved as a JSON baseline and compared against a
+previous one to catch regressions:
+
+    python -m bench.endpoints --latency-ms 2 --output baseline.json
+    python -m bench.endpoints --latency-ms 2 --compare baseline.json
+
+Each dataset size runs in its own subprocess so the per-worker caches and
+listeners start cold for every size.
+"""
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import BACKEND_DIR, load_app, seed, summarize, user_email
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def scenarios(fixtures):
+    """(name, method, fn(i) -> (path, json_body)) in run order; later ones reuse earlier state."""
+    busy, peer = fixtures["busy_user"], fixtures["busy_peer"]
+    user_count = fixtures["user_count"]
+    created = []
+
+    def create_listing(i):
+        return "/listings", {
+            "title": f"Bench listing {i}", "price": 900, "address": "1 Bench St",
+            "contactName": "Bench", "contactEmail": busy, "parking": "none", "furnished": True,
+            "availableFrom": "2025-05-01T00:00:00.000Z", "availableTo": "2025-08-01T00:00:00.000Z",
+        }
+
+    return created, [
+        ("GET /health", "get", lambda i: ("/health", None)),
+        ("POST /listings", "post", create_listing),
+        ("GET /listings", "get", lambda i: ("/listings", None)),
+        ("GET /listings/<id>", "get", lambda i: (f"/listings/listing-{i}", None)),
+        ("PUT /listings/<id>", "put", lambda i: (f"/listings/listing-{i}", {"price": 1000 + i})),
+        ("GET /listings/user/<email>", "get",
+         lambda i: (f"/listings/user/{user_email(i % user_count)}", None)),
+        ("POST /listings/filter", "post", lambda i: ("/listings/filter", {
+            "title": "studio", "maxPrice": 1200, "furnished": True, "parking": "yes",
+            "startDate": "2025-02-01T00:00:00.000Z"})),
+        ("POST /listings/filter (radius)", "post", lambda i: ("/listings/filter", {
+            "radiusMiles": 1, "near": "campus", "maxPrice": 1200})),
+        ("POST /listings/filter (q)", "post", lambda i: ("/listings/filter", {"q": "cozy stu"})),
+        ("GET /listings/suggest", "get", lambda i: (f"/listings/suggest?q={['co', 'stu', 'mid', 'arch'][i % 4]}", None)),
+        ("POST /auth/register", "post", lambda i: ("/auth/register", {
+            "email": f"bench{i}@ufl.edu", "password": "benchpass", "firstName": "Bench"})),
+        ("POST /auth/login", "post", lambda i: ("/auth/login", {
+            "email": f"bench{i}@ufl.edu", "password": "benchpass"})),
+        ("GET /users/<email>", "get", lambda i: (f"/users/{user_email(i % user_count)}", None)),
+        ("PUT /users/<email>", "put", lambda i: (f"/users/{user_email(i % user_count)}", {"bio": f"bio {i}"})),
+        ("POST /messages", "post", lambda i: ("/messages", {
+            "sender_email": peer, "receiver_email": busy, "text": f"bench {i}"})),
+        ("GET /messages", "get", lambda i: (f"/messages?sender={busy}&receiver={peer}", None)),
+        ("GET /messages/conversations", "get", lambda i: (f"/messages/conversations?user_email={busy}", None)),
+        ("PUT /messages/read", "put", lambda i: ("/messages/read", {
+            "user_email": busy, "other_user_email": user_email(1 + i % 10)})),
+        ("DELETE /listings/<id>", "delete",
+         lambda i: (f"/listings/{created[i]}" if i < len(created) else "/listings/missing", None)),
+    ]
+
+
+def run_scenario(app, db, method, make_request, requests, concurrency, on_response=None):
+    """Time `requests` calls; returns the summary dict."""
+    client = app.test_client()
+    # One unmeasured call warms lazily started caches and listeners
+    path, body = make_request(requests)
+    getattr(client, method)(path, json=body)
+    before = db.stats.snapshot()
+
+    def call(i):
+        path, body = make_request(i)
+        started = time.perf_counter()
+        response = getattr(app.test_client(), method)(path, json=body)
+        elapsed = time.perf_counter() - started
+        if on_response is not None:
+            on_response(response)
+        return elapsed, response.status_code
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        outcomes = [call(i) for i in range(requests)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+    after = db.stats.snapshot()
+    errors = sum(1 for _, status in outcomes if status >= 400)
+    return summarize([latency for latency, _ in outcomes], elapsed,
+                     after["reads"] - before["reads"], after["rpcs"] - before["rpcs"], errors)
+
+
+def run_size(size, requests, concurrency, latency_ms):
+    app, db = load_app()
+    fixtures = seed(db, size)
+    db.latency = latency_ms / 1000
+    created, plan = scenarios(fixtures)
+
+    def remember_listing(response):
+        listing = (response.get_json(silent=True) or {}).get("listing")
+        if listing and listing.get("id"):
+            created.append(listing["id"])
+
+    results = {}
+    for name, method, make_request in plan:
+        hook = remember_listing if name == "POST /listings" else None
+        results[name] = run_scenario(app, db, method, make_request, requests, concurrency, hook)
+        print(f"  {size:>7} {name:<30} p50 {results[name]['p50Ms']:>9.2f} ms  "
+              f"p99 {results[name]['p99Ms']:>9.2f} ms  reads/req {results[name]['readsPerRequest']:>9}",
+              file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the list of regressions of `results` against `baseline`."""
+    regressions = []
+    for size, endpoints in results.items():
+        for name, current in endpoints.items():
+            previous = baseline.get("results", {}).get(size, {}).get(name)
+            if previous is None:
+                continue
+            for metric, slack in (("p99Ms", 1.0), ("readsPerRequest", 1.0)):
+                limit = previous[metric] * (1 + tolerance) + slack
+                if current[metric] > limit:
+                    regressions.append(f"{size} {name}: {metric} {previous[metric]} -> {current[metric]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--requests", type=int, default=100, help="measured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated latency per Firestore RPC")
+    parser.add_argument("--output", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # The app logs with print(); keep stdout for the JSON result
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run_size(args.sizes[0], args.requests, args.concurrency, args.latency_ms)
+        json.dump(results, sys.stdout)
+        return 0
+
+    results = {}
+    for size in args.sizes:
+        out = subprocess.run(
+            [sys.executable, "-m", "bench.endpoints", "--child", "--sizes", str(size),
+             "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+             "--latency-ms", str(args.latency_ms)],
+            cwd=BACKEND_DIR, check=True, stdout=subprocess.PIPE, text=True,
+        ).stdout
+        results[str(size)] = json.loads(out)
+
+    report = {
+        "meta": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latencyMs": args.latency_ms,
+            "python": platform.python_version(),
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
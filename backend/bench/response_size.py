@@ -0,0 +1,103 @@
+"""
+Response bytes and peak memory of large listing pages.
+
+Requests one `GET /listings?limit=N` page from the in-memory backend (read
+through the Firestore query path unless --replica) in a fresh process per
+variant, and reports the bytes sent and how much memory building them took:
+the peak of Python allocations while serving the request (tracemalloc) and
+the growth of the process's peak RSS. Variants:
+
+- buffered: the whole page built as one list and one jsonify'd body, as
+  every response was before serializers.py (STREAM_THRESHOLD raised past N);
+- streamed: the same page streamed as the listings are read;
+- card: streamed with only the fields a listing card renders (`fields=`);
+
+each sent as identity, gzip and br.
+
+    python -m bench.response_size --listings 10000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from bench.common import BACKEND_DIR
+
+CARD_FIELDS = "title,price,address,availableFrom,availableTo,photoUrls"
+VARIANTS = {
+    "buffered": {"stream": False, "fields": None},
+    "streamed": {"stream": True, "fields": None},
+    "card": {"stream": True, "fields": CARD_FIELDS},
+}
+ENCODINGS = ["identity", "gzip", "br"]
+
+RUN_SCRIPT = """
+import gc, json, resource, sys, tracemalloc
+from bench.common import load_app, seed
+size, stream, fields, encoding = json.loads(sys.argv[1])
+app, db = load_app()
+seed(db, size)
+import serializers
+if not stream:
+    serializers.STREAM_THRESHOLD = size + 1
+client = app.test_client()
+url = f"/listings?limit={size}" + (f"&fields={fields}" if fields else "")
+headers = {"Accept-Encoding": encoding}
+# Warm up imports and caches on a short page
+client.get("/listings?limit=20", headers=headers).close()
+gc.collect()
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+tracemalloc.start()
+response = client.get(url, headers=headers, buffered=False)
+sent = sum(len(chunk) for chunk in response.response)
+response.close()
+_, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"bytes": sent, "streamed": "Content-Length" not in response.headers,
+                  "encoding": response.headers.get("Content-Encoding", "identity"),
+                  "peakHeapMb": round(peak / 2**20, 1), "peakRssGrowthMb": round((rss_after - rss_before) / 1024, 1),
+                  "peakRssMb": round(rss_after / 1024, 1)}))
+"""
+
+
+def measure(size, variant, encoding, replica):
+    env = dict(os.environ, STORAGE_BACKEND="memory", POPULARITY_RANKER="0", RATE_LIMITS="0",
+               LISTINGS_REPLICA="1" if replica else "0", MAX_STREAM_LIMIT=str(size))
+    settings = VARIANTS[variant]
+    args = json.dumps([size, settings["stream"], settings["fields"], encoding])
+    out = subprocess.run([sys.executable, "-c", RUN_SCRIPT, args], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(size, replica):
+    results = {}
+    for variant in VARIANTS:
+        for encoding in ENCODINGS:
+            r = results[f"{variant}/{encoding}"] = measure(size, variant, encoding, replica)
+            print(f"  {variant:<9} {encoding:<9} {r['bytes'] / 2**20:>7.2f} MB sent  "
+                  f"peak heap {r['peakHeapMb']:>7} MB  peak RSS +{r['peakRssGrowthMb']:>6} MB "
+                  f"({r['peakRssMb']} MB)", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listings", type=int, default=10000, help="listings stored and returned in one page")
+    parser.add_argument("--replica", action="store_true", help="page from the listings replica instead")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.listings, args.replica)
+    report = {"meta": {"listings": args.listings, "replica": args.replica}, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Matching new listings against saved searches.
+
+Builds a SavedSearchIndex over synthetic saved searches (keywords, price
+ceilings, furnished/parking, date ranges and radius searches, in roughly
+the mix the filter page produces) and matches a stream of new listings
+against it, next to checking every saved search one by one. Both must find
+the same searches for every listing:
+
+    python -m bench.saved_search_matching --searches 1000 10000 50000
+"""
+import argparse
+import contextlib
+import json
+import random
+import sys
+import time
+
+from bench.common import BACKEND_DIR, synthetic_listing, user_email
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from listing_queries import parse_criteria  # noqa: E402
+from saved_searches import SavedSearchIndex, saved_search_matcher  # noqa: E402
+
+WORDS = ["cozy", "spacious", "modern", "quiet", "sunny", "studio", "1br", "2br", "3br", "townhouse",
+         "midtown", "archer", "butler", "downtown", "campus", "utilities", "bus", "grocery"]
+
+
+def synthetic_criteria(rng):
+    """One saved search's criteria, mixing the filters people combine."""
+    criteria = {}
+    kind = rng.random()
+    if kind < 0.45:
+        words = rng.sample(WORDS, rng.choice([1, 2, 2, 3]))
+        criteria["q"] = " ".join(words)
+    elif kind < 0.6:
+        criteria["furnished"] = True
+    elif kind < 0.7:
+        criteria["parking"] = rng.choice(["yes", "no"])
+    elif kind < 0.8:
+        criteria["radiusMiles"] = rng.choice([1, 2, 5])
+        criteria["near"] = {"lat": 29.6516 + rng.uniform(-0.03, 0.03), "lng": -82.3248 + rng.uniform(-0.03, 0.03)}
+    # Most searches also cap the price, and a price cap alone is common
+    if kind >= 0.8 or rng.random() < 0.6:
+        criteria["maxPrice"] = rng.randrange(500, 1300, 50)
+    if rng.random() < 0.3:
+        criteria["startDate"] = f"2025-{rng.randrange(1, 9):02d}-01"
+    return criteria
+
+
+def build(count, rng):
+    index = SavedSearchIndex()
+    searches = []
+    for i in range(count):
+        data = {"userEmail": user_email(i % 997), "name": f"search {i}", "criteria": synthetic_criteria(rng)}
+        index.on_change("ADDED", f"search-{i}", data)
+        searches.append((f"search-{i}", data["userEmail"], data["name"],
+                         saved_search_matcher(parse_criteria(data["criteria"]))))
+    return index, searches
+
+
+def brute_force(searches, listing):
+    return [(doc_id, email, name) for doc_id, email, name, matcher in searches if matcher(listing)]
+
+
+def timed(fn, listings):
+    started = time.perf_counter()
+    results = [fn(listing) for listing in listings]
+    return results, time.perf_counter() - started
+
+
+def run(search_counts, listing_count, seed_value):
+    results = {}
+    for count in search_counts:
+        rng = random.Random(seed_value)
+        started = time.perf_counter()
+        index, searches = build(count, rng)
+        build_seconds = time.perf_counter() - started
+        listings = [synthetic_listing(i, rng, None) for i in range(listing_count)]
+
+        indexed, indexed_seconds = timed(index.match, listings)
+        scanned, scan_seconds = timed(lambda listing: brute_force(searches, listing), listings)
+        mismatches = sum(sorted(a) != sorted(b) for a, b in zip(indexed, scanned))
+        stats = index.stats()
+        results[str(count)] = {
+            "buildMs": round(build_seconds * 1000, 1),
+            "unindexed": stats["unindexed"],
+            "matchesPerListing": round(sum(map(len, indexed)) / listing_count, 1),
+            "candidatesPerListing": round(stats["candidatesChecked"] / listing_count, 1),
+            "indexedListingsPerSec": round(listing_count / indexed_seconds, 1),
+            "scanListingsPerSec": round(listing_count / scan_seconds, 1),
+            "mismatches": mismatches,
+        }
+        r = results[str(count)]
+        print(f"  {count:>6} searches  matches/listing {r['matchesPerListing']:>7}  "
+              f"candidates/listing {r['candidatesPerListing']:>8}  "
+              f"listings/s {r['scanListingsPerSec']:>9} -> {r['indexedListingsPerSec']:<9}  "
+              f"mismatches {mismatches}", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--searches", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="saved search counts to try")
+    parser.add_argument("--listings", type=int, default=200, help="new listings matched per run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args.searches, args.listings, args.seed)
+    report = {"meta": {"listings": args.listings, "seed": args.seed}, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if all(r["mismatches"] == 0 for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
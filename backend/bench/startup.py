@@ -0,0 +1,158 @@
+"""
+Startup cost of the app under gunicorn.
+
+Measures, on the in-memory backend:
+
+- import time: `import app` in a fresh interpreter, and the first request
+  after it (which creates the Firestore client);
+- for gunicorn with and without preload_app: time from launch until the
+  server answers, and the resident (RSS) and proportional (PSS, which splits
+  copy-on-write pages between the processes sharing them) memory of the
+  master and of every worker after some traffic.
+
+    python -m bench.startup --workers 4 --runs 3
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from bench.common import BACKEND_DIR
+
+IMPORT_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get("/listings?limit=1")
+print(json.dumps({"importMs": (imported - started) * 1000,
+                  "firstRequestMs": (time.perf_counter() - imported) * 1000}))
+"""
+
+
+def _env(**extra):
+    env = dict(os.environ, STORAGE_BACKEND="memory", LISTINGS_REPLICA="0", POPULARITY_RANKER="0")
+    env.update({key: str(value) for key, value in extra.items()})
+    return env
+
+
+def import_times(runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=BACKEND_DIR, env=_env(),
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {key: round(statistics.median(s[key] for s in samples), 1) for key in samples[0]}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _memory_kb(pid):
+    """(rss, pss) of a process in kB, from /proc."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                values[name] = int(rest.split()[0])
+    return values["Rss"], values["Pss"]
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def gunicorn_run(preload, workers, warm_requests, timeout=60):
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/listings?limit=1"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env=_env(PORT=port, WEB_CONCURRENCY=workers, GUNICORN_PRELOAD=int(preload)),
+    )
+    try:
+        while True:
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError("gunicorn did not answer in time")
+            try:
+                urllib.request.urlopen(url, timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.01)
+        first_response = time.perf_counter() - started
+        # Wait for every worker to boot, then let each of them serve something
+        while len(_children(proc.pid)) < workers:
+            time.sleep(0.05)
+        for _ in range(warm_requests):
+            urllib.request.urlopen(url, timeout=5).read()
+        worker_memory = [_memory_kb(pid) for pid in _children(proc.pid)]
+        master_rss, master_pss = _memory_kb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    return {
+        "firstResponseMs": round(first_response * 1000, 1),
+        "masterRssMb": round(master_rss / 1024, 1),
+        "masterPssMb": round(master_pss / 1024, 1),
+        "workerRssMb": round(statistics.mean(rss for rss, _ in worker_memory) / 1024, 1),
+        "workerPssMb": round(statistics.mean(pss for _, pss in worker_memory) / 1024, 1),
+        "totalPssMb": round((master_pss + sum(pss for _, pss in worker_memory)) / 1024, 1),
+    }
+
+
+def run(workers, runs, warm_requests):
+    results = {"import": import_times(runs)}
+    print(f"  import {results['import']['importMs']} ms, first request "
+          f"{results['import']['firstRequestMs']} ms", file=sys.stderr)
+    for preload in (False, True):
+        samples = [gunicorn_run(preload, workers, warm_requests) for _ in range(runs)]
+        summary = {key: round(statistics.median(s[key] for s in samples), 1) for key in samples[0]}
+        name = "preload" if preload else "noPreload"
+        results[name] = summary
+        print(f"  {name:<10} first response {summary['firstResponseMs']:>7} ms  "
+              f"worker RSS {summary['workerRssMb']:>6} MB  PSS {summary['workerPssMb']:>6} MB  "
+              f"total PSS {summary['totalPssMb']:>6} MB", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--runs", type=int, default=3, help="launches per variant (medians are reported)")
+    parser.add_argument("--warm-requests", type=int, default=50, help="requests served before measuring memory")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.workers, args.runs, args.warm_requests)
+    report = {"meta": {"workers": args.workers, "runs": args.runs}, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Round trips and latency of the write endpoints.
+
+Compares PUT /listings/<id>, DELETE /listings/<id> and PUT /users/<email>
+with the read-modify-read sequence they used to run (get, write, get again)
+replayed directly against the same store, then lets several editors update
+one listing at once with If-Match to show that conflicting writes get 412
+instead of being lost:
+
+    python -m bench.write_paths --latency-ms 10 --requests 200
+"""
+import argparse
+import contextlib
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import load_app, seed, summarize, user_email
+
+
+def read_modify_read(db, kind, i, user_count):
+    """The get / write / get sequence the handlers ran before preconditions."""
+    if kind == "PUT /listings/<id>":
+        ref = db.collection("listings").document(f"listing-{i}")
+        ref.get()
+        ref.update({"price": 1000 + i})
+        ref.get().to_dict()
+    elif kind == "DELETE /listings/<id>":
+        ref = db.collection("listings").document(f"listing-{i}")
+        if ref.get().exists:
+            ref.delete()
+    else:
+        from auth import find_user
+        user = find_user(db, user_email(i % user_count))
+        user.reference.update({"bio": f"bio {i}"})
+        user.reference.get().to_dict()
+
+
+def endpoint_request(kind, i, user_count):
+    if kind == "PUT /listings/<id>":
+        return "put", f"/listings/listing-{i}", {"price": 1000 + i}
+    if kind == "DELETE /listings/<id>":
+        return "delete", f"/listings/listing-{i}", None
+    return "put", f"/users/{user_email(i % user_count)}", {"bio": f"bio {i}"}
+
+
+def measure(db, calls):
+    latencies, errors = [], 0
+    before = db.stats.snapshot()
+    started = time.perf_counter()
+    for call in calls:
+        call_started = time.perf_counter()
+        if call() >= 500:
+            errors += 1
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    after = db.stats.snapshot()
+    return summarize(latencies, elapsed, after["reads"] - before["reads"],
+                     after["rpcs"] - before["rpcs"], errors)
+
+
+def contention(app, listing_id, editors, rounds):
+    """`editors` clients race to update one listing with the version they last saw."""
+    statuses = {}
+
+    def edit(editor):
+        client = app.test_client()
+        for n in range(rounds):
+            etag = client.get(f"/listings/{listing_id}").headers["ETag"]
+            response = client.put(f"/listings/{listing_id}", json={"price": 500 + editor * 100 + n},
+                                  headers={"If-Match": etag})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=editors) as pool:
+        list(pool.map(edit, range(editors)))
+    return {str(status): count for status, count in sorted(statuses.items())}
+
+
+def run(size, requests, latency_ms, editors):
+    app, db = load_app()
+    fixtures = seed(db, size)
+    user_count = fixtures["user_count"]
+    client = app.test_client()
+    # Warm the listings replica so the endpoints see it
+    client.get("/listings/listing-0")
+    db.latency = latency_ms / 1000
+
+    results = {}
+    for kind in ("PUT /listings/<id>", "PUT /users/<email>", "DELETE /listings/<id>"):
+        # Separate halves of the listings for the two variants, so deletes hit live docs
+        old = measure(db, (
+            lambda i=i: read_modify_read(db, kind, i, user_count) or 200
+            for i in range(requests)))
+
+        def call(i):
+            method, path, body = endpoint_request(kind, i, user_count)
+            return getattr(client, method)(path, json=body).status_code
+
+        new = measure(db, (lambda i=i: call(i) for i in range(requests, 2 * requests)))
+        results[kind] = {"readModifyRead": old, "preconditions": new}
+        print(f"  {kind:<24} rpcs/req {old['rpcsPerRequest']:>5} -> {new['rpcsPerRequest']:<5} "
+              f"p50 {old['p50Ms']:>8.2f} -> {new['p50Ms']:<8.2f} ms", file=sys.stderr)
+
+    # The last listing, which none of the deletes above touched
+    results["contention"] = contention(app, f"listing-{size - 1}", editors, max(1, requests // editors))
+    print(f"  contention with {editors} editors: {results['contention']}", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2000, help="seeded listings and messages")
+    parser.add_argument("--requests", type=int, default=200, help="requests per variant")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="simulated latency per Firestore RPC")
+    parser.add_argument("--editors", type=int, default=4, help="concurrent editors in the contention run")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+    if args.size < 2 * args.requests:
+        parser.error("--size must be at least twice --requests")
+
+    # The app logs with print(); keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args.size, args.requests, args.latency_ms, args.editors)
+    report = {
+        "meta": {"size": args.size, "requests": args.requests, "latencyMs": args.latency_ms},
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Shared bulk-write path for multi-document updates.
+
+bulk_write() splits any number of writes into WriteBatch chunks of at most
+500 operations (Firestore's per-commit limit), commits the chunks
+concurrently on a small thread pool, retries transient failures with
+exponential backoff and returns the timing of every chunk. Each chunk is
+atomic on its own; a write set larger than one chunk is not, so a chunk that
+still fails doesn't stop the others and BulkWriteError reports which did.
+"""
+import contextvars
+import random
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions
+
+MAX_BATCH_SIZE = 500
+DEFAULT_WORKERS = 4
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.1
+
+RETRYABLE = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+)
+# Errors after which the commit was not applied. A commit that timed out or
+# failed internally may have been, so writes that must not apply twice
+# (increments) retry only these.
+NOT_APPLIED = (
+    exceptions.Aborted,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+)
+
+# kind is "create", "set", "update" or "delete"; merge only applies to "set",
+# option (a write precondition) to "update" and "delete"
+WriteOp = namedtuple("WriteOp", ["kind", "reference", "data", "merge", "option"], defaults=(None, False, None))
+
+
+class BulkWriteResult:
+    def __init__(self, chunks, seconds):
+        self.chunks = chunks
+        # Wall-clock time of the whole write; chunks overlap, so not the sum of theirs
+        self.seconds = seconds
+
+    @property
+    def writes(self):
+        return sum(chunk["writes"] for chunk in self.chunks)
+
+    def to_dict(self):
+        return {"writes": self.writes, "seconds": round(self.seconds, 6), "chunks": self.chunks}
+
+
+class BulkWriteError(Exception):
+    """
+    Chunks that still failed after their retries: `failed` is a list of
+    (ops, error) and `result` the BulkWriteResult of the chunks that committed.
+    """
+
+    def __init__(self, failed, result):
+        super().__init__(f"{len(failed)} write chunk(s) failed: {failed[0][1]}")
+        self.failed = failed
+        self.result = result
+
+
+def _queue(batch, op):
+    if op.kind == "create":
+        batch.create(op.reference, op.data)
+    elif op.kind == "set":
+        batch.set(op.reference, op.data, merge=op.merge)
+    elif op.kind == "update":
+        batch.update(op.reference, op.data, option=op.option)
+    elif op.kind == "delete":
+        batch.delete(op.reference, option=op.option)
+    else:
+        raise ValueError(f"Unknown write kind {op.kind!r}")
+
+
+def _commit_chunk(db, index, ops, max_attempts, base_delay, retryable):
+    started = time.perf_counter()
+    attempt = 1
+    while True:
+        batch = db.batch()
+        for op in ops:
+            _queue(batch, op)
+        try:
+            batch.commit()
+            break
+        except retryable:
+            if attempt >= max_attempts:
+                raise
+            # Full jitter keeps concurrent chunks from retrying in lockstep
+            time.sleep(random.uniform(0, base_delay * (2 ** (attempt - 1))))
+            attempt += 1
+    return {
+        "chunk": index,
+        "writes": len(ops),
+        "attempts": attempt,
+        "seconds": round(time.perf_counter() - started, 6),
+    }
+
+
+def _chunks(ops, size):
+    chunk = []
+    for op in ops:
+        chunk.append(op)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_write(db, ops, chunk_size=MAX_BATCH_SIZE, max_workers=DEFAULT_WORKERS,
+               max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, retryable=RETRYABLE):
+    """
+    Commit an iterable of WriteOp in chunks of at most `chunk_size`.
+    `ops` is consumed lazily and at most 2 * max_workers chunks are held at
+    once, so generators of any length stream through in bounded memory.
+    A chunk is retried up to `max_attempts` times on the `retryable` errors
+    (NOT_APPLIED for writes that must not apply twice). Returns a
+    BulkWriteResult; raises BulkWriteError once every chunk has been tried
+    if any failed. max_workers=0 commits the chunks one by one in the
+    calling thread (at interpreter exit, when no thread may start).
+    """
+    chunk_size = min(chunk_size, MAX_BATCH_SIZE)
+    started = time.perf_counter()
+    results = []
+    failed = []
+
+    def collect(chunk, outcome):
+        try:
+            results.append(outcome())
+        except Exception as e:
+            failed.append((chunk, e))
+
+    if max_workers == 0:
+        for index, chunk in enumerate(_chunks(ops, chunk_size)):
+            collect(chunk, lambda: _commit_chunk(db, index, chunk, max_attempts, base_delay, retryable))
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            in_flight = deque()
+            for index, chunk in enumerate(_chunks(ops, chunk_size)):
+                if len(in_flight) >= 2 * max_workers:
+                    collect(*in_flight.popleft())
+                # Run in a copy of the caller's context so commits are attributed to its request
+                future = pool.submit(contextvars.copy_context().run, _commit_chunk,
+                                     db, index, chunk, max_attempts, base_delay, retryable)
+                in_flight.append((chunk, future.result))
+            while in_flight:
+                collect(*in_flight.popleft())
+    result = BulkWriteResult(results, time.perf_counter() - started)
+    if failed:
+        raise BulkWriteError(failed, result)
+    return result
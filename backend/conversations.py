@@ -0,0 +1,319 @@
+"""
+Denormalized per-pair conversation summaries.
+
+Every pair of users that has exchanged messages gets one document in the
+"conversations" collection, keyed by a canonical conversation ID:
+
+    participants   [email_a, email_b], sorted
+    lastMessage    text of the newest message
+    lastSender     sender of the newest message
+    lastTimestamp  timestamp of the newest message
+    unread0        unread messages received by participants[0]
+    unread1        unread messages received by participants[1]
+
+send_message and mark_messages_read update the summary in the same write
+batch as the messages, so the inbox is one ordered query over this
+collection instead of a scan of every message. A read batch only applies if
+none of its messages changed since they were queried, so two overlapping
+mark-read calls take each message off the counter once.
+
+Messages carry the same ID in their conversationId field, so a
+conversation's history is one query ordered by timestamp, read backwards a
+page at a time from the newest message. Past the oldest message still in
+the collection, pages continue from the archive (message_archive.py).
+"""
+import hashlib
+
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition
+
+from bulk_writes import MAX_BATCH_SIZE, NOT_APPLIED, BulkWriteError, WriteOp, bulk_write
+from message_archive import archive_query, archive_reads_total, archived_page, chunk_limit, is_archived
+from pagination import encode_cursor
+from preconditions import MAX_ATTEMPTS
+
+SUMMARY_COLLECTION = "conversations"
+# User fields embedded in an inbox entry with include=profiles
+PROFILE_FIELDS = ("firstName", "lastName", "profilepic")
+
+
+def conversation_id(a, b):
+    """Canonical, order-independent ID for the conversation between a and b."""
+    return hashlib.sha1("\n".join(sorted([a, b])).encode()).hexdigest()
+
+
+def participants(a, b):
+    return sorted([a, b])
+
+
+def unread_field(pair, receiver):
+    return f"unread{pair.index(receiver)}"
+
+
+def unread_count(summary, pair, receiver):
+    """receiver's unread counter in a summary, which read_op can leave below 0."""
+    return max(0, summary.get(unread_field(pair, receiver), 0))
+
+
+def summary_ref(db, a, b):
+    return db.collection(SUMMARY_COLLECTION).document(conversation_id(a, b))
+
+
+def record_sent(batch, db, msg):
+    """Queue the summary update for a newly sent message on `batch`."""
+    pair = participants(msg["sender"], msg["receiver"])
+    batch.set(summary_ref(db, msg["sender"], msg["receiver"]), {
+        "participants": pair,
+        "lastMessage": msg["text"],
+        "lastSender": msg["sender"],
+        "lastTimestamp": msg["timestamp"],
+        unread_field(pair, msg["receiver"]): firestore.Increment(1),
+    }, merge=True)
+
+
+def read_op(db, user_email, other_user_email, count):
+    """
+    The write that takes the `count` messages just marked read off
+    user_email's unread counter. Messages sent since they were queried keep
+    their increments, which resetting the counter to 0 would lose. A chunk
+    of those marks that fails after this commits can leave it below 0, so
+    it is read through unread_count().
+    """
+    pair = participants(user_email, other_user_email)
+    return WriteOp("set", summary_ref(db, user_email, other_user_email), {
+        "participants": pair,
+        unread_field(pair, user_email): firestore.Increment(-count),
+    }, merge=True)
+
+
+class MarkReadFailed(Exception):
+    """Some chunks of a mark-read failed; `marked` messages were marked before that."""
+
+    def __init__(self, marked, error):
+        super().__init__(str(error))
+        self.marked = marked
+
+
+def read_ops(db, user_email, other_user_email, docs):
+    """
+    Writes marking the unread message snapshots `docs` read: chunks of
+    MAX_BATCH_SIZE - 1 updates, each conditional on the message's version,
+    followed by the read_op for exactly those messages.
+    """
+    group = MAX_BATCH_SIZE - 1
+    for start in range(0, len(docs), group):
+        chunk = docs[start:start + group]
+        for doc in chunk:
+            yield WriteOp("update", doc.reference, {"read": True},
+                          option=db.write_option(last_update_time=doc.update_time))
+        yield read_op(db, user_email, other_user_email, len(chunk))
+
+
+def mark_read(db, user_email, other_user_email, docs):
+    """
+    Mark the unread messages `docs` read and take them off user_email's
+    unread counter. A chunk whose messages another call changed first fails
+    its precondition as a whole; its messages are read again and those
+    still unread retried. The decrement must not apply twice, so only
+    chunks that surely did not commit are retried. Returns the number of
+    messages this call marked; raises MarkReadFailed.
+    """
+    marked = 0
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            # Read chunks line up with bulk_write's chunks
+            result = bulk_write(db, read_ops(db, user_email, other_user_email, docs),
+                                chunk_size=MAX_BATCH_SIZE, retryable=NOT_APPLIED)
+            return marked + result.writes - len(result.chunks)
+        except BulkWriteError as e:
+            marked += e.result.writes - len(e.result.chunks)
+            if attempt == MAX_ATTEMPTS - 1 or not all(isinstance(error, FailedPrecondition) for _, error in e.failed):
+                raise MarkReadFailed(marked, e) from e
+            # Every failed chunk ends with its read_op
+            refs = [op.reference for chunk, _ in e.failed for op in chunk[:-1]]
+            docs = [doc for doc in db.get_all(refs) if doc.exists and doc.to_dict().get("read") is False]
+
+
+def to_inbox_entry(summary, user_email):
+    """Shape a summary document as the inbox entry returned to user_email."""
+    pair = summary.get("participants", [])
+    other = next((p for p in pair if p != user_email), user_email)
+    timestamp = summary.get("lastTimestamp")
+    return {
+        "other_user_email": other,
+        "last_message": summary.get("lastMessage", ""),
+        "last_timestamp": timestamp or "",
+        "unread_count": unread_count(summary, pair, user_email) if user_email in pair else 0,
+    }
+
+
+def inbox_query(db, user_email, cursor, limit):
+    """Query for one page of user_email's conversation summaries, most recent first."""
+    query = (
+        db.collection(SUMMARY_COLLECTION)
+          .where("participants", "array_contains", user_email)
+          .order_by("lastTimestamp", direction="DESCENDING")
+          .order_by("__name__", direction="DESCENDING")
+    )
+    if cursor is not None:
+        query = query.start_after({"lastTimestamp": cursor[0], "__name__": cursor[1]})
+    return query.limit(limit)
+
+
+def inbox_result(docs, user_email, limit):
+    """Shape the summaries returned by inbox_query as the inbox response."""
+    entries = [to_inbox_entry(doc.to_dict(), user_email) for doc in docs]
+    next_cursor = None
+    if len(docs) == limit:
+        next_cursor = encode_cursor([docs[-1].to_dict().get("lastTimestamp"), docs[-1].id])
+    return {"conversations": entries, "nextCursor": next_cursor}
+
+
+def embed_profiles(inbox, users):
+    """
+    Add "other_user" to each entry of an inbox response: the profile summary
+    of that participant from `users` (email -> user document dict), or None.
+    """
+    for entry in inbox["conversations"]:
+        user = users.get(entry["other_user_email"])
+        entry["other_user"] = None if user is None else {
+            "email": entry["other_user_email"],
+            **{field: user.get(field) for field in PROFILE_FIELDS},
+        }
+    return inbox
+
+
+def inbox_page(db, user_email, cursor, limit):
+    """One page of user_email's conversations, most recent first."""
+    docs = list(inbox_query(db, user_email, cursor, limit).stream())
+    return inbox_result(docs, user_email, limit)
+
+
+def history_query(db, a, b, before, limit):
+    """
+    Query for the `limit` messages between a and b that precede the `before`
+    cursor (the newest ones when None), oldest first.
+    """
+    query = (
+        db.collection("messages")
+          .where("conversationId", "==", conversation_id(a, b))
+          .order_by("timestamp")
+          .order_by("__name__")
+    )
+    if before is not None:
+        query = query.end_before({"timestamp": before[0], "__name__": before[1]})
+    # limit_to_last queries can't be streamed; run them with get()
+    return query.limit_to_last(limit)
+
+
+def history_result(docs, limit):
+    """Shape the messages returned by history_query as the history response."""
+    msgs = []
+    for doc in docs:
+        msg_data = doc.to_dict()
+        msg_data["id"] = doc.id
+        msgs.append(msg_data)
+    before = None
+    if len(docs) == limit:
+        before = encode_cursor([docs[0].to_dict().get("timestamp"), docs[0].id])
+    return {"messages": msgs, "before": before}
+
+
+def archive_boundary(result, before):
+    """
+    The cursor archived messages must precede: the oldest message of a
+    history page that ran out of hot messages, else `before`.
+    """
+    if result["messages"]:
+        oldest = result["messages"][0]
+        return [oldest.get("timestamp"), oldest["id"]]
+    return before[:2] if before is not None else None
+
+
+def with_archived(result, chunks, boundary, limit):
+    """Fill a history page that ran out of hot messages from the archive chunks of archive_query."""
+    needed = limit - len(result["messages"])
+    chunks = list(chunks)
+    older = archived_page(chunks, boundary, needed)
+    msgs = older + result["messages"]
+    if older:
+        archive_reads_total.inc()
+    before = None
+    # A page cut short by small chunks still has more before it
+    if older and (len(msgs) == limit or len(chunks) == chunk_limit(needed)):
+        # The third value marks a cursor into the archive, so the next page skips the hot query
+        before = encode_cursor([msgs[0].get("timestamp"), msgs[0]["id"], 1])
+    return {"messages": msgs, "before": before}
+
+
+def history_page(db, a, b, before, limit):
+    """One page of the conversation between a and b, scrolling back from `before`."""
+    docs = [] if is_archived(before) else history_query(db, a, b, before, limit).get()
+    result = history_result(docs, limit)
+    if len(docs) < limit:
+        boundary = archive_boundary(result, before)
+        needed = limit - len(docs)
+        chunks = archive_query(db, conversation_id(a, b), boundary, needed).stream()
+        result = with_archived(result, chunks, boundary, limit)
+    return result
+
+
+def backfill_conversations(db):
+    """
+    Rebuild every conversation summary from the messages collection.
+    Streams the messages once and writes the summaries in bulk;
+    returns the BulkWriteResult.
+    """
+    summaries = {}
+    for doc in db.collection("messages").stream():
+        msg = doc.to_dict()
+        sender, receiver = msg.get("sender"), msg.get("receiver")
+        if not sender or not receiver:
+            continue
+        key = conversation_id(sender, receiver)
+        pair = participants(sender, receiver)
+        summary = summaries.setdefault(key, {"participants": pair, "unread0": 0, "unread1": 0})
+        timestamp = msg.get("timestamp")
+        if timestamp is not None and ("lastTimestamp" not in summary or timestamp > summary["lastTimestamp"]):
+            summary["lastMessage"] = msg.get("text", "")
+            summary["lastSender"] = sender
+            summary["lastTimestamp"] = timestamp
+        if msg.get("read") is False:
+            summary[unread_field(pair, receiver)] += 1
+
+    collection = db.collection(SUMMARY_COLLECTION)
+    return bulk_write(db, (
+        WriteOp("set", collection.document(key), summary) for key, summary in summaries.items()
+    ))
+
+
+def backfill_conversation_ids(db, page_size=1000):
+    """
+    Tag every message that has no conversationId, walking the collection
+    in pages by document ID so no single query runs for long.
+    Returns (messages scanned, messages updated).
+    """
+    collection = db.collection("messages")
+    scanned = updated = 0
+    last = None
+    while True:
+        query = collection.select(["sender", "receiver", "conversationId"]).order_by("__name__")
+        if last is not None:
+            query = query.start_after(last)
+        docs = list(query.limit(page_size).stream())
+        ops = []
+        for doc in docs:
+            msg = doc.to_dict()
+            sender, receiver = msg.get("sender"), msg.get("receiver")
+            if not sender or not receiver:
+                continue
+            key = conversation_id(sender, receiver)
+            if msg.get("conversationId") != key:
+                ops.append(WriteOp("update", doc.reference, {"conversationId": key}))
+        if ops:
+            bulk_write(db, ops)
+        scanned += len(docs)
+        updated += len(ops)
+        if len(docs) < page_size:
+            return scanned, updated
+        last = docs[-1]
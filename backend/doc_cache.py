@@ -0,0 +1,170 @@
+"""
+Bounded read-through cache for single-document reads.
+
+Entries live in a cachetools TTLCache (least-recently-used eviction once
+full, plus a time-to-live) and hold the JSON-ready document together with a
+strong ETag computed from its content. Writes invalidate their key, and so
+that edits made through other workers are picked up without waiting for the
+TTL, listing entries are also invalidated by the listings replica's change
+events and user entries by a ChangeFeed on the users collection.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from cachetools import TTLCache
+
+CACHE_SIZE = int(os.environ.get("DOC_CACHE_SIZE", "2048"))
+CACHE_TTL = float(os.environ.get("DOC_CACHE_TTL", "30"))
+# Field every write to a ChangeFeed's collection sets to SERVER_TIMESTAMP
+UPDATED_FIELD = "updatedAt"
+# Allowed difference between this process's clock and Firestore's
+FEED_CLOCK_SKEW = timedelta(seconds=5)
+# Wait between attempts to (re)open a change feed, doubling up to the max
+FEED_RETRY_SECONDS = 1.0
+FEED_RETRY_MAX_SECONDS = 60.0
+
+log = logging.getLogger(__name__)
+
+
+def compute_etag(value):
+    """Strong ETag: a hash of the canonical JSON encoding of the response body."""
+    raw = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+class _CountingTTLCache(TTLCache):
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+
+class DocCache:
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self._cache = _CountingTTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with a write is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, loader, versioned=False):
+        """
+        Return (value, etag) for `key`, calling loader() on a miss. loader
+        returns the JSON-ready document or None when it does not exist;
+        missing documents are not cached. With versioned=True loader returns
+        (document, version) instead and the version is used as the ETag.
+        """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+        if versioned:
+            value, etag = loader()
+        else:
+            value = loader()
+            etag = compute_etag(value) if value is not None else None
+        if value is None:
+            return None, None
+        entry = (value, etag)
+        with self._lock:
+            if generation == self._generation:
+                self._cache[key] = entry
+        return entry
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+                "ttlSeconds": self._cache.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self._cache.evictions,
+                "expirations": self._cache.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+doc_cache = DocCache()
+
+
+class ChangeFeed:
+    """
+    Invalidates the cached documents of a collection whenever any worker
+    writes one. Every such write sets UPDATED_FIELD to SERVER_TIMESTAMP, and
+    the listener only watches documents updated since it started, so it
+    costs a read per write instead of loading the collection. key(snapshot)
+    gives the cache key of a changed document.
+    """
+
+    def __init__(self, collection, key, cache=doc_cache):
+        self._collection = collection
+        self._key = key
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._watch = None
+        self._pid = None
+        self._retry_at = 0.0
+        self._retry_delay = FEED_RETRY_SECONDS
+
+    def ensure_started(self, db):
+        """
+        Open the listener once per process (after gunicorn forks), again if
+        it died, at most once per backoff interval while that keeps failing.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._watch, self._pid, self._retry_at = None, os.getpid(), 0.0
+            if self._watch is not None and getattr(self._watch, "is_active", True):
+                return
+            now = time.monotonic()
+            if now < self._retry_at:
+                return
+            # The next attempt waits longer unless this one stays up
+            self._retry_at = now + self._retry_delay
+            since = datetime.now(timezone.utc) - FEED_CLOCK_SKEW
+            query = db.collection(self._collection).where(UPDATED_FIELD, ">", since)
+            try:
+                self._watch = query.on_snapshot(self._on_snapshot)
+            except Exception as e:
+                # Entries then only expire with the TTL
+                self._watch = None
+                self._retry_delay = min(self._retry_delay * 2, FEED_RETRY_MAX_SECONDS)
+                log.debug(f"Change feed on {self._collection} failed to start: {e}")
+                return
+            self._retry_delay = FEED_RETRY_SECONDS
+
+    def _on_snapshot(self, docs, changes, read_time):
+        for change in changes:
+            self._cache.invalidate(self._key(change.document))
@@ -1,21 +1,122 @@
+"""
+The Firestore client, created lazily and once per process.
+
+`db` is a stand-in that builds the real client on first use, so importing
+the app opens no gRPC channel. gRPC channels must not cross a fork, which
+makes this what lets gunicorn preload the app (gunicorn.conf.py): the
+master imports everything and parses the credentials once, and each worker
+builds its own client after the fork. The threads of one worker share its
+client and its channel. A client inherited through a fork that didn't go
+through post_fork is noticed by its pid and replaced.
+"""
 import os
+import threading
 import firebase_admin
 import json
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOCAL_KEY_PATH = os.path.join(BASE_DIR, "serviceAccountKey.json")
 
-if os.path.exists(LOCAL_KEY_PATH):
-    # Local development
-    cred = credentials.Certificate(LOCAL_KEY_PATH)
-else:
-    # Render / Production
-    google_creds = os.environ.get("GOOGLE_CREDENTIALS")
-    if not google_creds:
-        raise Exception("GOOGLE_CREDENTIALS environment variable is missing")
+# "firestore" talks to the real project; "memory" uses the in-memory engine
+# from memory_store.py (benchmarks, load tests, local runs without credentials)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "firestore")
+if STORAGE_BACKEND not in ("firestore", "memory"):
+    raise Exception(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+
+
+def load_credentials():
+    """Parse the service account once; fork-safe, so the gunicorn master does it."""
+    try:
+        return firebase_admin.get_app().credential
+    except ValueError:
+        pass
+    if os.path.exists(LOCAL_KEY_PATH):
+        # Local development
+        cred = credentials.Certificate(LOCAL_KEY_PATH)
+    else:
+        # Render / Production
+        google_creds = os.environ.get("GOOGLE_CREDENTIALS")
+        if not google_creds:
+            raise Exception("GOOGLE_CREDENTIALS environment variable is missing")
+
+        cred = credentials.Certificate(json.loads(google_creds))
+
+    firebase_admin.initialize_app(cred)
+    return cred
+
+
+def firestore_client():
+    # Built directly rather than with firebase_admin.firestore.client(), which
+    # caches one client per app and would hand a forked worker its parent's
+    from google.cloud import firestore
+    cred = load_credentials()
+    return firestore.Client(project=cred.project_id, credentials=cred.get_credential())
+
+
+def memory_client():
+    from memory_store import MemoryClient
+    # Simulated round-trip time added to every RPC
+    latency_ms = float(os.environ.get("MEMORY_STORE_LATENCY_MS", "0"))
+    return MemoryClient(latency=latency_ms / 1000)
+
+
+def _create_client():
+    client = memory_client() if STORAGE_BACKEND == "memory" else firestore_client()
+    # Count reads, writes and queries per route for /metrics (metrics.py)
+    if os.environ.get("FIRESTORE_METRICS", "1") != "0":
+        from metrics import instrument
+        client = instrument(client)
+    return client
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """This process's Firestore client, created on first use."""
+    global _client, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = _create_client()
+            _client_pid = os.getpid()
+        return _client
+
+
+def reset_client():
+    """Forget the client without closing it (it may belong to the parent process)."""
+    global _client, _client_pid
+    with _client_lock:
+        _client, _client_pid = None, None
+
+
+class LazyClient:
+    """Forwards everything to get_client()."""
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_client(), name, value)
+
+    def __repr__(self):
+        return f"<lazy {get_client()!r}>" if _client is not None else "<lazy Firestore client>"
+
+
+db = LazyClient()
 
-    cred = credentials.Certificate(json.loads(google_creds))
 
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+def async_client():
+    """Firestore AsyncClient on the same backend as `db`, for asgi.py."""
+    if STORAGE_BACKEND == "memory":
+        from memory_store import AsyncMemoryClient
+        from metrics import unwrap
+        return AsyncMemoryClient(unwrap(get_client()))
+    from google.cloud import firestore
+    cred = load_credentials()
+    return firestore.AsyncClient(project=cred.project_id, credentials=cred.get_credential())
@@ -0,0 +1,307 @@
+"""
+Geocoding, geohashes and radius search for listings.
+
+Listings are geocoded when they are written and store
+
+    location   {"lat": ..., "lng": ...}
+    geohash    base-32 geohash of the location (GEOHASH_PRECISION characters)
+
+A radius search covers the circle with at most nine geohash cells, runs one
+prefix range query per cell (a range over the single-field geohash index),
+then keeps the candidates whose haversine distance is within the radius.
+The work grows with the listings near the point, not with the collection.
+
+Addresses are resolved by GEOCODER: "offline" (default) is a local stand-in
+that understands the Gainesville street grid; "module:function" plugs in any
+callable that maps an address to (lat, lng) or None.
+"""
+import importlib
+import logging
+import math
+import os
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+EARTH_RADIUS_MILES = 3958.8
+GEOHASH_PRECISION = 9
+MAX_RADIUS_MILES = 50.0
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# University of Florida, the default "near" point
+CAMPUS = (29.6436, -82.3549)
+
+
+#### Geohash ####
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, interval = (lng, lng_range) if even else (lat, lat_range)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def _cell_size(precision):
+    """(lat_degrees, lng_degrees) covered by one geohash cell."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def haversine_miles(a, b):
+    lat1, lng1, lat2, lng2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(h)))
+
+
+def query_bounds(center, radius_miles):
+    """
+    Sorted, non-overlapping (start, end) geohash ranges that together cover
+    every point within radius_miles of center.
+    """
+    lat, lng = center
+    miles_per_lng_degree = 69.0 * max(math.cos(math.radians(lat)), 0.01)
+    # Finest precision whose cells are at least as large as the radius, so the
+    # center cell and its eight neighbours cover the circle
+    precision = 1
+    for p in range(GEOHASH_PRECISION, 0, -1):
+        dlat, dlng = _cell_size(p)
+        if dlat * 69.0 >= radius_miles and dlng * miles_per_lng_degree >= radius_miles:
+            precision = p
+            break
+    dlat, dlng = _cell_size(precision)
+    prefixes = set()
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            cell_lat = max(-89.999999, min(89.999999, lat + i * dlat))
+            cell_lng = (lng + j * dlng + 180.0) % 360.0 - 180.0
+            prefixes.add(encode_geohash(cell_lat, cell_lng, precision))
+    # "~" sorts after every geohash character
+    return [(prefix, prefix + "~") for prefix in sorted(prefixes)]
+
+
+#### Geocoding ####
+# Gainesville's grid: numbered streets run north-south and count blocks east or
+# west of Main St; numbered avenues, roads, places and lanes run east-west and
+# count blocks north or south of University Ave. House numbers are 100 per block.
+GRID_ORIGIN = (29.6516, -82.3248)
+BLOCK_LAT = 0.00094
+BLOCK_LNG = 0.00108
+_EAST_WEST = {"ave", "avenue", "rd", "road", "pl", "place", "ln", "lane", "blvd"}
+_NORTH_SOUTH = {"st", "street", "ter", "terrace", "dr", "drive", "way", "ct", "court"}
+# Named roads as (orientation, signed block offset from the grid axis)
+_NAMED_ROADS = {
+    "university": ("ew", 0),
+    "main": ("ns", 0),
+    "archer": ("ew", -24),
+    "newberry": ("ew", 8),
+    "hawthorne": ("ew", -2),
+    "depot": ("ew", -6),
+    "williston": ("ew", -42),
+    "waldo": ("ns", 15),
+}
+_ADDRESS = re.compile(
+    r"^\s*(?P<number>\d+)\s+(?:(?P<quadrant>NW|NE|SW|SE|N|S|E|W)\s+)?"
+    r"(?P<name>\d+|[a-z]+)(?:st|nd|rd|th)?\s+(?P<kind>[a-z]+)\b",
+    re.IGNORECASE,
+)
+
+
+def offline_geocode(address):
+    """Approximate (lat, lng) for a Gainesville street address, or None."""
+    match = _ADDRESS.match((address or "").split(",")[0])
+    if not match:
+        return None
+    number = int(match.group("number"))
+    quadrant = (match.group("quadrant") or "").upper()
+    name = match.group("name").lower()
+    kind = match.group("kind").lower()
+
+    if name.isdigit():
+        if kind in _EAST_WEST:
+            orientation = "ew"
+        elif kind in _NORTH_SOUTH:
+            orientation = "ns"
+        else:
+            return None
+        offset = int(name)
+        if orientation == "ew" and "S" in quadrant:
+            offset = -offset
+        if orientation == "ns" and "W" in quadrant:
+            offset = -offset
+    elif name in _NAMED_ROADS:
+        orientation, offset = _NAMED_ROADS[name]
+    else:
+        return None
+
+    # The house number gives the position along the road, signed by quadrant
+    along = number / 100.0
+    if orientation == "ew":
+        if "W" in quadrant:
+            along = -along
+        return GRID_ORIGIN[0] + offset * BLOCK_LAT, GRID_ORIGIN[1] + along * BLOCK_LNG
+    if "S" in quadrant:
+        along = -along
+    return GRID_ORIGIN[0] + along * BLOCK_LAT, GRID_ORIGIN[1] + offset * BLOCK_LNG
+
+
+def _load_resolver(spec):
+    if spec == "offline":
+        return offline_geocode
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+_resolver = _load_resolver(os.environ.get("GEOCODER", "offline"))
+
+
+@lru_cache(maxsize=4096)
+def geocode(address):
+    """(lat, lng) for an address through the configured resolver, or None."""
+    if not address:
+        return None
+    try:
+        point = _resolver(address)
+    except Exception as e:
+        log.warning(f"Geocoding failed for {address!r}: {e}")
+        return None
+    return (float(point[0]), float(point[1])) if point else None
+
+
+def location_fields(address):
+    """The location/geohash fields to store for a listing at `address`."""
+    point = geocode((address or "").strip())
+    if point is None:
+        return {"location": None, "geohash": None}
+    return {"location": {"lat": point[0], "lng": point[1]}, "geohash": encode_geohash(*point)}
+
+
+def listing_point(listing):
+    location = listing.get("location")
+    if not isinstance(location, dict):
+        return None
+    lat, lng = location.get("lat"), location.get("lng")
+    if not isinstance(lat, (int, float)) or not isinstance(lng, (int, float)):
+        return None
+    return lat, lng
+
+
+def parse_near(value):
+    """
+    Resolve a "near" filter value: "campus" (or empty), {"lat", "lng"}, or an
+    address. Raises ValueError when it cannot be resolved.
+    """
+    if value in (None, "", "campus"):
+        return CAMPUS
+    if isinstance(value, dict):
+        try:
+            lat, lng = float(value["lat"]), float(value["lng"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("near must have numeric lat and lng")
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError("near is out of range")
+        return lat, lng
+    point = geocode(str(value).strip())
+    if point is None:
+        raise ValueError("Could not locate the near address")
+    return point
+
+
+def parse_radius(value):
+    """radiusMiles as a float in (0, MAX_RADIUS_MILES], or None when absent."""
+    if value in (None, ""):
+        return None
+    try:
+        radius = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("radiusMiles must be a number")
+    if not (0 < radius <= MAX_RADIUS_MILES):
+        raise ValueError(f"radiusMiles must be between 0 and {MAX_RADIUS_MILES:g}")
+    return radius
+
+
+#### Radius search ####
+class GeoIndex:
+    """
+    Sorted (geohash, id) keys of the replicated listings, kept current by a
+    listings replica listener, so radius searches bisect instead of scanning.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def on_change(self, change, doc_id, data):
+        with self._lock:
+            old = self._hashes.pop(doc_id, None)
+            if old is not None:
+                index = bisect_left(self._keys, (old, doc_id))
+                if index < len(self._keys) and self._keys[index] == (old, doc_id):
+                    del self._keys[index]
+            geohash = (data or {}).get("geohash") if change != "REMOVED" else None
+            if isinstance(geohash, str) and geohash:
+                self._hashes[doc_id] = geohash
+                insort(self._keys, (geohash, doc_id))
+
+    def candidates(self, bounds):
+        """IDs of listings whose geohash falls in any of the (start, end) ranges."""
+        ids = []
+        with self._lock:
+            for start, end in bounds:
+                lo = bisect_left(self._keys, (start,))
+                hi = bisect_right(self._keys, (end,))
+                ids.extend(doc_id for _, doc_id in self._keys[lo:hi])
+        return ids
+
+    def __len__(self):
+        return len(self._keys)
+
+
+geo_index = GeoIndex()
+
+
+def nearby(candidates, center, radius_miles, predicate=None):
+    """
+    Exact filter over candidate listings: keep those within radius_miles of
+    center that also pass predicate, add "distanceMiles", nearest first.
+    """
+    results = []
+    for listing in candidates:
+        point = listing_point(listing)
+        if point is None:
+            continue
+        distance = haversine_miles(center, point)
+        if distance > radius_miles or (predicate is not None and not predicate(listing)):
+            continue
+        listing["distanceMiles"] = round(distance, 3)
+        results.append(listing)
+    results.sort(key=lambda l: (l["distanceMiles"], l["id"]))
+    return results
+
+
+def query_candidates(collection, bounds):
+    """Listings in the geohash ranges, one Firestore range query per range."""
+    listings = []
+    for start, end in bounds:
+        query = collection.where("geohash", ">=", start).where("geohash", "<=", end)
+        for doc in query.stream():
+            data = doc.to_dict()
+            data["id"] = doc.id
+            listings.append(data)
+    return listings
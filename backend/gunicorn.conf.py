@@ -0,0 +1,42 @@
+"""
+gunicorn settings: gunicorn -c gunicorn.conf.py app:app
+
+The master preloads the app, so workers fork with every module already
+imported (and shared copy-on-write) instead of importing it themselves on
+boot and on every recycle. Each worker then builds its own Firestore client
+in post_fork (firebase_admin_setup.py), which its threads share.
+"""
+import os
+
+# Render's proxy is the one hop in front of the app; admission.py keys rate
+# limits on the client address it appends to X-Forwarded-For. Set before the
+# app is imported (preloaded or in the worker).
+os.environ.setdefault("TRUSTED_PROXY_HOPS", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+# GUNICORN_PRELOAD=0 imports the app in each worker instead
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+# Recycle workers after this many requests (0 = never)
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+# Long enough for the SSE message streams' keep-alives
+timeout = 60
+graceful_timeout = 30
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from firebase_admin_setup import STORAGE_BACKEND, load_credentials
+        # Parse the service account once, before forking
+        if STORAGE_BACKEND == "firestore":
+            load_credentials()
+
+
+def post_fork(server, worker):
+    from firebase_admin_setup import get_client, reset_client
+    # Never use a client (and gRPC channel) created before the fork
+    reset_client()
+    get_client()
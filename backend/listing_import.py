@@ -0,0 +1,166 @@
+"""
+Streaming bulk import of listings from NDJSON or CSV.
+
+Rows are read one at a time, validated with the shared listing schema and
+fed lazily into bulk_write(), so memory stays bounded by the write chunks in
+flight (plus the line number of every row, to report failed writes) no
+matter how large the input is. A bad row, or a chunk of rows that could not
+be written, is recorded in the report and skipped; it does not abort the
+import. Open the input with errors="replace": rows that are not valid UTF-8
+are reported like any other bad row.
+
+Document IDs are derived from the row (its `id` column when present, else
+the contact email, address, title and start date), so importing the same
+file twice overwrites the same documents instead of duplicating them. Those
+keep the createdAt of their first import, read back one chunk of rows at a
+time, so a re-run doesn't move them to the top of the newest-first pages.
+"""
+import csv
+import hashlib
+import json
+import time
+from array import array
+from datetime import datetime, timezone
+
+from availability import availability_fields
+from bulk_writes import MAX_BATCH_SIZE, BulkWriteError, WriteOp, bulk_write
+from geo import location_fields
+from listing_schema import validate_listing
+
+FORMATS = ("ndjson", "csv")
+# Per-row errors kept in the report; the total is always counted
+MAX_REPORTED_ERRORS = 100
+# What errors="replace" decodes invalid UTF-8 to
+REPLACEMENT = "\ufffd"
+
+
+def guess_format(name):
+    """"csv" for *.csv, otherwise "ndjson"."""
+    return "csv" if (name or "").lower().endswith(".csv") else "ndjson"
+
+
+def import_listing_id(source, record, listing):
+    if record.get("id"):
+        key = [source, str(record["id"]).strip()]
+    else:
+        key = [source, listing.get("contactEmail", "").lower(), listing.get("address", "").lower(),
+               listing.get("title", "").lower(), listing.get("availableFrom") or ""]
+    return "import-" + hashlib.sha1("\n".join(key).encode()).hexdigest()[:24]
+
+
+def read_rows(stream, fmt):
+    """Yield (line_number, record_or_exception) from a text stream."""
+    if fmt == "csv":
+        # csv.DictReader pulls one line at a time from the stream
+        reader = csv.DictReader(stream)
+        for row in reader:
+            if any(REPLACEMENT in (v or "") for v in row.values() if isinstance(v, str)):
+                yield reader.line_num, ValueError("not valid UTF-8")
+                continue
+            # Empty CSV cells mean "not given"
+            yield reader.line_num, {k: v for k, v in row.items() if k and v not in (None, "")}
+    elif fmt == "ndjson":
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            if REPLACEMENT in line:
+                yield number, ValueError("not valid UTF-8")
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, ValueError(f"invalid JSON: {e}")
+                continue
+            if not isinstance(record, dict):
+                yield number, ValueError("each line must be a JSON object")
+                continue
+            yield number, record
+    else:
+        raise ValueError(f"Unknown import format {fmt!r}")
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.chunks = []
+        self.seconds = 0.0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "errorCount": self.error_count,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "rowsPerSecond": round(self.rows / self.seconds, 1) if self.seconds else None,
+            "chunks": len(self.chunks),
+        }
+
+
+def import_listings(db, stream, fmt, source="import"):
+    """
+    Import every row of `stream` (a text file object) in format `fmt`.
+    `source` namespaces the generated IDs. Returns an ImportReport.
+    """
+    report = ImportReport()
+    listings = db.collection("listings")
+    started = time.perf_counter()
+    imported_at = datetime.now(timezone.utc)
+    # Line numbers of each chunk's rows, by the id() of its first op
+    chunk_lines = {}
+
+    def stamped(pending):
+        refs = [listings.document(doc_id) for doc_id, _, _ in pending]
+        created = {}
+        for doc in db.get_all(refs, field_paths=["createdAt"]):
+            if doc.exists:
+                created[doc.id] = (doc.to_dict() or {}).get("createdAt")
+        ops = []
+        for ref, (doc_id, listing, _) in zip(refs, pending):
+            listing["createdAt"] = created.get(doc_id) or imported_at
+            ops.append(WriteOp("set", ref, listing))
+        # A chunk's ops stay alive until its outcome is known, so their ids are stable
+        chunk_lines[id(ops[0])] = array("L", (number for _, _, number in pending))
+        yield from ops
+
+    def ops():
+        pending = []
+        for number, record in read_rows(stream, fmt):
+            report.rows += 1
+            if isinstance(record, Exception):
+                report.error(number, str(record))
+                continue
+            try:
+                listing = validate_listing(record)
+            except ValueError as e:
+                report.error(number, str(e))
+                continue
+            listing.update(location_fields(listing.get("address")))
+            listing.update(availability_fields(listing))
+            pending.append((import_listing_id(source, record, listing), listing, number))
+            if len(pending) == MAX_BATCH_SIZE:
+                yield from stamped(pending)
+                pending = []
+        if pending:
+            yield from stamped(pending)
+
+    # Each chunk of MAX_BATCH_SIZE rows is one bulk_write chunk
+    try:
+        result = bulk_write(db, ops(), chunk_size=MAX_BATCH_SIZE)
+    except BulkWriteError as e:
+        result = e.result
+        for chunk, error in e.failed:
+            for number in chunk_lines[id(chunk[0])]:
+                report.error(number, f"not written: {error}")
+    report.imported = result.writes
+    report.chunks = result.chunks
+    report.seconds = time.perf_counter() - started
+    return report
@@ -0,0 +1,210 @@
+"""
+Filtering and newest-first pagination for listing queries.
+
+Filter criteria are parsed once per request. Predicates that a declared
+composite index can serve are pushed into the Firestore query; everything
+else is checked in Python while walking the results page by page. A pushed
+predicate must match exactly the documents its Python check does.
+"""
+import os
+from datetime import datetime
+
+from availability import listing_window, parse_mode, request_window, window_matches
+from geo import parse_near, parse_radius
+from listings_replica import created_at_key
+from search_index import matches_query
+
+PARKING_YES = [True, "included", "yes", "available"]
+# Includes listings without the field, which an "in" filter can't match, so
+# parking "no" is only ever checked in Python
+PARKING_NO = [False, "none", "no", None]
+
+# Composite indexes deployed with firestore.indexes.json, as the sets of filter
+# fields each one serves together with ORDER BY createdAt DESC, __name__ DESC
+# ("price" is the price range, ordered after them). Keep the two in sync; a
+# query planned against a missing index fails.
+COMPOSITE_INDEXES = [
+    frozenset({"furnished"}),
+    frozenset({"parking"}),
+    frozenset({"furnished", "parking"}),
+    frozenset({"price"}),
+    frozenset({"furnished", "price"}),
+    frozenset({"parking", "price"}),
+    frozenset({"furnished", "parking", "price"}),
+]
+PUSHDOWN_ENABLED = os.environ.get("LISTINGS_PUSHDOWN", "1") != "0"
+
+# Upper bound on documents scanned for one page when predicates run in Python;
+# a short page still carries nextCursor so the client can keep going.
+MAX_SCAN_FACTOR = 10
+FETCH_BATCH = 100
+
+
+def _parse_date(value):
+    # An unparseable date is treated as not given
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+def _parse_price(value):
+    if not value:
+        return None
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None  # Skip invalid price
+
+
+def parse_criteria(body):
+    """
+    Turn a /listings/filter body into normalized filter criteria. Raises
+    ValueError for a bad radiusMiles, availability or minOverlapDays, or an
+    unresolvable near.
+    """
+    radius = parse_radius(body.get("radiusMiles"))
+    start = _parse_date(body.get("startDate"))
+    end = _parse_date(body.get("endDate"))
+    mode, min_overlap_days = parse_mode(body)
+    return {
+        "title": (body.get("title", "") or "").strip().lower(),
+        "q": str(body.get("q") or "").strip(),
+        "minPrice": _parse_price(body.get("minPrice")),
+        "maxPrice": _parse_price(body.get("maxPrice")),
+        "furnished": body.get("furnished") is True,
+        "parking": body.get("parking") if body.get("parking") in ("yes", "no") else None,
+        "startDate": start,
+        "endDate": end,
+        # The requested stay as epoch seconds (a missing side is open), or None
+        "window": request_window(start, end) if start is not None or end is not None else None,
+        "availability": mode,
+        "minOverlapDays": min_overlap_days,
+        "radiusMiles": radius,
+        # Only resolved for a radius search; raises ValueError if it can't be
+        "near": parse_near(body.get("near")) if radius is not None else None,
+    }
+
+
+def build_predicate(criteria, pushed=frozenset()):
+    """Return fn(listing) -> bool for every criterion not already in `pushed`."""
+    checks = []
+
+    if (criteria["minPrice"] is not None or criteria["maxPrice"] is not None) and "price" not in pushed:
+        low, high = criteria["minPrice"], criteria["maxPrice"]
+
+        # Mirror Firestore range filters, which only match numbers
+        def price_ok(listing):
+            price = listing.get("price")
+            if not isinstance(price, (int, float)) or isinstance(price, bool):
+                return False
+            return (low is None or price >= low) and (high is None or price <= high)
+        checks.append(price_ok)
+
+    if criteria["title"]:
+        title_lower = criteria["title"]
+        checks.append(lambda l: title_lower in (l.get("title", "") or "").lower())
+
+    if criteria["q"] and "q" not in pushed:
+        q = criteria["q"]
+        checks.append(lambda l: matches_query(l, q))
+
+    if criteria["furnished"] and "furnished" not in pushed:
+        checks.append(lambda l: l.get("furnished") is True)
+
+    if criteria["parking"] and "parking" not in pushed:
+        allowed = PARKING_YES if criteria["parking"] == "yes" else PARKING_NO
+        checks.append(lambda l: l.get("parking") in allowed)
+
+    if criteria["window"] is not None and "availability" not in pushed:
+        wanted, mode, days = criteria["window"], criteria["availability"], criteria["minOverlapDays"]
+        checks.append(lambda l: window_matches(listing_window(l), wanted, mode, days))
+
+    if not checks:
+        return None
+    return lambda listing: all(check(listing) for check in checks)
+
+
+def plan_pushdown(criteria):
+    """Pick the predicates that a declared composite index can serve."""
+    if not PUSHDOWN_ENABLED:
+        return frozenset()
+    wanted = set()
+    if criteria["furnished"]:
+        wanted.add("furnished")
+    if criteria["parking"] == "yes":
+        wanted.add("parking")
+    if criteria["minPrice"] is not None or criteria["maxPrice"] is not None:
+        wanted.add("price")
+    best = frozenset()
+    for index in COMPOSITE_INDEXES:
+        if index <= wanted and len(index) > len(best):
+            best = index
+    return best
+
+
+def apply_pushdown(query, criteria, pushed):
+    if "furnished" in pushed:
+        query = query.where("furnished", "==", True)
+    if "parking" in pushed:
+        query = query.where("parking", "in", PARKING_YES)
+    if "price" in pushed:
+        # Range filters only match numbers, like the Python check
+        if criteria["minPrice"] is not None:
+            query = query.where("price", ">=", criteria["minPrice"])
+        if criteria["maxPrice"] is not None:
+            query = query.where("price", "<=", criteria["maxPrice"])
+    return query
+
+
+def walk_query(query, predicate, cursor, limit):
+    """
+    Walk `query` newest first from `cursor` (a [createdAt, id] pair), yielding
+    up to `limit` matching listings as they arrive; returns the next cursor.
+    Documents are fetched in batches with start_after, so a page costs about
+    `limit` reads when every document matches.
+    """
+    query = (
+        query.order_by("createdAt", direction="DESCENDING")
+             .order_by("__name__", direction="DESCENDING")
+    )
+    found = 0
+    scanned = 0
+    last = cursor
+    batch_size = limit if predicate is None else min(FETCH_BATCH, limit * MAX_SCAN_FACTOR)
+    while True:
+        q = query
+        if last is not None:
+            q = q.start_after({"createdAt": last[0], "__name__": last[1]})
+        fetched = 0
+        docs = q.limit(batch_size).stream()
+        try:
+            for doc in docs:
+                data = doc.to_dict()
+                last = [data.get("createdAt"), doc.id]
+                fetched += 1
+                scanned += 1
+                if predicate is None or predicate(data):
+                    data["id"] = doc.id
+                    yield data
+                    found += 1
+                    if found == limit:
+                        return last
+        finally:
+            # Stops the RPC and counts its reads now, not when collected
+            docs.close()
+        if fetched < batch_size:
+            return None
+        if scanned >= limit * MAX_SCAN_FACTOR:
+            return last
+
+
+def walk_replica(replica, predicate, cursor, limit):
+    """walk_query over the listings replica."""
+    after = None
+    if cursor is not None:
+        after = (created_at_key({"createdAt": cursor[0]}), cursor[1])
+    last = yield from replica.walk(predicate, after, limit)
+    return [last[0], last[1]] if last is not None else None
@@ -0,0 +1,135 @@
+"""
+The listing document schema shared by create_listing, update_listing and
+the bulk importer.
+
+validate_listing() checks and normalizes the fields a client may write and
+drops everything else. Values arriving as text (CSV columns, form posts) are
+coerced to the stored types, so an imported row ends up identical to the same
+listing created through the API.
+"""
+import math
+import re
+from datetime import datetime
+
+# field -> kind; the fields clients may set on a listing
+LISTING_FIELDS = {
+    "title": "text",
+    "price": "number",
+    "category": "text",
+    "address": "text",
+    "contactName": "text",
+    "contactEmail": "email",
+    "availableFrom": "date",
+    "availableTo": "date",
+    "parking": "text",
+    "furnished": "bool",
+    "description": "text",
+    "notes": "text",
+    "photos": "photos",
+}
+REQUIRED_FIELDS = ("title", "price", "contactEmail")
+MAX_PHOTOS = 10
+# An uploaded photo's ID: the SHA-256 of its bytes (see photos.py)
+PHOTO_ID = re.compile(r"^[0-9a-f]{64}$")
+
+_TRUE = {"true", "yes", "y", "1"}
+_FALSE = {"false", "no", "n", "0", ""}
+
+
+def _number(value):
+    if isinstance(value, bool):
+        raise ValueError("must be a number")
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        try:
+            number = float(str(value).strip().replace(",", "").lstrip("$"))
+        except ValueError:
+            raise ValueError("must be a number")
+    if not math.isfinite(number):
+        raise ValueError("must be a number")
+    if number < 0:
+        raise ValueError("must not be negative")
+    return int(number) if float(number).is_integer() else number
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError("must be true or false")
+
+
+def _date(value):
+    # Stored as the ISO string the frontend sends; only checked for parseability
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError("must be an ISO 8601 date")
+    return text
+
+
+def _photos(value):
+    # Photo IDs or external http(s) URLs; a CSV column holds them space or comma separated
+    if isinstance(value, str):
+        value = [part for part in re.split(r"[\s,]+", value) if part]
+    if not isinstance(value, list):
+        raise ValueError("must be a list")
+    if len(value) > MAX_PHOTOS:
+        raise ValueError(f"must have at most {MAX_PHOTOS} entries")
+    for photo in value:
+        if not isinstance(photo, str) or not (PHOTO_ID.match(photo) or photo.startswith(("https://", "http://"))):
+            raise ValueError("must hold photo IDs or http(s) URLs")
+    return list(dict.fromkeys(value))
+
+
+def _coerce(kind, value):
+    if value is None:
+        return None
+    if kind == "number":
+        return _number(value)
+    if kind == "bool":
+        return _bool(value)
+    if kind == "date":
+        return _date(value)
+    if kind == "photos":
+        return _photos(value)
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        raise ValueError("must be text")
+    text = str(value).strip()
+    if kind == "email" and text and "@" not in text:
+        raise ValueError("must be an email address")
+    return text
+
+
+def validate_listing(record, partial=False):
+    """
+    Return the normalized listing fields of `record`. Unknown fields are
+    dropped. Raises ValueError naming the first bad field; with partial=False
+    the REQUIRED_FIELDS must also be present and non-empty.
+    """
+    listing = {}
+    for field, kind in LISTING_FIELDS.items():
+        if field not in record:
+            continue
+        try:
+            listing[field] = _coerce(kind, record[field])
+        except ValueError as e:
+            raise ValueError(f"{field} {e}")
+    if not partial:
+        for field in REQUIRED_FIELDS:
+            if listing.get(field) in (None, ""):
+                raise ValueError(f"{field} is required")
+    if listing.get("availableFrom") and listing.get("availableTo"):
+        start = datetime.fromisoformat(listing["availableFrom"].replace("Z", "+00:00"))
+        end = datetime.fromisoformat(listing["availableTo"].replace("Z", "+00:00"))
+        if (start.tzinfo is None) == (end.tzinfo is None) and end < start:
+            raise ValueError("availableTo must not be before availableFrom")
+    return listing
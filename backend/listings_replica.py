@@ -0,0 +1,273 @@
+"""
+Per-worker, in-memory replica of the "listings" collection.
+
+The replica loads the collection once through a Firestore on_snapshot
+listener and then applies the ADDED / MODIFIED / REMOVED change events the
+listener delivers, so the read endpoints can be answered without touching
+Firestore. Set LISTINGS_REPLICA=0 to fall back to direct queries.
+"""
+import logging
+import os
+import threading
+from bisect import bisect_left, insort
+import time
+from datetime import datetime, timezone
+
+REPLICA_ENABLED = os.environ.get("LISTINGS_REPLICA", "1") != "0"
+# How long after the replica is created requests wait for its initial
+# snapshot; after that they use Firestore directly until it arrives
+READY_TIMEOUT = float(os.environ.get("LISTINGS_REPLICA_READY_TIMEOUT", "5"))
+
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+log = logging.getLogger(__name__)
+
+
+def created_at_key(listing):
+    """Sort key for createdAt that tolerates naive, aware and missing values."""
+    value = listing.get("createdAt")
+    if not isinstance(value, datetime):
+        return _EPOCH
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class ListingsReplica:
+    def __init__(self, collection):
+        self._collection = collection
+        self._docs = {}
+        # doc_id -> update time of the replicated version, for write preconditions
+        self._update_times = {}
+        # (createdAt, id) keys of listings with a timestamp createdAt, ascending
+        self._order = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self._started = False
+        # functions called as fn(change_type, doc_id, data) after each change is applied
+        self._listeners = []
+        self.last_read_time = None
+        self.last_applied_at = None
+        self.last_lag_seconds = None
+        self.events_applied = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        try:
+            self._watch = self._collection.on_snapshot(self._on_snapshot)
+        except Exception:
+            self._started = False
+            raise
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+        self._watch = None
+        self._started = False
+        self._ready.clear()
+
+    def restart(self):
+        """Re-open a listener that has died; the next initial snapshot reconciles the docs."""
+        self.stop()
+        self.start()
+
+    def add_listener(self, fn):
+        """Register fn(change_type, doc_id, data); it is replayed over the current docs."""
+        with self._lock:
+            self._listeners.append(fn)
+            current = list(self._docs.items())
+        for doc_id, data in current:
+            fn("ADDED", doc_id, data)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        applied = []
+        with self._lock:
+            if not self._ready.is_set():
+                # Initial snapshot (or one after a restart): drop docs that vanished meanwhile
+                present = {doc.id for doc in docs}
+                for doc_id in [d for d in self._docs if d not in present]:
+                    self._remove(doc_id)
+                    applied.append(("REMOVED", doc_id, None))
+            for change in changes:
+                doc = change.document
+                kind = change.type.name
+                if kind == "REMOVED":
+                    self._remove(doc.id)
+                    applied.append((kind, doc.id, None))
+                else:
+                    data = doc.to_dict() or {}
+                    self._remove(doc.id)
+                    self._docs[doc.id] = data
+                    self._update_times[doc.id] = doc.update_time
+                    if isinstance(data.get("createdAt"), datetime):
+                        insort(self._order, (created_at_key(data), doc.id))
+                    applied.append((kind, doc.id, data))
+            self.events_applied += len(applied)
+            self.last_applied_at = time.time()
+            if read_time is not None:
+                self.last_read_time = read_time
+                self.last_lag_seconds = max(0.0, self.last_applied_at - read_time.timestamp())
+            listeners = list(self._listeners)
+        for kind, doc_id, data in applied:
+            for fn in listeners:
+                fn(kind, doc_id, data)
+        self._ready.set()
+
+    def _remove(self, doc_id):
+        self._update_times.pop(doc_id, None)
+        data = self._docs.pop(doc_id, None)
+        if data is not None and isinstance(data.get("createdAt"), datetime):
+            key = (created_at_key(data), doc_id)
+            index = bisect_left(self._order, key)
+            if index < len(self._order) and self._order[index] == key:
+                del self._order[index]
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @property
+    def active(self):
+        if self._watch is None:
+            return False
+        return getattr(self._watch, "is_active", True)
+
+    def wait_ready(self, timeout=READY_TIMEOUT):
+        return self._ready.wait(timeout) and self.active
+
+    def get(self, doc_id):
+        """Return a copy of one listing with its "id", or None."""
+        with self._lock:
+            data = self._docs.get(doc_id)
+        if data is None:
+            return None
+        listing = dict(data)
+        listing["id"] = doc_id
+        return listing
+
+    def get_versioned(self, doc_id):
+        """Return (listing, update_time) for one listing, or (None, None)."""
+        with self._lock:
+            data = self._docs.get(doc_id)
+            update_time = self._update_times.get(doc_id)
+        if data is None:
+            return None, None
+        listing = dict(data)
+        listing["id"] = doc_id
+        return listing, update_time
+
+    def select(self, predicate=None):
+        """Return copies of the matching listings, each with its "id" filled in."""
+        with self._lock:
+            items = list(self._docs.items())
+        results = []
+        for doc_id, data in items:
+            if predicate is None or predicate(data):
+                listing = dict(data)
+                listing["id"] = doc_id
+                results.append(listing)
+        return results
+
+    def walk(self, predicate, after=None, limit=20, chunk=256):
+        """
+        Walk listings newest first by (createdAt, id), starting after the key
+        `after`, yielding copies of the matching ones; returns the key of the
+        last listing yielded, or None once the walk reaches the oldest
+        listing. The lock is taken for `chunk` listings at a time, so a long
+        walk streamed to a slow client doesn't hold up the listener.
+        """
+        found = 0
+        while True:
+            batch = []
+            with self._lock:
+                start = bisect_left(self._order, after) if after is not None else len(self._order)
+                stop = max(start - chunk, 0)
+                for index in range(start - 1, stop - 1, -1):
+                    key = after = self._order[index]
+                    data = self._docs[key[1]]
+                    if predicate is None or predicate(data):
+                        listing = dict(data)
+                        listing["id"] = key[1]
+                        batch.append(listing)
+                        if found + len(batch) == limit:
+                            break
+            yield from batch
+            found += len(batch)
+            if found == limit:
+                return after
+            if stop == 0:
+                return None
+
+    def stats(self):
+        """Staleness / lag gauge reported by /health."""
+        now = time.time()
+        return {
+            "ready": self.ready,
+            "active": self.active,
+            "documents": len(self._docs),
+            "eventsApplied": self.events_applied,
+            "lastReadTime": self.last_read_time.isoformat() if self.last_read_time else None,
+            "lagSeconds": self.last_lag_seconds,
+            "secondsSinceLastEvent": (now - self.last_applied_at) if self.last_applied_at else None,
+        }
+
+
+_replica = None
+# Requests wait for the initial snapshot until then (time.monotonic())
+_ready_deadline = None
+_replica_lock = threading.Lock()
+# Listeners attached to the replica when it is created (cache invalidation, indexes)
+_replica_listeners = []
+
+
+def add_replica_listener(fn):
+    """Register fn(change_type, doc_id, data) on this process's replica, now or once it exists."""
+    with _replica_lock:
+        _replica_listeners.append(fn)
+        replica = _replica
+    if replica is not None:
+        replica.add_listener(fn)
+
+
+def get_replica(db):
+    """
+    Return this process's replica once it has loaded, or None when it is
+    disabled or not ready (callers then query Firestore directly).
+    The listener is started lazily so it is created after gunicorn forks.
+    Requests in the first READY_TIMEOUT wait for the initial snapshot; later
+    ones don't wait, so a listener that never loads costs each request
+    nothing.
+    """
+    global _replica, _ready_deadline
+    if not REPLICA_ENABLED:
+        return None
+    with _replica_lock:
+        if _replica is None:
+            _replica = ListingsReplica(db.collection("listings"))
+            _ready_deadline = time.monotonic() + READY_TIMEOUT
+            for fn in _replica_listeners:
+                _replica.add_listener(fn)
+        try:
+            if _replica.ready and not _replica.active:
+                _replica.restart()
+            else:
+                _replica.start()
+        except Exception as e:
+            # Callers fall back to Firestore queries on every request until it starts
+            log.debug(f"Listings replica failed to start: {e}")
+            return None
+    if not _replica.wait_ready(max(0.0, _ready_deadline - time.monotonic())):
+        return None
+    return _replica
+
+
+def replica_stats():
+    if not REPLICA_ENABLED:
+        return {"enabled": False}
+    if _replica is None:
+        return {"enabled": True, "ready": False}
+    return {"enabled": True, **_replica.stats()}
@@ -0,0 +1,818 @@
+"""
+In-memory stand-in for the Firestore client.
+
+MemoryClient implements the part of the google-cloud-firestore API that the
+backend uses (collection/document references, where/order_by/limit/cursor
+queries, stream/get/get_all, add/set/update/delete/create, write batches,
+bulk writers, write preconditions, field transforms and on_snapshot
+listeners) so the app can run, be benchmarked and be load-tested without
+credentials. Every RPC can be delayed by a configurable latency, and the
+client counts RPCs, document reads and document writes. AsyncMemoryClient
+gives the ASGI entry point an asyncio view of the same data.
+"""
+import asyncio
+import copy
+import logging
+import random
+import string
+import threading
+import time
+from collections.abc import Sequence
+from datetime import datetime, timezone
+
+from google.api_core import exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1._helpers import ExistsOption, LastUpdateOption
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+log = logging.getLogger(__name__)
+
+_AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+
+def _auto_id():
+    return "".join(random.choice(_AUTO_ID_CHARS) for _ in range(20))
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+# Firestore orders values of different types by type first
+def _type_rank(value):
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, (list, tuple)):
+        return 8
+    if isinstance(value, dict):
+        return 9
+    return 7
+
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank == 3 and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    if rank == 8:
+        return (rank, tuple(_sort_key(v) for v in value))
+    if rank == 9:
+        return (rank, tuple(sorted((k, _sort_key(v)) for k, v in value.items())))
+    if rank in (0, 7):
+        return (rank, 0)
+    return (rank, value)
+
+
+def _normalize(value):
+    """Store values the way Firestore returns them: aware datetimes, lists for tuples."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+_MISSING = object()
+
+
+def _get_path(data, field_path):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set_path(data, field_path, value):
+    parts = field_path.split(".")
+    target = data
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    target[parts[-1]] = value
+
+
+def _delete_path(data, field_path):
+    parts = field_path.split(".")
+    target = data
+    for part in parts[:-1]:
+        target = target.get(part)
+        if not isinstance(target, dict):
+            return
+    target.pop(parts[-1], None)
+
+
+def _apply_value(data, field_path, value, commit_time):
+    if value is transforms.DELETE_FIELD:
+        _delete_path(data, field_path)
+    elif value is transforms.SERVER_TIMESTAMP:
+        _set_path(data, field_path, commit_time)
+    elif isinstance(value, transforms.Increment):
+        current = _get_path(data, field_path)
+        if not isinstance(current, (int, float)) or isinstance(current, bool):
+            current = 0
+        _set_path(data, field_path, current + value.value)
+    elif isinstance(value, transforms.ArrayUnion):
+        current = _get_path(data, field_path)
+        current = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in current:
+                current.append(_normalize(item))
+        _set_path(data, field_path, current)
+    elif isinstance(value, transforms.ArrayRemove):
+        current = _get_path(data, field_path)
+        current = list(current) if isinstance(current, list) else []
+        _set_path(data, field_path, [item for item in current if item not in value.values])
+    elif isinstance(value, dict):
+        nested = {}
+        for key, inner in value.items():
+            _apply_value(nested, key, inner, commit_time)
+        _set_path(data, field_path, nested)
+    else:
+        _set_path(data, field_path, copy.deepcopy(_normalize(value)))
+
+
+def _match(value, op, target):
+    if op == "==":
+        return value is not _MISSING and _sort_key(value) == _sort_key(target)
+    if op == "!=":
+        return value is not _MISSING and value is not None and _sort_key(value) != _sort_key(target)
+    if op == "in":
+        return value is not _MISSING and any(_sort_key(value) == _sort_key(t) for t in target)
+    if op == "not-in":
+        return (value is not _MISSING and value is not None
+                and all(_sort_key(value) != _sort_key(t) for t in target))
+    if op == "array_contains":
+        return isinstance(value, list) and any(_sort_key(v) == _sort_key(target) for v in value)
+    if op == "array_contains_any":
+        return isinstance(value, list) and any(
+            _sort_key(v) == _sort_key(t) for v in value for t in target)
+    if value is _MISSING or _type_rank(value) != _type_rank(target):
+        return False
+    left, right = _sort_key(value), _sort_key(target)
+    if op == "<":
+        return left < right
+    if op == "<=":
+        return left <= right
+    if op == ">":
+        return left > right
+    if op == ">=":
+        return left >= right
+    raise ValueError(f"Unsupported operator {op!r}")
+
+
+class MemoryStats:
+    """Counters for RPCs, document reads and document writes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rpcs = 0
+        self.reads = 0
+        self.writes = 0
+
+    def record(self, rpcs=0, reads=0, writes=0):
+        with self._lock:
+            self.rpcs += rpcs
+            self.reads += reads
+            self.writes += writes
+
+    def snapshot(self):
+        with self._lock:
+            return {"rpcs": self.rpcs, "reads": self.reads, "writes": self.writes}
+
+    def reset(self):
+        with self._lock:
+            self.rpcs = self.reads = self.writes = 0
+
+
+class MemorySnapshot:
+    # Stored document dicts are never mutated in place (commits stage copies),
+    # so snapshots share them and only to_dict() copies.
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        value = _get_path(self._data, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class _LazySnapshots(Sequence):
+    """The full result set handed to listeners, only materialized if a listener reads it."""
+
+    def __init__(self, client, collection, entries, matching, read_time):
+        self._args = (client, collection, entries, matching, read_time)
+        self._snapshots = None
+
+    def _materialize(self):
+        if self._snapshots is None:
+            client, collection, entries, matching, read_time = self._args
+            self._snapshots = [
+                MemorySnapshot(MemoryDocumentReference(client, collection, doc_id), entry["data"],
+                               entry["create_time"], entry["update_time"], read_time)
+                for doc_id, entry in entries.items() if doc_id in matching
+            ]
+        return self._snapshots
+
+    def __len__(self):
+        return len(self._materialize())
+
+    def __getitem__(self, index):
+        return self._materialize()[index]
+
+
+class MemoryDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection}/{self.id}"
+
+    @property
+    def parent(self):
+        return MemoryCollectionReference(self._client, self._collection)
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and self.path == other.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._rpc()
+        return self._client._read_one(self)
+
+    def set(self, document_data, merge=False):
+        self._client._rpc()
+        return self._client._commit([("set", self, document_data, {"merge": merge})])[0]
+
+    def create(self, document_data):
+        self._client._rpc()
+        return self._client._commit([("create", self, document_data, {})])[0]
+
+    def update(self, field_updates, option=None):
+        self._client._rpc()
+        return self._client._commit([("update", self, field_updates, {"option": option})])[0]
+
+    def delete(self, option=None):
+        self._client._rpc()
+        return self._client._commit([("delete", self, None, {"option": option})])[0].update_time
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self._collection, lambda ref, data: ref.id == self.id, None, callback)
+
+
+class MemoryWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class MemoryQuery:
+    def __init__(self, client, collection, filters=(), orders=(), limit=None,
+                 limit_to_last=False, start=None, end=None, projection=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._limit_to_last = limit_to_last
+        self._start = start
+        self._end = end
+        self._projection = projection
+
+    def _copy(self, **changes):
+        fields = dict(
+            filters=self._filters, orders=self._orders, limit=self._limit,
+            limit_to_last=self._limit_to_last, start=self._start, end=self._end,
+            projection=self._projection,
+        )
+        fields.update(changes)
+        return MemoryQuery(self._client, self._collection, **fields)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count):
+        return self._copy(limit=count, limit_to_last=True)
+
+    def select(self, field_paths):
+        return self._copy(projection=tuple(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, False))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, True))
+
+    def end_before(self, document_fields_or_snapshot):
+        return self._copy(end=(document_fields_or_snapshot, False))
+
+    def end_at(self, document_fields_or_snapshot):
+        return self._copy(end=(document_fields_or_snapshot, True))
+
+    def _effective_orders(self):
+        orders = list(self._orders)
+        ordered = {field for field, _ in orders}
+        # Firestore implicitly orders by inequality fields after the explicit
+        # orders, then by document id
+        last = orders[-1][1] if orders else "ASCENDING"
+        for field, op, _ in self._filters:
+            if op in ("<", "<=", ">", ">=", "!=", "not-in") and field not in ordered:
+                orders.append((field, last))
+                ordered.add(field)
+        if "__name__" not in ordered:
+            orders.append(("__name__", last))
+        return orders
+
+    def _matches(self, ref, data):
+        for field, op, value in self._filters:
+            actual = ref.id if field == "__name__" else _get_path(data, field)
+            if field == "__name__" and isinstance(value, MemoryDocumentReference):
+                value = value.id
+            if not _match(actual, op, value):
+                return False
+        for field, _ in self._orders:
+            if field != "__name__" and _get_path(data, field) is _MISSING:
+                return False
+        return True
+
+    def _cursor_values(self, cursor, orders):
+        if isinstance(cursor, MemorySnapshot):
+            data = cursor._data or {}
+            return [cursor.id if f == "__name__" else _get_path(data, f) for f, _ in orders]
+        if isinstance(cursor, dict):
+            values = [cursor.get(f, _MISSING) for f, _ in orders]
+            return [v.id if isinstance(v, MemoryDocumentReference) else v for v in values]
+        values = list(cursor)
+        return values + [_MISSING] * (len(orders) - len(values))
+
+    def _compare(self, row_values, cursor_values, orders):
+        for value, cursor, (_, direction) in zip(row_values, cursor_values, orders):
+            if cursor is _MISSING:
+                return 0
+            a, b = _sort_key(value), _sort_key(cursor)
+            if a != b:
+                result = -1 if a < b else 1
+                return -result if direction == "DESCENDING" else result
+        return 0
+
+    def _run(self):
+        orders = self._effective_orders()
+        rows = []
+        for ref, data, meta in self._client._scan(self._collection):
+            if self._matches(ref, data):
+                values = [ref.id if f == "__name__" else _get_path(data, f) for f, _ in orders]
+                rows.append((values, ref, data, meta))
+
+        def row_key(row):
+            return [_sort_key(v) for v in row[0]]
+
+        # Stable multi-key sort honouring per-field direction
+        for index in range(len(orders) - 1, -1, -1):
+            reverse = orders[index][1] == "DESCENDING"
+            rows.sort(key=lambda row, i=index: row_key(row)[i], reverse=reverse)
+
+        if self._start is not None:
+            cursor, inclusive = self._start
+            values = self._cursor_values(cursor, orders)
+            rows = [r for r in rows
+                    if (self._compare(r[0], values, orders) >= 0 if inclusive
+                        else self._compare(r[0], values, orders) > 0)]
+        if self._end is not None:
+            cursor, inclusive = self._end
+            values = self._cursor_values(cursor, orders)
+            rows = [r for r in rows
+                    if (self._compare(r[0], values, orders) <= 0 if inclusive
+                        else self._compare(r[0], values, orders) < 0)]
+        if self._limit is not None:
+            rows = rows[-self._limit:] if self._limit_to_last else rows[:self._limit]
+            if self._limit == 0:
+                rows = []
+
+        read_time = _now()
+        snapshots = []
+        for _, ref, data, (create_time, update_time) in rows:
+            if self._projection is not None:
+                projected = {}
+                for field in self._projection:
+                    value = _get_path(data, field)
+                    if value is not _MISSING:
+                        _set_path(projected, field, value)
+                data = projected
+            snapshots.append(MemorySnapshot(ref, data, create_time, update_time, read_time))
+        # Firestore bills at least one read per query
+        self._client.stats.record(reads=max(1, len(snapshots)))
+        return snapshots
+
+    def stream(self, transaction=None):
+        self._client._rpc()
+        yield from self._run()
+
+    def get(self, transaction=None):
+        self._client._rpc()
+        return self._run()
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self._collection, self._matches, self, callback)
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client, collection):
+        super().__init__(client, collection)
+        self.id = collection
+
+    def document(self, document_id=None):
+        return MemoryDocumentReference(self._client, self._collection, document_id or _auto_id())
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        result = ref.create(document_data)
+        return result.update_time, ref
+
+    def list_documents(self, page_size=None):
+        self._client._rpc()
+        return [ref for ref, _, _ in self._client._scan(self._collection)]
+
+
+class MemoryWriteBatch:
+    MAX_WRITES = 500
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference, document_data, {}))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference, document_data, {"merge": merge}))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(("update", reference, field_updates, {"option": option}))
+
+    def delete(self, reference, option=None):
+        self._writes.append(("delete", reference, None, {"option": option}))
+
+    def commit(self, retry=None, timeout=None):
+        if len(self._writes) > self.MAX_WRITES:
+            raise exceptions.InvalidArgument(
+                f"maximum {self.MAX_WRITES} writes allowed per request")
+        self._client._rpc()
+        results = self._client._commit(self._writes)
+        self._writes = []
+        return results
+
+
+class MemoryBulkWriter:
+    """Applies writes as they are queued; mirrors the BulkWriter surface."""
+
+    def __init__(self, client):
+        self._client = client
+        self._on_result = None
+        self._on_error = None
+
+    def on_write_result(self, callback):
+        self._on_result = callback
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def _write(self, kind, reference, data=None, **kwargs):
+        self._client._rpc()
+        try:
+            result = self._client._commit([(kind, reference, data, kwargs)])[0]
+        except exceptions.GoogleAPICallError as e:
+            if self._on_error is None:
+                raise
+            self._on_error(e, self)
+            return
+        if self._on_result is not None:
+            self._on_result(reference, result, self)
+
+    def create(self, reference, document_data):
+        self._write("create", reference, document_data)
+
+    def set(self, reference, document_data, merge=False):
+        self._write("set", reference, document_data, merge=merge)
+
+    def update(self, reference, field_updates, option=None):
+        self._write("update", reference, field_updates, option=option)
+
+    def delete(self, reference, option=None):
+        self._write("delete", reference, option=option)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryWatch:
+    def __init__(self, client, collection, predicate, callback):
+        self._client = client
+        self.collection = collection
+        self.predicate = predicate
+        self.callback = callback
+        self.is_active = True
+        self.matching = set()
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._client._unwatch(self)
+
+
+class MemoryClient:
+    """In-memory Firestore client. latency is the simulated delay per RPC, in seconds."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.stats = MemoryStats()
+        self._data = {}
+        self._lock = threading.RLock()
+        self._watches = []
+
+    # --- public API ---
+    def collection(self, name):
+        return MemoryCollectionReference(self, name)
+
+    def document(self, path):
+        collection, doc_id = path.split("/", 1)
+        return MemoryDocumentReference(self, collection, doc_id)
+
+    def collections(self):
+        self._rpc()
+        with self._lock:
+            return [MemoryCollectionReference(self, name) for name, docs in self._data.items() if docs]
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        self._rpc()
+        for ref in references:
+            yield self._read_one(ref)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def bulk_writer(self, options=None):
+        return MemoryBulkWriter(self)
+
+    write_option = staticmethod(firestore.Client.write_option)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    # --- internals ---
+    def _rpc(self):
+        self.stats.record(rpcs=1)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _scan(self, collection):
+        with self._lock:
+            return [
+                (MemoryDocumentReference(self, collection, doc_id), entry["data"],
+                 (entry["create_time"], entry["update_time"]))
+                for doc_id, entry in self._data.get(collection, {}).items()
+            ]
+
+    def _read_one(self, ref):
+        self.stats.record(reads=1)
+        with self._lock:
+            entry = self._data.get(ref._collection, {}).get(ref.id)
+            if entry is None:
+                return MemorySnapshot(ref, None, read_time=_now())
+            return MemorySnapshot(ref, entry["data"], entry["create_time"], entry["update_time"], _now())
+
+    def _check_option(self, ref, entry, option):
+        if option is None:
+            return
+        if isinstance(option, ExistsOption):
+            if option._exists and entry is None:
+                raise exceptions.NotFound(f"No document to update: {ref.path}")
+            if not option._exists and entry is not None:
+                raise exceptions.AlreadyExists(f"Document already exists: {ref.path}")
+        elif isinstance(option, LastUpdateOption):
+            if entry is None or entry["update_time"] != option._last_update_time:
+                raise exceptions.FailedPrecondition(
+                    f"Document {ref.path} was modified since the last read")
+
+    def _commit(self, writes):
+        """Apply writes atomically; raises before changing anything if a precondition fails."""
+        with self._lock:
+            commit_time = _now()
+            staged = {}
+            for kind, ref, data, kwargs in writes:
+                key = (ref._collection, ref.id)
+                if key in staged:
+                    entry = staged[key]
+                else:
+                    entry = self._data.get(ref._collection, {}).get(ref.id)
+                    entry = copy.deepcopy(entry) if entry is not None else None
+                if kind == "create":
+                    if entry is not None:
+                        raise exceptions.AlreadyExists(f"Document already exists: {ref.path}")
+                    entry = {"data": {}, "create_time": commit_time}
+                    for field, value in data.items():
+                        _apply_value(entry["data"], field, value, commit_time)
+                elif kind == "set":
+                    if entry is None:
+                        entry = {"data": {}, "create_time": commit_time}
+                    elif not kwargs.get("merge"):
+                        entry["data"] = {}
+                    for field, value in data.items():
+                        if kwargs.get("merge") and isinstance(value, dict) and isinstance(
+                                entry["data"].get(field), dict):
+                            for inner, inner_value in value.items():
+                                _apply_value(entry["data"], f"{field}.{inner}", inner_value, commit_time)
+                        else:
+                            _apply_value(entry["data"], field, value, commit_time)
+                elif kind == "update":
+                    if entry is None:
+                        raise exceptions.NotFound(f"No document to update: {ref.path}")
+                    self._check_option(ref, entry, kwargs.get("option"))
+                    for field, value in data.items():
+                        _apply_value(entry["data"], field, value, commit_time)
+                elif kind == "delete":
+                    self._check_option(ref, entry, kwargs.get("option"))
+                    entry = None
+                if entry is not None:
+                    entry["update_time"] = commit_time
+                staged[key] = entry
+            for (collection, doc_id), entry in staged.items():
+                docs = self._data.setdefault(collection, {})
+                if entry is None:
+                    docs.pop(doc_id, None)
+                else:
+                    docs[doc_id] = entry
+            self.stats.record(writes=len(writes))
+            notifications = self._pending_notifications(staged, commit_time)
+        for watch, docs, changes in notifications:
+            try:
+                watch.callback(docs, changes, commit_time)
+            except Exception as e:
+                log.warning(f"Snapshot listener failed: {e}")
+        return [MemoryWriteResult(commit_time) for _ in writes]
+
+    def _watch(self, collection, predicate, query, callback):
+        watch = MemoryWatch(self, collection, predicate, callback)
+        with self._lock:
+            self._watches.append(watch)
+            read_time = _now()
+            docs = []
+            for ref, data, (create_time, update_time) in self._scan(collection):
+                if predicate(ref, data):
+                    watch.matching.add(ref.id)
+                    docs.append(MemorySnapshot(ref, data, create_time, update_time, read_time))
+        changes = [DocumentChange(ChangeType.ADDED, doc, -1, i) for i, doc in enumerate(docs)]
+        callback(docs, changes, read_time)
+        return watch
+
+    def _unwatch(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _pending_notifications(self, staged, commit_time):
+        notifications = []
+        for watch in list(self._watches):
+            changes = []
+            for (collection, doc_id), entry in staged.items():
+                if collection != watch.collection:
+                    continue
+                ref = MemoryDocumentReference(self, collection, doc_id)
+                was = doc_id in watch.matching
+                now = entry is not None and watch.predicate(ref, entry["data"])
+                if now:
+                    snapshot = MemorySnapshot(ref, entry["data"], entry["create_time"],
+                                              entry["update_time"], commit_time)
+                    kind = ChangeType.MODIFIED if was else ChangeType.ADDED
+                    watch.matching.add(doc_id)
+                    changes.append(DocumentChange(kind, snapshot, -1, -1))
+                elif was:
+                    watch.matching.discard(doc_id)
+                    changes.append(DocumentChange(ChangeType.REMOVED, MemorySnapshot(ref, None), -1, -1))
+            if changes:
+                docs = _LazySnapshots(self, watch.collection, dict(self._data.get(watch.collection, {})),
+                                      set(watch.matching), commit_time)
+                notifications.append((watch, docs, changes))
+        return notifications
+
+
+class _AsyncMemoryDocument:
+    def __init__(self, client, reference):
+        self._client = client
+        self._reference = reference
+        self.id = reference.id
+
+    async def get(self, field_paths=None, transaction=None):
+        await self._client._rpc()
+        return self._client._sync._read_one(self._reference)
+
+
+class _AsyncMemoryQuery:
+    def __init__(self, client, query):
+        self._client = client
+        self._query = query
+
+    def _wrap(name):
+        def method(self, *args, **kwargs):
+            return _AsyncMemoryQuery(self._client, getattr(self._query, name)(*args, **kwargs))
+        method.__name__ = name
+        return method
+
+    where = _wrap("where")
+    order_by = _wrap("order_by")
+    limit = _wrap("limit")
+    limit_to_last = _wrap("limit_to_last")
+    select = _wrap("select")
+    start_after = _wrap("start_after")
+    start_at = _wrap("start_at")
+    end_before = _wrap("end_before")
+    end_at = _wrap("end_at")
+    del _wrap
+
+    def document(self, document_id=None):
+        return _AsyncMemoryDocument(self._client, self._query.document(document_id))
+
+    async def stream(self, transaction=None):
+        await self._client._rpc()
+        for snapshot in self._query._run():
+            yield snapshot
+
+    async def get(self, transaction=None):
+        await self._client._rpc()
+        return self._query._run()
+
+
+class AsyncMemoryClient:
+    """
+    Read-only asyncio view of a MemoryClient, shaped like firestore.AsyncClient
+    (awaitable get(), async-iterable stream()). It shares the wrapped client's
+    data and stats; the simulated latency is awaited instead of slept.
+    """
+
+    def __init__(self, client):
+        self._sync = client
+
+    def collection(self, name):
+        return _AsyncMemoryQuery(self, self._sync.collection(name))
+
+    def document(self, path):
+        return _AsyncMemoryDocument(self, self._sync.document(path))
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        await self._rpc()
+        for ref in references:
+            yield self._sync._read_one(getattr(ref, "_reference", ref))
+
+    async def _rpc(self):
+        self._sync.stats.record(rpcs=1)
+        if self._sync.latency:
+            await asyncio.sleep(self._sync.latency)
@@ -0,0 +1,216 @@
+"""
+Archival of old messages into per-conversation chunk documents.
+
+Messages older than HOT_DAYS are folded, oldest first, into documents of
+the "messageArchive" collection holding up to CHUNK_MESSAGES of them each:
+
+    conversationId  the conversation the messages belong to
+    participants    [email_a, email_b], sorted
+    oldest, newest  timestamps of the first and last message
+    count           number of messages
+    messages        the messages, oldest first, each with its "id"
+
+A chunk is written and its messages deleted in one batch, so a message is
+always in exactly one of the two places and an interrupted run loses
+nothing. The archive holds the oldest part of each conversation; history
+reads continue into it once they scroll past the oldest hot message
+(conversations.history_page).
+
+archive_messages() walks the conversation summaries in ID order and saves
+its position in CHECKPOINT_COLLECTION/CHECKPOINT_DOC after each one, so a
+run that stops resumes where it left off, with the same cutoff.
+"""
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+import metrics
+
+ARCHIVE_COLLECTION = "messageArchive"
+CHECKPOINT_COLLECTION = "maintenance"
+CHECKPOINT_DOC = "messageArchive"
+# Messages younger than this stay in "messages"
+HOT_DAYS = float(os.environ.get("MESSAGE_HOT_DAYS", "90"))
+# A chunk and the deletes of its messages share one batch (at most 500 writes)
+CHUNK_MESSAGES = min(int(os.environ.get("ARCHIVE_CHUNK_MESSAGES", "400")), 499)
+# Well under Firestore's 1 MiB per document
+CHUNK_BYTES = 800_000
+# Fewer old messages than this wait for a later run rather than make a small chunk
+MIN_CHUNK_MESSAGES = int(os.environ.get("ARCHIVE_MIN_CHUNK_MESSAGES", "100"))
+# Per-message overhead in a chunk beyond its strings, roughly
+MESSAGE_OVERHEAD_BYTES = 120
+
+archived_messages_total = metrics.Counter(
+    "archived_messages_total", "Messages folded into archive chunks.")
+archive_chunks_total = metrics.Counter(
+    "archive_chunks_written_total", "Message archive chunks written.")
+reclaimed_documents_total = metrics.Counter(
+    "archive_reclaimed_documents_total", "Documents removed from Firestore by message archival.")
+archive_reads_total = metrics.Counter(
+    "archive_history_reads_total", "History pages that read archived messages.")
+ARCHIVE_METRICS = [archived_messages_total, archive_chunks_total, reclaimed_documents_total]
+metrics.METRICS.extend(ARCHIVE_METRICS + [archive_reads_total])
+
+
+def exposition():
+    """The archival counters in Prometheus text format, for a scheduled run's textfile collector."""
+    return "\n".join(line for metric in ARCHIVE_METRICS for line in metric.expose()) + "\n"
+
+
+#### Reading ####
+def is_archived(cursor):
+    """Whether a history cursor points into the archive."""
+    return cursor is not None and len(cursor) > 2
+
+
+def chunk_limit(count):
+    """
+    Chunks to read for `count` archived messages: chunks usually hold at
+    least MIN_CHUNK_MESSAGES, plus one for the chunk a cursor falls in.
+    """
+    return math.ceil(count / max(1, MIN_CHUNK_MESSAGES)) + 1
+
+
+def archive_query(db, conversation_id, before, count):
+    """
+    Query for the archive chunks holding the `count` archived messages of a
+    conversation that precede `before` (a [timestamp, id] cursor, or None),
+    newest chunk first.
+    """
+    query = db.collection(ARCHIVE_COLLECTION).where("conversationId", "==", conversation_id)
+    if before is not None:
+        query = query.where("oldest", "<=", before[0])
+    return query.order_by("oldest", direction="DESCENDING").limit(chunk_limit(count))
+
+
+def archived_page(chunks, before, count):
+    """The last `count` messages of `chunks` (archive_query's result) before `before`, oldest first."""
+    messages = []
+    for chunk in chunks:
+        for msg in reversed(chunk.to_dict().get("messages", [])):
+            if before is None or (msg.get("timestamp"), msg.get("id")) < (before[0], before[1]):
+                messages.append(msg)
+                if len(messages) == count:
+                    return messages[::-1]
+    return messages[::-1]
+
+
+#### Compaction ####
+def _size(msg):
+    return MESSAGE_OVERHEAD_BYTES + sum(len(value) for value in msg.values() if isinstance(value, str))
+
+
+def _chunk(conversation_id, messages):
+    return {
+        "conversationId": conversation_id,
+        "participants": sorted({messages[0].get("sender"), messages[0].get("receiver")} - {None}),
+        "oldest": messages[0]["timestamp"],
+        "newest": messages[-1]["timestamp"],
+        "count": len(messages),
+        "messages": messages,
+    }
+
+
+def old_messages(db, conversation_id, cutoff, page_size=CHUNK_MESSAGES):
+    """A conversation's messages older than `cutoff`, oldest first, each with its "id" and reference."""
+    query = (
+        db.collection("messages")
+          .where("conversationId", "==", conversation_id)
+          .where("timestamp", "<", cutoff)
+          .order_by("timestamp")
+          .order_by("__name__")
+    )
+    last = None
+    while True:
+        page = query.start_after(last) if last is not None else query
+        docs = list(page.limit(page_size).stream())
+        for doc in docs:
+            msg = doc.to_dict()
+            msg["id"] = doc.id
+            yield doc.reference, msg
+        if len(docs) < page_size:
+            return
+        last = docs[-1]
+
+
+def fold_conversation(db, conversation_id, cutoff, dry_run=False):
+    """
+    Fold the messages of one conversation older than `cutoff` into archive
+    chunks. Returns (messages archived, chunks written).
+    """
+    archived = chunks = 0
+    pending, size = [], 0
+
+    def fold(batch_items):
+        messages = [msg for _, msg in batch_items]
+        if not dry_run:
+            batch = db.batch()
+            # Named after its first message, so a retried fold rewrites the same chunk
+            batch.set(db.collection(ARCHIVE_COLLECTION).document(f"{conversation_id}_{messages[0]['id']}"),
+                      _chunk(conversation_id, messages))
+            for ref, _ in batch_items:
+                batch.delete(ref)
+            batch.commit()
+            archived_messages_total.inc(amount=len(messages))
+            archive_chunks_total.inc()
+            reclaimed_documents_total.inc(amount=len(messages) - 1)
+        return len(messages)
+
+    for ref, msg in old_messages(db, conversation_id, cutoff):
+        msg_size = _size(msg)
+        if pending and (len(pending) == CHUNK_MESSAGES or size + msg_size > CHUNK_BYTES):
+            archived += fold(pending)
+            chunks += 1
+            pending, size = [], 0
+        pending.append((ref, msg))
+        size += msg_size
+    if len(pending) >= MIN_CHUNK_MESSAGES:
+        archived += fold(pending)
+        chunks += 1
+    return archived, chunks
+
+
+def archive_messages(db, hot_days=HOT_DAYS, dry_run=False, restart=False, now=None, page_size=500):
+    """
+    Fold every conversation's messages older than `hot_days` into the
+    archive, resuming from the checkpoint of an unfinished run unless
+    `restart`. With `dry_run`, only counts what would be archived and
+    writes nothing. Returns the run's totals.
+    """
+    checkpoint_ref = db.collection(CHECKPOINT_COLLECTION).document(CHECKPOINT_DOC)
+    snapshot = checkpoint_ref.get()
+    checkpoint = snapshot.to_dict() if snapshot.exists else {}
+    if checkpoint.get("lastConversation") is not None and not restart and not dry_run:
+        cutoff = checkpoint["cutoff"]
+        totals = checkpoint["totals"]
+        last = checkpoint["lastConversation"]
+        print(f"Resuming message archival after conversation {last} (cutoff {cutoff.isoformat()})")
+    else:
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=hot_days)
+        totals = {"conversations": 0, "messages": 0, "chunks": 0, "reclaimed": 0}
+        last = None
+
+    summaries = db.collection("conversations").order_by("__name__")
+    while True:
+        page = summaries.start_after({"__name__": last}) if last is not None else summaries
+        docs = list(page.select([]).limit(page_size).stream())
+        for doc in docs:
+            archived, chunks = fold_conversation(db, doc.id, cutoff, dry_run)
+            totals["conversations"] += 1
+            totals["messages"] += archived
+            totals["chunks"] += chunks
+            totals["reclaimed"] += archived - chunks
+            last = doc.id
+            if not dry_run and archived:
+                checkpoint_ref.set({"cutoff": cutoff, "lastConversation": last, "totals": totals,
+                                    "updatedAt": firestore.SERVER_TIMESTAMP})
+        if len(docs) < page_size:
+            break
+
+    totals["cutoff"] = cutoff
+    if not dry_run:
+        checkpoint_ref.set({"cutoff": cutoff, "lastConversation": None, "totals": totals,
+                            "lastRun": totals, "updatedAt": firestore.SERVER_TIMESTAMP})
+    return totals
@@ -0,0 +1,232 @@
+"""
+Server-Sent Events fan-out for new messages and read receipts.
+
+Each worker keeps at most one Firestore listener per open conversation, on
+that conversation's summary document (see conversations.py). When the
+summary changes, the feed fetches only the messages newer than the last one
+it has seen and pushes them, together with read receipts derived from the
+unread counters, to every stream subscribed to that conversation.
+
+A new stream starts with the latest REPLAY_LIMIT messages; older ones are
+paged through GET /messages. Each message's event id is the history cursor
+of its (timestamp, id), so a reconnect resumes exactly after it and the
+oldest one received can be passed as `before`.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from conversations import conversation_id, participants, summary_ref, unread_count
+from pagination import decode_cursor, encode_cursor
+
+# Streams hold a worker thread each, so keep this below the gunicorn thread count
+MAX_STREAMS = int(os.environ.get("MESSAGE_STREAMS_PER_WORKER", "8"))
+HEARTBEAT_SECONDS = 15
+# Streams are closed after this long; EventSource reconnects with Last-Event-ID
+MAX_STREAM_SECONDS = 300
+SUBSCRIBER_QUEUE_SIZE = 100
+# Messages a new stream starts with, as many as a GET /messages page
+REPLAY_LIMIT = 50
+
+
+def parse_since(value):
+    """
+    Parse a Last-Event-ID (a [timestamp, id] cursor) or a `since` ISO 8601
+    timestamp into [timestamp, id or None]. Raises ValueError.
+    """
+    if not value:
+        return None
+    try:
+        cursor = decode_cursor(value)
+    except ValueError:
+        cursor = None
+    if cursor is not None and len(cursor) == 2 and isinstance(cursor[0], datetime):
+        return cursor
+    since = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return [since, None]
+
+
+def fetch_since(db, a, b, since):
+    """
+    Messages between a and b after the `since` cursor, oldest first; from
+    a bare timestamp, those at or after it. Without `since`, the latest
+    REPLAY_LIMIT.
+    """
+    query = (
+        db.collection("messages")
+          .where("conversationId", "==", conversation_id(a, b))
+          .order_by("timestamp")
+          .order_by("__name__")
+    )
+    if since is None:
+        # limit_to_last queries can't be streamed; run them with get()
+        docs = query.limit_to_last(REPLAY_LIMIT).get()
+    elif since[1] is None:
+        # Messages sharing the timestamp may be sent again; streams skip ids they sent
+        docs = query.start_at({"timestamp": since[0]}).stream()
+    else:
+        docs = query.start_after({"timestamp": since[0], "__name__": since[1]}).stream()
+    msgs = []
+    for doc in docs:
+        msg_data = doc.to_dict()
+        msg_data["id"] = doc.id
+        msgs.append(msg_data)
+    return msgs
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def message_event(msg):
+    msg = dict(msg)
+    timestamp = msg.get("timestamp")
+    event_id = encode_cursor([timestamp, msg["id"]])
+    if isinstance(timestamp, datetime):
+        msg["timestamp"] = timestamp.isoformat()
+    return format_event("message", msg, event_id=event_id)
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Set when the client falls too far behind; its stream ends and the
+        # browser reconnects with Last-Event-ID to catch up
+        self.overflowed = False
+
+    def offer(self, message_id, frame):
+        try:
+            self.queue.put_nowait((message_id, frame))
+        except queue.Full:
+            self.overflowed = True
+
+
+class ConversationFeed:
+    """One summary-document listener shared by every stream on a conversation."""
+
+    def __init__(self, db, a, b):
+        self._db = db
+        self.pair = participants(a, b)
+        self.subscribers = set()
+        self._lock = threading.Lock()
+        self._watch = None
+        self._last_timestamp = None
+        self._unread = None
+        self.ready = threading.Event()
+
+    def start(self):
+        self._watch = summary_ref(self._db, *self.pair).on_snapshot(self._on_summary)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def publish(self, message_id, frame):
+        for subscriber in list(self.subscribers):
+            subscriber.offer(message_id, frame)
+
+    def _on_summary(self, docs, changes, read_time):
+        summary = (docs[0].to_dict() if docs else None) or {}
+        unread = [unread_count(summary, self.pair, p) for p in self.pair]
+        last_timestamp = summary.get("lastTimestamp")
+        with self._lock:
+            first = self._unread is None
+            previous_unread, self._unread = self._unread, unread
+            previous_timestamp = self._last_timestamp
+            if last_timestamp is not None:
+                self._last_timestamp = max(last_timestamp, previous_timestamp or last_timestamp)
+        if first:
+            self.ready.set()
+            return
+        if last_timestamp is not None and (previous_timestamp is None or last_timestamp > previous_timestamp):
+            since = [previous_timestamp, None] if previous_timestamp is not None else None
+            for msg in fetch_since(self._db, self.pair[0], self.pair[1], since):
+                self.publish(msg["id"], message_event(msg))
+        for reader, before, after in zip(self.pair, previous_unread, unread):
+            if before and not after:
+                self.publish(None, format_event("read", {"reader": reader, "at": read_time.isoformat()}))
+
+
+class MessageHub:
+    """Per-worker registry of conversation feeds and the concurrent-stream cap."""
+
+    def __init__(self, db, max_streams=MAX_STREAMS):
+        self._db = db
+        self.max_streams = max_streams
+        self._feeds = {}
+        self._lock = threading.Lock()
+        self.active_streams = 0
+
+    def subscribe(self, a, b):
+        """Return (feed, subscriber), or None when the worker is at its stream cap."""
+        with self._lock:
+            if self.active_streams >= self.max_streams:
+                return None
+            key = tuple(participants(a, b))
+            feed = self._feeds.get(key)
+            if feed is None:
+                feed = ConversationFeed(self._db, a, b)
+                self._feeds[key] = feed
+                feed.start()
+            subscriber = Subscriber()
+            feed.subscribers.add(subscriber)
+            self.active_streams += 1
+            return feed, subscriber
+
+    def unsubscribe(self, feed, subscriber):
+        with self._lock:
+            feed.subscribers.discard(subscriber)
+            self.active_streams -= 1
+            if not feed.subscribers:
+                feed.stop()
+                self._feeds.pop(tuple(feed.pair), None)
+
+    def stream(self, feed, subscriber, since):
+        """Generator of SSE frames: the delta since the `since` cursor (or the latest messages), then live events."""
+        # Subscribing happens before the catch-up query, so a message can arrive
+        # both ways; ids already sent are skipped
+        seen = set()
+        try:
+            yield "retry: 3000\n\n"
+            # Wait for the feed's first snapshot so nothing falls between the two
+            feed.ready.wait(5)
+            for msg in fetch_since(self._db, feed.pair[0], feed.pair[1], since):
+                seen.add(msg["id"])
+                yield message_event(msg)
+            deadline = time.monotonic() + MAX_STREAM_SECONDS
+            while time.monotonic() < deadline and not subscriber.overflowed:
+                try:
+                    message_id, frame = subscriber.queue.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message_id is not None:
+                    if message_id in seen:
+                        continue
+                    seen.add(message_id)
+                yield frame
+        finally:
+            self.unsubscribe(feed, subscriber)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub(db):
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = MessageHub(db)
+        return _hub
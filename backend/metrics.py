@@ -0,0 +1,382 @@
+"""
+Request and Firestore metrics in the Prometheus text format.
+
+`instrument(db)` wraps the Firestore client so that every document read,
+document write, query and RPC made through it is counted. The counts go to
+the per-route totals and to the request being served: install(app) opens a
+RequestUsage for each request, adds an X-Firestore-Reads header to the
+response and exposes everything on GET /metrics.
+
+Reads are counted the way Firestore bills them: one per document a get or
+query returns, and at least one per query. Documents delivered to snapshot
+listeners (the listings replica, message streams) count under the
+"(listener)" route, and work done outside a request under "(background)".
+
+Every worker process keeps its own registry, so a scrape sees the worker it
+reached; run one scrape target per worker or sum over `instance`.
+"""
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import partial
+
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+READS_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+LISTENER_ROUTE = "(listener)"
+BACKGROUND_ROUTE = "(background)"
+# Adds the X-Firestore-Reads header to every response
+READS_HEADER = os.environ.get("FIRESTORE_READS_HEADER", "1") != "0"
+
+
+#### Registry ####
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def mean(self, *labels):
+        """(observations, their mean) for one label set."""
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                return 0, 0.0
+            count = sum(entry[0])
+            return count, entry[1] / count
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (_number(bound),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests served.", ("method", "route", "status"))
+http_latency = Histogram(
+    "http_request_duration_seconds", "Time to produce the response.", ("method", "route"))
+firestore_reads = Counter(
+    "firestore_document_reads_total", "Documents read from Firestore.", ("route",))
+firestore_writes = Counter(
+    "firestore_document_writes_total", "Documents written to Firestore.", ("route",))
+firestore_queries = Counter(
+    "firestore_queries_total", "Firestore queries run.", ("route",))
+firestore_rpc_latency = Histogram(
+    "firestore_rpc_duration_seconds", "Time spent waiting on Firestore, per RPC.", ("op",))
+reads_per_request = Histogram(
+    "firestore_reads_per_request", "Documents read while serving one request.", ("route",),
+    buckets=READS_BUCKETS)
+
+METRICS = [http_requests, http_latency, firestore_reads, firestore_writes, firestore_queries,
+           firestore_rpc_latency, reads_per_request]
+
+
+def exposition():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+#### Per-request accounting ####
+class RequestUsage:
+    """Firestore work done on behalf of one request."""
+
+    def __init__(self, route):
+        self.route = route
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+
+    def record(self, reads=0, writes=0, queries=0):
+        with self._lock:
+            self.reads += reads
+            self.writes += writes
+            self.queries += queries
+
+
+_usage = contextvars.ContextVar("firestore_usage", default=None)
+
+
+def current_usage():
+    """The RequestUsage of the request being served, or None."""
+    return _usage.get()
+
+
+def record(reads=0, writes=0, queries=0, route=None):
+    usage = _usage.get()
+    if route is None:
+        route = usage.route if usage is not None else BACKGROUND_ROUTE
+    if usage is not None and route == usage.route:
+        usage.record(reads, writes, queries)
+    if reads:
+        firestore_reads.inc(route, amount=reads)
+    if writes:
+        firestore_writes.inc(route, amount=writes)
+    if queries:
+        firestore_queries.inc(route, amount=queries)
+
+
+#### Instrumented client ####
+# Methods that return another client object (reference, query, batch)
+_CHAINED = frozenset({
+    "collection", "document", "where", "order_by", "limit", "limit_to_last", "select",
+    "offset", "start_after", "start_at", "end_before", "end_at", "batch",
+})
+_WRITES = frozenset({"set", "create", "update", "delete"})
+
+
+def unwrap(obj):
+    """The client object behind an instrumented one."""
+    if isinstance(obj, _Traced):
+        return object.__getattribute__(obj, "_target")
+    if isinstance(obj, _TracedSnapshot):
+        return obj._snapshot
+    return obj
+
+
+class _Traced:
+    """Forwards to a Firestore client object, counting the RPCs made through it."""
+
+    __slots__ = ("_target", "_queued")
+
+    def __init__(self, target):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_queued", 0)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name == "parent" and value is not None:
+            return _Traced(value)
+        if not callable(value) or name.startswith("_"):
+            return value
+        return partial(self._call, name, value)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __eq__(self, other):
+        return self._target == unwrap(other)
+
+    def __hash__(self):
+        return hash(self._target)
+
+    def __len__(self):
+        return len(self._target)
+
+    def __repr__(self):
+        return f"<instrumented {self._target!r}>"
+
+    def _call(self, name, method, *args, **kwargs):
+        args = [unwrap(arg) for arg in args]
+        kwargs = {key: unwrap(value) for key, value in kwargs.items()}
+        if name in _CHAINED:
+            return _Traced(method(*args, **kwargs))
+        is_batch = hasattr(self._target, "commit")
+
+        if name in _WRITES and is_batch:
+            object.__setattr__(self, "_queued", self._queued + 1)
+            return method(*args, **kwargs)
+        if name in _WRITES or name == "add":
+            result = _timed("write", method, *args, **kwargs)
+            record(writes=1)
+            if name == "add":
+                return result[0], _Traced(result[1])
+            return result
+        if name == "commit":
+            writes = self._queued
+            object.__setattr__(self, "_queued", 0)
+            result = _timed("commit", method, *args, **kwargs)
+            record(writes=writes)
+            return result
+
+        if name == "get" and not hasattr(self._target, "where"):
+            # DocumentReference.get
+            snapshot = _timed("get", method, *args, **kwargs)
+            record(reads=1)
+            return _TracedSnapshot(snapshot)
+        if name == "get":
+            snapshots = _timed("query", method, *args, **kwargs)
+            record(reads=max(1, len(snapshots)), queries=1)
+            return [_TracedSnapshot(s) for s in snapshots]
+        if name == "stream":
+            return _stream("query", method(*args, **kwargs), query=True)
+        if name == "get_all":
+            args[0] = [unwrap(ref) for ref in args[0]]
+            return _stream("get_all", method(*args, **kwargs), query=False)
+        if name in ("collections", "list_documents"):
+            result = _timed("list", method, *args, **kwargs)
+            record(reads=1)
+            return [_Traced(item) for item in result]
+        if name == "on_snapshot":
+            return method(partial(_listener, args[0]), *args[1:], **kwargs)
+        return method(*args, **kwargs)
+
+
+class _TracedSnapshot:
+    """A snapshot whose .reference is instrumented too."""
+
+    __slots__ = ("_snapshot",)
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    @property
+    def reference(self):
+        return _Traced(self._snapshot.reference)
+
+    def __getattr__(self, name):
+        return getattr(self._snapshot, name)
+
+
+def _timed(op, method, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return method(*args, **kwargs)
+    finally:
+        firestore_rpc_latency.observe(time.perf_counter() - started, op)
+
+
+def _stream(op, results, query):
+    # Only time spent inside the iterator counts, not the caller's work per document
+    count, waited = 0, 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                snapshot = next(results)
+            except StopIteration:
+                break
+            finally:
+                waited += time.perf_counter() - started
+            count += 1
+            yield _TracedSnapshot(snapshot)
+    finally:
+        firestore_rpc_latency.observe(waited, op)
+        record(reads=max(1, count) if query else count, queries=1 if query else 0)
+
+
+def _listener(callback, snapshots, changes, read_time):
+    record(reads=len(changes), route=LISTENER_ROUTE)
+    return callback(snapshots, changes, read_time)
+
+
+def instrument(db):
+    """`db` with every read, write and query counted."""
+    return _Traced(db)
+
+
+def start_request(route):
+    """Open the RequestUsage of a request; returns it with the token to close it."""
+    usage = RequestUsage(route)
+    return usage, _usage.set(usage)
+
+
+def finish_request(usage, method, status, elapsed):
+    http_requests.inc(method, usage.route, str(status))
+    http_latency.observe(elapsed, method, usage.route)
+    # Requests shed by admission.py read nothing and would drag its route costs down
+    if status not in (429, 503):
+        reads_per_request.observe(usage.reads, usage.route)
+
+
+def end_request(token):
+    _usage.reset(token)
+
+
+#### Flask integration ####
+def _begin():
+    rule = request.url_rule
+    g.metrics_started = time.perf_counter()
+    g.metrics_usage, g.metrics_token = start_request(rule.rule if rule is not None else "(unmatched)")
+
+
+def _finish(response):
+    usage = g.get("metrics_usage")
+    if usage is None:
+        return response
+    method, started = request.method, g.metrics_started
+    if response.is_streamed:
+        # Streamed pages read Firestore while they are sent; count them once sent
+        response.call_on_close(
+            lambda: finish_request(usage, method, response.status_code, time.perf_counter() - started))
+    else:
+        finish_request(usage, method, response.status_code, time.perf_counter() - started)
+        if READS_HEADER:
+            response.headers["X-Firestore-Reads"] = str(usage.reads)
+    return response
+
+
+def _teardown(exc):
+    token = g.pop("metrics_token", None)
+    if token is not None:
+        end_request(token)
+
+
+def install(app):
+    """Count every request of `app` and serve the registry on GET /metrics."""
+    # Registered ahead of the app's own hooks, so requests they reject are counted too
+    app.before_request_funcs.setdefault(None, []).insert(0, _begin)
+    app.after_request(_finish)
+    app.teardown_request(_teardown)
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(exposition(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,61 @@
+"""
+Opaque cursors and page sizes for the paginated endpoints.
+
+A cursor is the urlsafe-base64 JSON encoding of the sort-key values of the
+last item on a page. Clients must treat it as opaque and pass it back
+unchanged as `cursor` to fetch the next page.
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import datetime, timezone
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Newest-first listing pages are streamed, so they may be much longer
+MAX_STREAM_LIMIT = int(os.environ.get("MAX_STREAM_LIMIT", "10000"))
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return {"ts": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "ts" in value:
+        return datetime.fromisoformat(value["ts"])
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return the list of values in a cursor, or None for an empty token. Raises ValueError."""
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list):
+            raise ValueError
+        return [_decode_value(v) for v in values]
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def parse_limit(raw, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    """Parse a `limit` parameter, clamped to [1, maximum]. Raises ValueError."""
+    if raw is None or raw == "":
+        return default
+    try:
+        limit = int(raw)
+    except (ValueError, TypeError):
+        raise ValueError("limit must be an integer")
+    return max(1, min(limit, maximum))
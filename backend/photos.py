@@ -0,0 +1,349 @@
+"""
+Listing photo uploads: content-addressed storage and background resizing.
+
+POST /photos streams the upload to a temporary file while hashing it, so a
+photo's ID is the SHA-256 of its bytes. The "photos/{id}" document claims
+the ID; an upload whose ID already exists is answered from that document
+without storing anything again. The original is stored as
+"photos/{id}/original", and a bounded process pool renders every size in
+VARIANT_WIDTHS as JPEG and WebP ("photos/{id}/{size}.jpg", ".webp") off the
+request path.
+
+Objects never change once written, so they are served with a one-year
+immutable Cache-Control. Storage is a Cloud Storage bucket
+(PHOTO_STORAGE=gcs, PHOTO_BUCKET) or a local directory served by the app
+(PHOTO_STORAGE=local, PHOTO_DIR), the default on the memory backend.
+
+Listings keep photo IDs in "photos" (older listings hold external URLs, which
+pass through unchanged) and responses add "photoUrls" with the URL of every
+size.
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import AlreadyExists
+
+from firebase_admin_setup import STORAGE_BACKEND, load_credentials
+from listing_schema import PHOTO_ID
+
+log = logging.getLogger(__name__)
+
+COLLECTION = "photos"
+# size -> longest side in pixels
+VARIANT_WIDTHS = {"thumb": 320, "card": 800, "full": 1600}
+FORMATS = {"jpg": "image/jpeg", "webp": "image/webp"}
+MAX_PHOTO_BYTES = int(os.environ.get("MAX_PHOTO_BYTES", str(10 * 1024 * 1024)))
+# Larger images are rejected before decoding
+MAX_PIXELS = 40_000_000
+# Processes rendering sizes, and uploads that may wait for them
+PHOTO_WORKERS = int(os.environ.get("PHOTO_WORKERS", "2"))
+PHOTO_QUEUE_SIZE = int(os.environ.get("PHOTO_QUEUE_SIZE", "16"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+CHUNK_SIZE = 64 * 1024
+
+PHOTO_STORAGE = os.environ.get("PHOTO_STORAGE", "local" if STORAGE_BACKEND == "memory" else "gcs")
+PHOTO_DIR = os.environ.get("PHOTO_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+PHOTO_BUCKET = os.environ.get("PHOTO_BUCKET", "")
+# Prefix of photo URLs; a CDN in front of the bucket, or empty for the
+# app's own /photos route (the frontend prefixes its API base)
+PHOTO_BASE_URL = os.environ.get(
+    "PHOTO_BASE_URL",
+    f"https://storage.googleapis.com/{PHOTO_BUCKET}" if PHOTO_STORAGE == "gcs" else "",
+).rstrip("/")
+
+VARIANT_NAME = re.compile(r"^(original|(%s)\.(%s))$" % ("|".join(VARIANT_WIDTHS), "|".join(FORMATS)))
+
+
+class PhotoTooLarge(Exception):
+    pass
+
+
+class UploadsBusy(Exception):
+    """Every slot of the resizing queue is taken."""
+
+
+def sniff_type(head):
+    """Content type of an image from its first bytes, or None if it isn't JPEG, PNG or WebP."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def object_key(photo_id, name):
+    return f"photos/{photo_id}/{name}"
+
+
+def photo_url(photo_id, name):
+    return f"{PHOTO_BASE_URL}/{object_key(photo_id, name)}"
+
+
+def photo_urls(photos):
+    """The "photoUrls" of a listing's "photos": every size of uploaded photos, external URLs as is."""
+    urls = []
+    for photo in photos if isinstance(photos, list) else ():
+        if not isinstance(photo, str):
+            continue
+        if not PHOTO_ID.match(photo):
+            urls.append({"original": photo})
+            continue
+        entry = {"id": photo, "original": photo_url(photo, "original")}
+        for ext in FORMATS:
+            entry[ext] = {size: photo_url(photo, f"{size}.{ext}") for size in VARIANT_WIDTHS}
+        urls.append(entry)
+    return urls
+
+
+#### Storage ####
+class LocalStorage:
+    """Objects as files under `root`, served by GET /photos/<id>/<name>."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def download_to(self, key, filename):
+        shutil.copyfile(self.path(key), filename)
+
+    def put(self, key, fileobj, content_type):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name so a reader never sees half a file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as out:
+            shutil.copyfileobj(fileobj, out, CHUNK_SIZE)
+        os.replace(tmp, path)
+
+
+class CloudStorage:
+    """Objects in a Cloud Storage bucket, served from PHOTO_BASE_URL."""
+
+    def __init__(self, bucket_name):
+        from google.cloud import storage
+        cred = load_credentials()
+        client = storage.Client(project=cred.project_id, credentials=cred.get_credential())
+        self.bucket = client.bucket(bucket_name)
+
+    def download_to(self, key, filename):
+        self.bucket.blob(key).download_to_filename(filename)
+
+    def put(self, key, fileobj, content_type):
+        blob = self.bucket.blob(key)
+        blob.cache_control = IMMUTABLE
+        blob.upload_from_file(fileobj, content_type=content_type)
+
+
+_storage = None
+_storage_pid = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """This process's storage backend (created after gunicorn forks, like the Firestore client)."""
+    global _storage, _storage_pid
+    with _storage_lock:
+        if _storage is None or _storage_pid != os.getpid():
+            if PHOTO_STORAGE == "gcs":
+                if not PHOTO_BUCKET:
+                    raise Exception("PHOTO_BUCKET environment variable is missing")
+                _storage = CloudStorage(PHOTO_BUCKET)
+            else:
+                _storage = LocalStorage(PHOTO_DIR)
+            _storage_pid = os.getpid()
+        return _storage
+
+
+#### Resizing ####
+def render_variants(path):
+    """
+    {"<size>.<ext>": bytes} for every size and format, plus the original's
+    (width, height). Runs in the process pool.
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    with Image.open(path) as image:
+        if image.width * image.height > MAX_PIXELS:
+            raise ValueError("image has too many pixels")
+        image = ImageOps.exif_transpose(image)
+        size = image.size
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        variants = {}
+        for name, width in VARIANT_WIDTHS.items():
+            resized = image.copy()
+            resized.thumbnail((width, width), Image.LANCZOS)
+            for ext in FORMATS:
+                out = io.BytesIO()
+                if ext == "jpg":
+                    flat = resized
+                    if has_alpha:
+                        flat = Image.new("RGB", resized.size, (255, 255, 255))
+                        flat.paste(resized, mask=resized.getchannel("A"))
+                    flat.save(out, "JPEG", quality=82, optimize=True, progressive=True)
+                else:
+                    resized.save(out, "WEBP", quality=80, method=4)
+                variants[f"{name}.{ext}"] = out.getvalue()
+    return variants, size
+
+
+class PhotoPipeline:
+    """Stores uploads and renders their sizes in a bounded process pool."""
+
+    def __init__(self, db):
+        self._db = db
+        self._slots = threading.BoundedSemaphore(PHOTO_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._threads = None
+        self.rendered = 0
+        self.failed = 0
+        self.deduplicated = 0
+
+    def _executors(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: the workers of a threaded server must not fork
+                self._pool = ProcessPoolExecutor(
+                    max_workers=PHOTO_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                # Waits on the pool and uploads its output
+                self._threads = ThreadPoolExecutor(max_workers=PHOTO_WORKERS, thread_name_prefix="photos")
+            return self._pool, self._threads
+
+    def upload(self, stream, uploaded_by=None):
+        """
+        Store the image in `stream` and queue its resizing. Returns
+        (photo document, created). Raises ValueError for something that is
+        not a JPEG, PNG or WebP, PhotoTooLarge and UploadsBusy.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise UploadsBusy()
+        tmp = None
+        queued = False
+        try:
+            tmp, photo_id, size, content_type = self._spool(stream)
+            doc_ref = self._db.collection(COLLECTION).document(photo_id)
+            photo = {
+                "contentType": content_type,
+                "bytes": size,
+                "status": "processing",
+                "uploadedBy": uploaded_by,
+                "createdAt": datetime.now(timezone.utc),
+            }
+            try:
+                doc_ref.create(photo)
+            except AlreadyExists:
+                self.deduplicated += 1
+                existing = doc_ref.get().to_dict() or photo
+                return {**existing, "id": photo_id}, False
+
+            try:
+                with open(tmp, "rb") as f:
+                    get_storage().put(object_key(photo_id, "original"), f, content_type)
+            except Exception:
+                doc_ref.delete()
+                raise
+            pool, threads = self._executors()
+            threads.submit(self._render, pool, doc_ref, photo_id, tmp)
+            queued = True
+            return {**photo, "id": photo_id}, True
+        finally:
+            # Once queued, the temporary file and the slot belong to _render
+            if not queued:
+                if tmp is not None:
+                    os.unlink(tmp)
+                self._slots.release()
+
+    def _spool(self, stream):
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        fd, tmp = tempfile.mkstemp(prefix="photo-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > MAX_PHOTO_BYTES:
+                        raise PhotoTooLarge()
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    digest.update(chunk)
+                    out.write(chunk)
+            content_type = sniff_type(head)
+            if content_type is None:
+                raise ValueError("Upload a JPEG, PNG or WebP image")
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return tmp, digest.hexdigest(), size, content_type
+
+    def _render(self, pool, doc_ref, photo_id, tmp):
+        try:
+            variants, (width, height) = pool.submit(render_variants, tmp).result()
+            storage = get_storage()
+            for name, data in variants.items():
+                storage.put(object_key(photo_id, name), io.BytesIO(data), FORMATS[name.rsplit(".", 1)[1]])
+            doc_ref.update({"status": "ready", "width": width, "height": height,
+                            "variants": sorted(variants)})
+            self.rendered += 1
+        except Exception as e:
+            self.failed += 1
+            log.warning(f"Resizing photo {photo_id} failed: {e}")
+            doc_ref.update({"status": "failed"})
+        finally:
+            os.unlink(tmp)
+            self._slots.release()
+
+    def rerender(self, photo_id):
+        """Queue the sizes of a stored photo again (CLI, for "failed" photos)."""
+        if not self._slots.acquire(blocking=False):
+            raise UploadsBusy()
+        fd, tmp = tempfile.mkstemp(prefix="photo-")
+        os.close(fd)
+        try:
+            get_storage().download_to(object_key(photo_id, "original"), tmp)
+        except BaseException:
+            os.unlink(tmp)
+            self._slots.release()
+            raise
+        pool, threads = self._executors()
+        return threads.submit(self._render, pool, self._db.collection(COLLECTION).document(photo_id), photo_id, tmp)
+
+    def wait_idle(self):
+        """Block until nothing is queued (tests and the CLI)."""
+        for _ in range(PHOTO_QUEUE_SIZE):
+            self._slots.acquire()
+        for _ in range(PHOTO_QUEUE_SIZE):
+            self._slots.release()
+
+    def stats(self):
+        return {"rendered": self.rendered, "failed": self.failed, "deduplicated": self.deduplicated}
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline(db):
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = PhotoPipeline(db)
+        return _pipeline
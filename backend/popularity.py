@@ -0,0 +1,308 @@
+"""
+Listing popularity: view and contact counters, and the popular-listings
+ranking served by GET /listings/popular.
+
+GET /listings/<id> records a view and POST /messages (with a listing_id) a
+contact. Events are summed in process and flushed every FLUSH_SECONDS as
+one increment per listing to a random one of SHARDS counter documents
+("listingCounters/{listingId}_{shard}"), so a popular listing spreads its
+writes instead of hitting one document's sustained write limit.
+
+A listing's popularity is its events weighted by EVENT_WEIGHTS and decayed
+with a half-life of HALF_LIFE_HOURS. Each event is stored already grown by
+e^(λ·age within its week) under "scores.<week>", so the counters only ever
+need increments. Decaying every listing by the same factor doesn't change
+their order, which lets rank() recompute only the listings whose counters
+changed since its last run and merge them into the previous top TOP_N. The
+result, with the card fields of each listing, is one document
+("popularity/listings") that the endpoint reads through the document cache.
+"""
+import atexit
+import logging
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.cloud.firestore_v1 import transforms
+
+from bulk_writes import DEFAULT_WORKERS, NOT_APPLIED, BulkWriteError, WriteOp, bulk_write
+from listings_replica import get_replica
+from photos import photo_urls
+
+log = logging.getLogger(__name__)
+
+COUNTERS = "listingCounters"
+RANKING_COLLECTION = "popularity"
+RANKING_DOC = "listings"
+EVENT_FIELDS = {"view": "views", "contact": "contacts"}
+EVENT_WEIGHTS = {"view": 1.0, "contact": 5.0}
+SHARDS = int(os.environ.get("POPULARITY_SHARDS", "10"))
+FLUSH_SECONDS = float(os.environ.get("POPULARITY_FLUSH_SECONDS", "10"))
+RANK_SECONDS = float(os.environ.get("POPULARITY_RANK_SECONDS", "60"))
+HALF_LIFE_HOURS = float(os.environ.get("POPULARITY_HALF_LIFE_HOURS", "72"))
+# POPULARITY_RANKER=0 leaves the ranking to the rank-popular-listings command
+RANKER_ENABLED = os.environ.get("POPULARITY_RANKER", "1") != "0"
+TOP_N = 50
+# Shard writes are stamped by the server; scan a little before the last run
+CLOCK_SKEW = timedelta(seconds=30)
+CARD_FIELDS = ("title", "price", "address", "availableFrom", "availableTo", "furnished", "parking")
+
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+WEEK = timedelta(days=7)
+_DECAY_RATE = math.log(2) / (HALF_LIFE_HOURS * 3600)
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _week(when):
+    return (when - EPOCH) // WEEK
+
+
+def event_score(event, when):
+    """(week, score) an event adds to its listing's "scores.<week>"."""
+    week = _week(when)
+    age = (when - (EPOCH + week * WEEK)).total_seconds()
+    return week, EVENT_WEIGHTS[event] * math.exp(_DECAY_RATE * age)
+
+
+def decayed_score(scores, now):
+    """A listing's popularity at `now`, from its summed "scores" map."""
+    total = 0.0
+    for week, value in scores.items():
+        start = EPOCH + int(week) * WEEK
+        total += value * math.exp(-_DECAY_RATE * (now - start).total_seconds())
+    return total
+
+
+def card(listing_id, listing):
+    """The fields of a listing the popular list shows."""
+    urls = photo_urls((listing.get("photos") or [])[:1])
+    photo = None
+    if urls:
+        photo = urls[0]["jpg"]["card"] if "jpg" in urls[0] else urls[0]["original"]
+    return {"id": listing_id, **{field: listing.get(field) for field in CARD_FIELDS}, "photo": photo}
+
+
+#### Counters ####
+class PopularityRecorder:
+    """Sums events in process and flushes them to the sharded counters."""
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        # (listing id, week) -> {"views", "contacts", "score"}
+        self._pending = {}
+        self._thread = None
+        self.flushed = 0
+
+    def record(self, listing_id, event, when=None):
+        week, score = event_score(event, when or _utcnow())
+        self._ensure_started()
+        with self._lock:
+            counts = self._pending.setdefault((listing_id, week), {"views": 0, "contacts": 0, "score": 0.0})
+            counts[EVENT_FIELDS[event]] += 1
+            counts["score"] += score
+
+    def _ensure_started(self):
+        # Started on first use, so the thread exists after gunicorn forks
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="popularity-flush", daemon=True)
+            self._thread.start()
+        # Commits inline: no new threads may start at interpreter exit
+        atexit.register(self.flush, max_workers=0)
+        start_ranker(self._db)
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            self.flush()
+
+    def flush(self, max_workers=DEFAULT_WORKERS):
+        """
+        Write the pending events. Counters whose chunk failed before it was
+        applied stay pending for the next flush; those whose commit may have
+        been applied (a timeout) are dropped, so no event is counted twice.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        counters = self._db.collection(COUNTERS)
+        ops = []
+        for (listing_id, week), counts in pending.items():
+            shard = random.randrange(SHARDS)
+            ops.append(WriteOp("set", counters.document(f"{listing_id}_{shard}"), {
+                "listingId": listing_id,
+                "views": transforms.Increment(counts["views"]),
+                "contacts": transforms.Increment(counts["contacts"]),
+                "scores": {str(week): transforms.Increment(counts["score"])},
+                "updatedAt": transforms.SERVER_TIMESTAMP,
+            }, merge=True))
+        try:
+            # Increments apply again on every retry, so only retry commits that weren't applied
+            bulk_write(self._db, ops, max_workers=max_workers, retryable=NOT_APPLIED)
+        except BulkWriteError as e:
+            retry = {id(op) for chunk, error in e.failed if isinstance(error, NOT_APPLIED) for op in chunk}
+            lost = sum(len(chunk) for chunk, _ in e.failed) - len(retry)
+            log.warning(f"Popularity flush failed, keeping {len(retry)} counters and dropping {lost}: {e}")
+            self._requeue({key: counts for (key, counts), op in zip(pending.items(), ops) if id(op) in retry})
+            self.flushed += e.result.writes
+            return e.result.writes
+        except Exception as e:
+            # Nothing was committed
+            log.warning(f"Popularity flush failed, keeping {len(pending)} counters: {e}")
+            self._requeue(pending)
+            return 0
+        self.flushed += len(ops)
+        return len(ops)
+
+    def _requeue(self, pending):
+        with self._lock:
+            for key, counts in pending.items():
+                current = self._pending.setdefault(key, {"views": 0, "contacts": 0, "score": 0.0})
+                for field, value in counts.items():
+                    current[field] += value
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+
+#### Ranking ####
+def listing_totals(db, listing_ids, now):
+    """{listing id: (views, contacts, score)} summed over every shard."""
+    counters = db.collection(COUNTERS)
+    refs = [counters.document(f"{listing_id}_{shard}") for listing_id in listing_ids for shard in range(SHARDS)]
+    totals = {listing_id: [0, 0, {}] for listing_id in listing_ids}
+    for doc in db.get_all(refs):
+        if not doc.exists:
+            continue
+        data = doc.to_dict()
+        entry = totals.get(data.get("listingId"))
+        if entry is None:
+            continue
+        entry[0] += data.get("views", 0)
+        entry[1] += data.get("contacts", 0)
+        for week, value in (data.get("scores") or {}).items():
+            entry[2][week] = entry[2].get(week, 0.0) + value
+    return {
+        listing_id: (views, contacts, decayed_score(scores, now))
+        for listing_id, (views, contacts, scores) in totals.items()
+    }
+
+
+def load_cards(db, listing_ids):
+    """{listing id: card} for the listings that still exist."""
+    replica = get_replica(db)
+    cards = {}
+    if replica is not None:
+        for listing_id in listing_ids:
+            listing = replica.get(listing_id)
+            if listing is not None:
+                cards[listing_id] = card(listing_id, listing)
+        return cards
+    listings = db.collection("listings")
+    for doc in db.get_all([listings.document(listing_id) for listing_id in listing_ids]):
+        if doc.exists:
+            cards[doc.id] = card(doc.id, doc.to_dict())
+    return cards
+
+
+def rank(db, now=None, force=False):
+    """
+    Bring the popular-listings document up to date. Skipped (returns None)
+    when another worker ranked within the last RANK_SECONDS, unless `force`.
+    Returns the number of listings whose counters were re-read.
+    """
+    now = now or _utcnow()
+    ranking_ref = db.collection(RANKING_COLLECTION).document(RANKING_DOC)
+    current = ranking_ref.get()
+    previous = current.to_dict() if current.exists else {}
+    computed_at = previous.get("computedAt")
+    if not force and computed_at is not None and (now - computed_at).total_seconds() < RANK_SECONDS * 0.9:
+        return None
+
+    counters = db.collection(COUNTERS)
+    if computed_at is None:
+        changed_docs = counters.stream()
+    else:
+        changed_docs = counters.where("updatedAt", ">=", computed_at - CLOCK_SKEW).stream()
+    changed = {doc.to_dict().get("listingId") for doc in changed_docs}
+    changed.discard(None)
+
+    # The unchanged entries only decay, by the same factor for all of them
+    factor = math.exp(-_DECAY_RATE * (now - computed_at).total_seconds()) if computed_at else 1.0
+    entries = {
+        entry["id"]: (entry["views"], entry["contacts"], entry["score"] * factor)
+        for entry in previous.get("listings", [])
+        if entry["id"] not in changed
+    }
+    entries.update(listing_totals(db, changed, now))
+    top = sorted(entries.items(), key=lambda item: item[1][2], reverse=True)[:TOP_N]
+
+    cards = load_cards(db, [listing_id for listing_id, _ in top])
+    ranking_ref.set({
+        "listings": [
+            {**cards[listing_id], "views": views, "contacts": contacts, "score": score}
+            for listing_id, (views, contacts, score) in top
+            if listing_id in cards
+        ],
+        "computedAt": now,
+    })
+    return len(changed)
+
+
+class Ranker:
+    """Re-ranks every RANK_SECONDS on a background thread."""
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self._thread = None
+        self.runs = 0
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="popularity-ranker", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if rank(self._db) is not None:
+                    self.runs += 1
+            except Exception as e:
+                log.warning(f"Ranking popular listings failed: {e}")
+            time.sleep(RANK_SECONDS)
+
+
+_recorder = None
+_ranker = None
+_lock = threading.Lock()
+
+
+def get_recorder(db):
+    global _recorder
+    with _lock:
+        if _recorder is None:
+            _recorder = PopularityRecorder(db)
+        return _recorder
+
+
+def start_ranker(db):
+    """Start this process's ranker, unless POPULARITY_RANKER=0."""
+    global _ranker
+    if not RANKER_ENABLED:
+        return
+    with _lock:
+        if _ranker is None:
+            _ranker = Ranker(db)
+    _ranker.ensure_started()
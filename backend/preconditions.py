@@ -0,0 +1,61 @@
+"""
+Document versions and write preconditions.
+
+A document's version is its Firestore update time, written as an RFC 3339
+string with nanoseconds. GET /listings/<id> and GET /users/<email> send it as
+their ETag; a client that echoes it in If-Match on PUT or DELETE gets 412
+Precondition Failed if someone else wrote the document in between, instead
+of overwriting their change.
+
+The writes themselves carry a Firestore precondition (`exists` or
+`last_update_time`), so Firestore checks the version in the same round trip
+as the write and the handler never has to read the document back.
+"""
+from datetime import timezone
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from serializers import base_etag
+
+# Times a write is retried when its pre-image went stale underneath it
+MAX_ATTEMPTS = 3
+
+
+class VersionMismatch(Exception):
+    """The If-Match version is not the document's current version."""
+
+
+def encode_version(update_time):
+    if isinstance(update_time, DatetimeWithNanoseconds):
+        return update_time.rfc3339()
+    return update_time.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def parse_version(value):
+    """The update time a version string stands for. Raises ValueError."""
+    try:
+        return DatetimeWithNanoseconds.from_rfc3339(value)
+    except (TypeError, ValueError):
+        raise ValueError("If-Match must be a version returned in an ETag")
+
+
+def expected_version(request):
+    """
+    Update time required by the request's If-Match header, or None when the
+    header is absent or "*". Raises ValueError.
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    tags = if_match.as_set(include_weak=False)
+    if len(tags) != 1:
+        raise ValueError("If-Match must carry exactly one strong version")
+    # The ETag of a compressed or projected response carries a suffix
+    return parse_version(base_etag(next(iter(tags))))
+
+
+def write_option(db, update_time=None):
+    """Precondition for a write: unchanged since update_time, or merely existing."""
+    if update_time is not None:
+        return db.write_option(last_update_time=update_time)
+    return db.write_option(exists=True)
@@ -0,0 +1,314 @@
+"""
+Saved searches and new-listing alerts.
+
+A saved search is a /listings/filter body stored in the "savedSearches"
+collection:
+
+    userEmail   owner
+    name        label shown to the owner
+    criteria    the filter body (title, q, minPrice, maxPrice, furnished,
+                parking, startDate, endDate, availability, minOverlapDays,
+                radiusMiles, near)
+    createdAt
+
+Every worker keeps a SavedSearchIndex of all saved searches, fed by a
+Firestore listener on that collection. Each search is filed under one
+"access key", the most selective criterion it has: a keyword (a search
+keyword can only match listings that contain it), or furnished or parking.
+A search with none of these is filed as unindexed. Within a key, searches
+are ordered by their price ceiling. A new listing then looks up only the
+keys of its own words and values, and within those only the searches whose
+ceiling is at or above its price; those candidates are checked with the
+same predicate /listings/filter uses. The work per listing grows with the
+matching searches, not with every saved search.
+
+create_listing hands each new listing to the Notifier, whose background
+thread matches it and writes one "notifications" document per matching
+search (owner, search, listing). The request does not wait for it.
+"""
+import logging
+import math
+import os
+import queue
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+
+from bulk_writes import WriteOp, bulk_write
+from geo import haversine_miles, listing_point
+from listing_queries import PARKING_NO, PARKING_YES, build_predicate, parse_criteria
+from search_index import MIN_PREFIX_LENGTH, listing_terms, terms_match, tokenize
+
+log = logging.getLogger(__name__)
+
+COLLECTION = "savedSearches"
+NOTIFICATIONS = "notifications"
+CRITERIA_FIELDS = (
+    "title", "q", "minPrice", "maxPrice", "furnished", "parking", "startDate", "endDate",
+    "availability", "minOverlapDays", "radiusMiles", "near",
+)
+MAX_NAME_LENGTH = 100
+# New listings waiting to be matched; beyond this they are dropped and logged
+NOTIFY_QUEUE_SIZE = int(os.environ.get("SAVED_SEARCH_QUEUE_SIZE", "1000"))
+# How long the notifier waits for the saved searches to load before matching
+READY_TIMEOUT = 30
+
+
+def saved_search_fields(body):
+    """
+    The document to store for a saved search request body
+    ({"name", "criteria"}). Raises ValueError.
+    """
+    criteria = body.get("criteria")
+    if not isinstance(criteria, dict):
+        raise ValueError("criteria must be an object")
+    criteria = {k: v for k, v in criteria.items() if k in CRITERIA_FIELDS and v not in (None, "")}
+    parsed = parse_criteria(criteria)
+    if build_predicate(parsed) is None and parsed["radiusMiles"] is None:
+        raise ValueError("criteria must set at least one filter")
+    name = body.get("name") or ""
+    if not isinstance(name, str) or len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f"name must be a string of at most {MAX_NAME_LENGTH} characters")
+    return {"name": name.strip(), "criteria": criteria}
+
+
+def saved_search_matcher(criteria, pushed=frozenset()):
+    """
+    fn(listing) -> bool for parsed criteria, with the same meaning as
+    /listings/filter, leaving out the criteria in `pushed`.
+    """
+    predicate = build_predicate(criteria, pushed)
+    radius, center = criteria["radiusMiles"], criteria["near"]
+    if radius is None:
+        return predicate or (lambda listing: True)
+
+    def matches(listing):
+        point = listing_point(listing)
+        if point is None or haversine_miles(center, point) > radius:
+            return False
+        return predicate is None or predicate(listing)
+    return matches
+
+
+def access_key(criteria):
+    """The bucket (of parsed criteria) a saved search is filed under in the index."""
+    tokens = tokenize(criteria["q"])
+    if tokens:
+        *exact, last = tokens
+        if exact:
+            # Rarer words tend to be longer
+            return ("term", max(exact, key=len))
+        # The last query word also matches as a prefix (see search_index)
+        return ("prefix", last) if len(last) >= MIN_PREFIX_LENGTH else ("term", last)
+    if criteria["furnished"]:
+        return ("value", ("furnished", True))
+    if criteria["parking"]:
+        return ("value", ("parking", criteria["parking"]))
+    return ("rest", None)
+
+
+class SavedSearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # search id -> (user_email, name, query tokens, matcher, access key, ceiling)
+        self._searches = {}
+        # access key -> [(maxPrice or inf, search id)], ascending, so a listing
+        # only looks at the searches whose price ceiling it is under
+        self._buckets = {}
+        self._watch = None
+        # Set once the listener's initial snapshot is applied
+        self._ready = threading.Event()
+        self.candidates_checked = 0
+        self.listings_matched = 0
+
+    def on_change(self, change, doc_id, data):
+        entry = None
+        if change != "REMOVED" and data is not None:
+            try:
+                criteria = parse_criteria(data.get("criteria") or {})
+                # The query is checked against terms computed once per listing
+                matcher = saved_search_matcher(criteria, pushed=frozenset({"q"}))
+                ceiling = criteria["maxPrice"] if criteria["maxPrice"] is not None else math.inf
+                entry = (data.get("userEmail"), data.get("name", ""), tokenize(criteria["q"]),
+                         matcher, access_key(criteria), ceiling)
+            except ValueError as e:
+                log.warning(f"Skipping saved search {doc_id}: {e}")
+        with self._lock:
+            self._remove(doc_id)
+            if entry is not None:
+                self._searches[doc_id] = entry
+                insort(self._buckets.setdefault(entry[4], []), (entry[5], doc_id))
+
+    def _remove(self, doc_id):
+        entry = self._searches.pop(doc_id, None)
+        if entry is None:
+            return
+        bucket = self._buckets[entry[4]]
+        index = bisect_left(bucket, (entry[5], doc_id))
+        if index < len(bucket) and bucket[index] == (entry[5], doc_id):
+            del bucket[index]
+        if not bucket:
+            del self._buckets[entry[4]]
+
+    def _candidates(self, listing, terms):
+        keys = [("rest", None)]
+        for term in terms:
+            keys.append(("term", term))
+            keys.extend(("prefix", term[:end]) for end in range(MIN_PREFIX_LENGTH, len(term) + 1))
+        if listing.get("furnished") is True:
+            keys.append(("value", ("furnished", True)))
+        parking = listing.get("parking")
+        if parking in PARKING_YES:
+            keys.append(("value", ("parking", "yes")))
+        if parking in PARKING_NO:
+            keys.append(("value", ("parking", "no")))
+
+        price = listing.get("price")
+        if not isinstance(price, (int, float)) or isinstance(price, bool):
+            # A search with a price ceiling never matches a listing without a price
+            price = math.inf
+        ids = set()
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket:
+                ids.update(doc_id for _, doc_id in bucket[bisect_left(bucket, (price,)):])
+        return ids
+
+    def match(self, listing):
+        """[(search_id, user_email, name)] of the saved searches `listing` satisfies."""
+        terms = listing_terms(listing)
+        with self._lock:
+            candidates = [(doc_id, self._searches[doc_id]) for doc_id in self._candidates(listing, terms)]
+        matches = [
+            (doc_id, user_email, name)
+            for doc_id, (user_email, name, wanted, matcher, _, _) in candidates
+            if (not wanted or terms_match(terms, wanted)) and matcher(listing)
+        ]
+        self.candidates_checked += len(candidates)
+        self.listings_matched += 1
+        return matches
+
+    def start(self, collection):
+        """Follow the saved searches in `collection` with a snapshot listener."""
+        with self._lock:
+            if self._watch is not None and getattr(self._watch, "is_active", True):
+                return
+            # A dead listener is replaced; its successor's initial snapshot reconciles
+            self._watch = None
+            self._ready.clear()
+        watch = collection.on_snapshot(self._on_snapshot)
+        with self._lock:
+            self._watch = watch
+
+    def wait_ready(self, timeout):
+        return self._ready.wait(timeout)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        if not self._ready.is_set():
+            present = {doc.id for doc in docs}
+            with self._lock:
+                vanished = [doc_id for doc_id in self._searches if doc_id not in present]
+            for doc_id in vanished:
+                self.on_change("REMOVED", doc_id, None)
+        for change in changes:
+            kind = change.type.name
+            doc = change.document
+            self.on_change(kind, doc.id, doc.to_dict() if kind != "REMOVED" else None)
+        self._ready.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "searches": len(self._searches),
+                "unindexed": len(self._buckets.get(("rest", None), ())),
+                "listingsMatched": self.listings_matched,
+                "candidatesChecked": self.candidates_checked,
+            }
+
+    def __len__(self):
+        return len(self._searches)
+
+
+def notification_ops(db, listing_id, listing, matches, now=None):
+    """One notification write per match, skipping searches owned by the listing's poster."""
+    now = now or datetime.now(timezone.utc)
+    notifications = db.collection(NOTIFICATIONS)
+    for search_id, user_email, name in matches:
+        if not user_email or user_email == listing.get("contactEmail"):
+            continue
+        # Keyed by search and listing, so a retried write doesn't notify twice
+        yield WriteOp("set", notifications.document(f"{search_id}_{listing_id}"), {
+            "userEmail": user_email,
+            "type": "savedSearchMatch",
+            "savedSearchId": search_id,
+            "savedSearchName": name,
+            "listingId": listing_id,
+            "listingTitle": listing.get("title", ""),
+            "createdAt": now,
+            "read": False,
+        })
+
+
+class Notifier:
+    """Matches new listings against the saved searches on a background thread."""
+
+    def __init__(self, db, index):
+        self._db = db
+        self._index = index
+        self._queue = queue.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.notified = 0
+
+    def submit(self, listing_id, listing):
+        """Queue a new listing; never blocks the request."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((listing_id, dict(listing)))
+        except queue.Full:
+            self.dropped += 1
+            log.warning(f"Saved search queue full; no alerts for listing {listing_id}")
+
+    def _ensure_started(self):
+        # Started on first use, so the thread and listener exist after gunicorn forks
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="saved-search-notifier", daemon=True)
+                self._thread.start()
+        self._index.start(self._db.collection(COLLECTION))
+
+    def _run(self):
+        while True:
+            listing_id, listing = self._queue.get()
+            try:
+                if not self._index.wait_ready(READY_TIMEOUT):
+                    log.debug(f"Saved searches not loaded; matching listing {listing_id} against a partial index")
+                matches = self._index.match(listing)
+                result = bulk_write(self._db, notification_ops(self._db, listing_id, listing, matches))
+                self.notified += result.writes
+            except Exception as e:
+                log.warning(f"Saved search alerts failed for listing {listing_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every queued listing has been processed (tests and benchmarks)."""
+        self._queue.join()
+
+    def stats(self):
+        return {**self._index.stats(), "queued": self._queue.qsize(),
+                "notified": self.notified, "dropped": self.dropped}
+
+
+saved_search_index = SavedSearchIndex()
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier(db):
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = Notifier(db, saved_search_index)
+        return _notifier
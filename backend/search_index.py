@@ -0,0 +1,197 @@
+"""
+In-process full-text index over listing text, with BM25 ranking and prefix
+(typeahead) matching.
+
+The index is kept current by a listings replica listener, like the geohash
+index, so every worker can rank results and suggest completions without a
+Firestore read. Text is normalized (case, accents), split into word tokens
+and stripped of stop words; a title word counts three times as much as one
+in the other fields. The last query token also matches as a prefix, so "cozy
+stu" finds "cozy studio".
+
+When the replica is not available, matches_query() is used as a plain
+predicate instead (all tokens must match, no ranking).
+"""
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+
+# listing field -> weight in the term frequencies
+FIELDS = {"title": 3, "description": 1, "notes": 1, "address": 1}
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Vocabulary terms a prefix may expand to, most frequent first
+MAX_PREFIX_TERMS = 50
+MIN_PREFIX_LENGTH = 2
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from in is it near of on or the to with".split()
+)
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Normalized word tokens of `text`, stop words removed."""
+    if not isinstance(text, str):
+        return []
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [t for t in _TOKEN.findall(text) if t not in STOP_WORDS]
+
+
+def listing_terms(listing):
+    """Weighted term frequencies of a listing's searchable fields."""
+    terms = Counter()
+    for field, weight in FIELDS.items():
+        for token in tokenize(listing.get(field)):
+            terms[token] += weight
+    return terms
+
+
+def matches_query(listing, q):
+    """True when every token of q occurs in the listing (the last one as a prefix)."""
+    wanted = tokenize(q)
+    if not wanted:
+        return True
+    return terms_match(listing_terms(listing), wanted)
+
+
+def terms_match(terms, wanted):
+    """matches_query() for a listing's terms and the (non-empty) tokens of q."""
+    *exact, last = wanted
+    if any(token not in terms for token in exact):
+        return False
+    return last in terms or (len(last) >= MIN_PREFIX_LENGTH and any(t.startswith(last) for t in terms))
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # term -> {doc_id: weighted term frequency}
+        self._postings = {}
+        # doc_id -> (Counter of terms, weighted length)
+        self._docs = {}
+        self._total_length = 0
+        # Sorted vocabulary, for prefix expansion
+        self._vocabulary = []
+
+    def on_change(self, change, doc_id, data):
+        with self._lock:
+            self._remove(doc_id)
+            if change != "REMOVED" and data is not None:
+                self._add(doc_id, listing_terms(data))
+
+    def _add(self, doc_id, terms):
+        length = sum(terms.values())
+        self._docs[doc_id] = (terms, length)
+        self._total_length += length
+        for term, frequency in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                insort(self._vocabulary, term)
+            postings[doc_id] = frequency
+
+    def _remove(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        terms, length = entry
+        self._total_length -= length
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                index = bisect_left(self._vocabulary, term)
+                del self._vocabulary[index]
+
+    def _expand(self, prefix):
+        """Vocabulary terms starting with prefix, most frequent first."""
+        start = bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        terms.sort(key=lambda t: -len(self._postings[t]))
+        return terms[:MAX_PREFIX_TERMS]
+
+    def _idf(self, term):
+        df = len(self._postings.get(term, ()))
+        n = len(self._docs)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _bm25(self, term, idf, doc_id, avg_length):
+        frequency = self._postings[term][doc_id]
+        length = self._docs[doc_id][1]
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        return idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+    def search(self, q):
+        """
+        Rank the listings matching every token of q (the last one also as a
+        prefix). Returns [(score, doc_id)], best first.
+        """
+        tokens = tokenize(q)
+        if not tokens:
+            return []
+        *exact, last = tokens
+        with self._lock:
+            if not self._docs:
+                return []
+            avg_length = self._total_length / len(self._docs)
+            # Each query token is a group of alternative terms; a doc must match every group
+            groups = [[t] for t in exact]
+            last_terms = self._expand(last) if len(last) >= MIN_PREFIX_LENGTH else []
+            if last in self._postings and last not in last_terms:
+                last_terms.insert(0, last)
+            groups.append(last_terms)
+            groups = [[t for t in group if t in self._postings] for group in groups]
+            if not all(groups):
+                return []
+
+            # Start from the rarest group to keep the candidate set small
+            groups.sort(key=lambda g: sum(len(self._postings[t]) for t in g))
+            candidates = set()
+            for term in groups[0]:
+                candidates.update(self._postings[term])
+            for group in groups[1:]:
+                candidates = {d for d in candidates if any(d in self._postings[t] for t in group)}
+                if not candidates:
+                    return []
+
+            idf = {t: self._idf(t) for group in groups for t in group}
+            ranked = []
+            for doc_id in candidates:
+                score = 0.0
+                for group in groups:
+                    score += max(self._bm25(t, idf[t], doc_id, avg_length)
+                                 for t in group if doc_id in self._postings[t])
+                ranked.append((round(score, 6), doc_id))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return ranked
+
+    def suggest(self, q, limit=8):
+        """Completions of the last token of q, with the number of listings each matches."""
+        tokens = tokenize(q)
+        if not tokens or len(tokens[-1]) < MIN_PREFIX_LENGTH:
+            return []
+        *head, last = tokens
+        with self._lock:
+            terms = self._expand(last)[:limit]
+            counts = [len(self._postings[t]) for t in terms]
+        prefix = " ".join(head)
+        return [
+            {"text": f"{prefix} {term}" if prefix else term, "count": count}
+            for term, count in zip(terms, counts)
+        ]
+
+    def __len__(self):
+        return len(self._docs)
+
+
+search_index = SearchIndex()
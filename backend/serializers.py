@@ -0,0 +1,248 @@
+"""
+Response bodies for every route: JSON encoding, field projection,
+compression and streamed pages.
+
+- ApiJSONProvider, installed as app.json so jsonify() uses it, writes
+  datetimes (Firestore timestamps included) as ISO 8601 strings, so handlers
+  return stored documents as they are.
+- project() keeps the fields a client asked for with `fields=` (a card
+  needs a title, a price and a photo, not the notes), plus the id.
+- JSON responses of COMPRESS_MIN_BYTES or more go out br or gzip encoded,
+  whichever Accept-Encoding prefers; streamed ones a chunk at a time. The
+  encoding is appended to a strong ETag ("<tag>-gzip"), since the encoded
+  body is not byte-for-byte the identity one, as is a hash of the `fields`
+  of a projected one (projected_etag()); base_etag() recovers the tag a
+  handler set from one a client echoes back.
+- page_response() sends {"<key>": [...], ...} from a generator of items:
+  short pages as one body, longer ones streamed while the generator
+  produces them, so a page of thousands of listings is never held whole.
+"""
+import hashlib
+import os
+import re
+import zlib
+from datetime import date
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import parse_accept_header
+
+from pagination import MAX_LIMIT
+
+try:
+    import brotli
+except ImportError:
+    # Optional; without it responses are only ever gzipped
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+# Brotli's 11 is for static assets; 5 compresses JSON better than gzip -9, faster
+BROTLI_QUALITY = 5
+COMPRESSIBLE = frozenset({"application/json"})
+# Longer pages are streamed
+STREAM_THRESHOLD = MAX_LIMIT
+STREAM_CHUNK_BYTES = 16 * 1024
+
+FIELD_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9_]{0,63}$")
+PROJECTION_TAG = re.compile(r"-f[0-9a-f]{8}$")
+MAX_FIELDS = 40
+
+
+class ApiJSONProvider(DefaultJSONProvider):
+    # Flask's default writes dates as HTTP dates
+    @staticmethod
+    def default(o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+
+#### Field projection ####
+def parse_fields(raw):
+    """
+    The fields named by a `fields` parameter, comma-separated or as a JSON
+    list, always with "id"; None (every field) when absent. Raises ValueError.
+    """
+    if raw is None or raw == "":
+        return None
+    names = raw.split(",") if isinstance(raw, str) else raw
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError("fields must be a comma-separated list of field names")
+    names = [name.strip() for name in names if name.strip()]
+    if len(names) > MAX_FIELDS:
+        raise ValueError(f"At most {MAX_FIELDS} fields")
+    for name in names:
+        if not FIELD_NAME.match(name):
+            raise ValueError(f"Invalid field name {name!r}")
+    return tuple(dict.fromkeys(["id", *names]))
+
+
+def request_fields(body=None):
+    """parse_fields() of the request's `fields` query parameter, or else of body["fields"]."""
+    raw = request.args.get("fields")
+    if raw is None and isinstance(body, dict):
+        raw = body.get("fields")
+    return parse_fields(raw)
+
+
+def project(doc, fields):
+    if fields is None:
+        return doc
+    return {name: doc[name] for name in fields if name in doc}
+
+
+def projected_etag(etag, fields):
+    """The ETag of the `fields` projection of a document whose ETag is `etag`."""
+    if fields is None:
+        return etag
+    return f"{etag}-f{hashlib.sha1(','.join(fields).encode()).hexdigest()[:8]}"
+
+
+#### Streamed pages ####
+def page_response(key, items, tail, fields=None):
+    """
+    {key: [items], **tail(result)}, where `items` is a generator of documents
+    whose return value is handed to tail() for the fields after the list.
+    Documents pass through project(). Pages of up to STREAM_THRESHOLD items
+    are sent whole; longer ones are streamed as `items` yields them.
+    """
+    items = iter(items)
+    head = []
+    try:
+        while len(head) <= STREAM_THRESHOLD:
+            head.append(project(next(items), fields))
+    except StopIteration as stop:
+        return jsonify({key: head, **tail(stop.value)})
+    body = _stream_page(current_app.json, key, head, items, tail, fields)
+    return Response(stream_with_context(body), mimetype="application/json")
+
+
+def _stream_page(provider, key, head, items, tail, fields):
+    def dumps(value):
+        return provider.dumps(value, separators=(",", ":"))
+
+    parts = ["{", dumps(key), ":[", ",".join(map(dumps, head))]
+    size = 0
+    while True:
+        try:
+            item = next(items)
+        except StopIteration as stop:
+            result = stop.value
+            break
+        text = dumps(project(item, fields))
+        parts.append(",")
+        parts.append(text)
+        size += len(text)
+        if size >= STREAM_CHUNK_BYTES:
+            yield "".join(parts)
+            parts, size = [], 0
+    parts.append("]")
+    for name, value in tail(result).items():
+        parts.append(f",{dumps(name)}:{dumps(value)}")
+    parts.append("}")
+    yield "".join(parts)
+
+
+#### Compression ####
+def negotiate(accept_encoding):
+    """"br", "gzip" or None for an Accept-Encoding header; br wins ties."""
+    accept = parse_accept_header(accept_encoding)
+    best, best_quality = None, 0
+    for encoding in (("br",) if brotli is not None else ()) + ("gzip",):
+        quality = accept.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compressor(encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    # wbits 31: a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def compress(data, encoding):
+    process, finish = _compressor(encoding)
+    return process(data) + finish()
+
+
+def compress_chunks(chunks, encoding):
+    process, finish = _compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            out = process(chunk)
+            if out:
+                yield out
+        yield finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def _compressible(response):
+    return not (response.status_code in (204, 304) or response.status_code < 200 or response.direct_passthrough
+                or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE)
+
+
+def _encoding(response):
+    """The encoding _compress will give `response`, or None when it goes out as is."""
+    if not _compressible(response):
+        return None
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    if encoding is not None and not response.is_streamed and len(response.get_data()) < COMPRESS_MIN_BYTES:
+        return None
+    return encoding
+
+
+def _tag(etag, encoding):
+    return etag if encoding is None or etag.endswith(f"-{encoding}") else f"{etag}-{encoding}"
+
+
+def base_etag(etag):
+    """The document's ETag, given one sent with an encoded or projected response."""
+    for encoding in ("br", "gzip"):
+        if etag.endswith(f"-{encoding}"):
+            etag = etag[:-len(encoding) - 1]
+            break
+    return PROJECTION_TAG.sub("", etag)
+
+
+def set_etag(response, etag):
+    """
+    Give `response` a strong ETag that already carries the encoding
+    _compress will apply, so make_conditional() compares If-None-Match
+    against the tag the client actually holds.
+    """
+    response.set_etag(_tag(etag, _encoding(response)))
+
+
+def _compress(response):
+    if not _compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = _encoding(response)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(_tag(etag, encoding))
+    return response
+
+
+def install(app):
+    """Encode `app`'s JSON with ApiJSONProvider and compress its responses."""
+    app.json = ApiJSONProvider(app)
+    app.after_request(_compress)
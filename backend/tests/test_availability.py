@@ -0,0 +1,53 @@
+"""The interval index against a scan of every window."""
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+from availability import DAY_SECONDS, IntervalIndex, MODES, listing_window, overlap_seconds, window_matches
+
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def listing(rng):
+    start = BASE + timedelta(days=rng.randrange(365))
+    return {"availableStart": start, "availableEnd": start + timedelta(days=rng.randrange(1, 200))}
+
+
+def expected(listings, wanted, mode, days):
+    matches = []
+    for doc_id, data in listings.items():
+        window = listing_window(data)
+        if window_matches(window, wanted, mode, days):
+            matches.append((overlap_seconds(window, wanted), doc_id))
+    return sorted(matches, key=lambda match: (-match[0], match[1]))
+
+
+def test_query_matches_a_full_scan():
+    rng = random.Random(3)
+    index, listings = IntervalIndex(), {}
+    for step in range(1500):
+        doc_id = f"l{rng.randrange(600)}"
+        if doc_id in listings and rng.random() < 0.3:
+            del listings[doc_id]
+            index.on_change("REMOVED", doc_id, None)
+        else:
+            listings[doc_id] = listing(rng)
+            index.on_change("MODIFIED", doc_id, listings[doc_id])
+    assert len(index) == len(listings)
+
+    lo = (BASE + timedelta(days=150)).timestamp()
+    for wanted in [(lo, lo + 60 * DAY_SECONDS), (lo, math.inf), (-math.inf, lo), (-math.inf, math.inf)]:
+        for mode in MODES:
+            for days in (0, 1, 30):
+                assert list(index.query(wanted, mode, days)) == expected(listings, wanted, mode, days)
+
+
+def test_pages_resume_after_the_cursor():
+    rng = random.Random(5)
+    index, listings = IntervalIndex(), {}
+    for n in range(200):
+        listings[f"l{n}"] = listing(rng)
+        index.on_change("ADDED", f"l{n}", listings[f"l{n}"])
+    wanted = ((BASE + timedelta(days=100)).timestamp(), (BASE + timedelta(days=250)).timestamp())
+    everything = list(index.query(wanted))
+    assert list(index.query(wanted, after=everything[9])) == everything[10:]
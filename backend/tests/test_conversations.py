@@ -0,0 +1,91 @@
+"""Conversation summary unread counters."""
+from datetime import datetime, timezone
+
+import pytest
+from google.api_core.exceptions import DeadlineExceeded
+
+from bulk_writes import bulk_write
+from conversations import (MarkReadFailed, conversation_id, mark_read, participants, read_op, record_sent, summary_ref,
+                           to_inbox_entry, unread_count)
+from memory_store import MemoryClient
+
+A, B = "a@ufl.edu", "b@ufl.edu"
+
+
+def send(db, sender, receiver, text):
+    msg = {"sender": sender, "receiver": receiver, "conversationId": conversation_id(sender, receiver),
+           "text": text, "timestamp": datetime.now(timezone.utc), "read": False}
+    batch = db.batch()
+    batch.set(db.collection("messages").document(), msg)
+    record_sent(batch, db, msg)
+    batch.commit()
+
+
+def unread(db, receiver):
+    return list(db.collection("messages").where("receiver", "==", receiver).where("read", "==", False).stream())
+
+
+def summary(db):
+    return summary_ref(db, A, B).get().to_dict()
+
+
+def test_read_keeps_messages_sent_after_the_unread_query():
+    db = MemoryClient()
+    send(db, A, B, "one")
+    send(db, A, B, "two")
+    # B's mark-read found these two; a third arrives before it commits
+    send(db, A, B, "three")
+    bulk_write(db, [read_op(db, B, A, 2)])
+    assert unread_count(summary(db), participants(A, B), B) == 1
+    assert to_inbox_entry(summary(db), B)["unread_count"] == 1
+
+
+def test_unread_count_never_negative():
+    db = MemoryClient()
+    send(db, A, B, "one")
+    bulk_write(db, [read_op(db, B, A, 3)])
+    assert to_inbox_entry(summary(db), B)["unread_count"] == 0
+    assert to_inbox_entry(summary(db), A)["unread_count"] == 0
+
+
+def test_overlapping_mark_reads_take_each_message_off_once():
+    db = MemoryClient()
+    send(db, A, B, "one")
+    send(db, A, B, "two")
+    # Two tabs query the same unread messages before either writes
+    first, second = unread(db, B), unread(db, B)
+    send(db, A, B, "three")
+    assert mark_read(db, B, A, first) == 2
+    assert mark_read(db, B, A, second) == 0
+    assert summary(db)[f"unread{participants(A, B).index(B)}"] == 1
+    assert mark_read(db, B, A, unread(db, B)) == 1
+    assert summary(db)[f"unread{participants(A, B).index(B)}"] == 0
+
+
+def test_mark_read_retries_messages_still_unread():
+    db = MemoryClient()
+    send(db, A, B, "one")
+    send(db, A, B, "two")
+    stale = unread(db, B)
+    # Another call marks only the first one
+    assert mark_read(db, B, A, stale[:1]) == 1
+    assert mark_read(db, B, A, stale) == 1
+    assert summary(db)[f"unread{participants(A, B).index(B)}"] == 0
+
+
+def test_ambiguous_commit_is_not_retried(monkeypatch):
+    db = MemoryClient()
+    send(db, A, B, "one")
+    docs = unread(db, B)
+    commits = []
+
+    def fail(self, retry=None, timeout=None):
+        commits.append(self)
+        raise DeadlineExceeded("commit timed out")
+
+    monkeypatch.setattr(type(db.batch()), "commit", fail)
+    with pytest.raises(MarkReadFailed) as failed:
+        mark_read(db, B, A, docs)
+    assert failed.value.marked == 0
+    # It may have applied; replaying it could decrement the counter twice
+    assert len(commits) == 1
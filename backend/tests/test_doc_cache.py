@@ -0,0 +1,44 @@
+"""Cross-worker invalidation of cached user profiles."""
+from auth import user_cache_key, user_changed, user_doc_id
+from doc_cache import ChangeFeed, DocCache
+from memory_store import MemoryClient
+
+EMAIL = "a@ufl.edu"
+
+
+def test_write_through_another_worker_invalidates():
+    db = MemoryClient()
+    ref = db.collection("users").document(user_doc_id(EMAIL))
+    ref.set({"email": EMAIL, "firstName": "Ann"})
+    # This worker's cache and feed; the write below comes from another worker
+    cache = DocCache()
+    feed = ChangeFeed("users", lambda doc: user_cache_key(doc.to_dict()["email"]), cache=cache)
+    feed.ensure_started(db)
+
+    def load():
+        return ref.get().to_dict()["firstName"]
+
+    assert cache.get(user_cache_key(EMAIL), load)[0] == "Ann"
+    ref.update(user_changed({"firstName": "Anna"}))
+    assert cache.get(user_cache_key(EMAIL), load)[0] == "Anna"
+
+
+
+def test_failing_feed_backs_off():
+    attempts = []
+
+    class Unavailable:
+        def collection(self, name):
+            return self
+
+        def where(self, *args):
+            return self
+
+        def on_snapshot(self, callback):
+            attempts.append(callback)
+            raise RuntimeError("unavailable")
+
+    feed = ChangeFeed("users", lambda doc: doc.id, cache=DocCache())
+    for _ in range(5):
+        feed.ensure_started(Unavailable())
+    assert len(attempts) == 1
@@ -0,0 +1,42 @@
+"""Bulk import reports failed writes and bad bytes per row."""
+import io
+import json
+
+from google.api_core.exceptions import InvalidArgument
+
+import memory_store
+from bulk_writes import MAX_BATCH_SIZE
+from listing_import import import_listings
+from memory_store import MemoryClient
+
+
+def rows(count):
+    return [json.dumps({"title": f"Room {n}", "price": 500 + n, "contactEmail": "a@ufl.edu"}) for n in range(count)]
+
+
+def test_failed_chunk_is_reported_by_line(monkeypatch):
+    db = MemoryClient()
+    commit = memory_store.MemoryWriteBatch.commit
+    commits = []
+
+    def second_fails(self, retry=None, timeout=None):
+        commits.append(self)
+        if len(commits) == 2:
+            raise InvalidArgument("rejected")
+        return commit(self, retry, timeout)
+
+    monkeypatch.setattr(memory_store.MemoryWriteBatch, "commit", second_fails)
+    report = import_listings(db, io.StringIO("\n".join(rows(MAX_BATCH_SIZE + 10))), "ndjson")
+    assert report.imported == MAX_BATCH_SIZE
+    assert report.error_count == 10
+    assert report.errors[0]["line"] == MAX_BATCH_SIZE + 1
+    assert len(list(db.collection("listings").stream())) == MAX_BATCH_SIZE
+
+
+def test_invalid_utf8_is_a_row_error():
+    db = MemoryClient()
+    body = b'{"title": "Room \xff", "price": 1}\n' + rows(1)[0].encode()
+    stream = io.TextIOWrapper(io.BytesIO(body), encoding="utf-8", errors="replace", newline="")
+    report = import_listings(db, stream, "ndjson")
+    assert report.imported == 1
+    assert report.errors == [{"line": 1, "error": "not valid UTF-8"}]
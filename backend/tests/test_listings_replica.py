@@ -0,0 +1,160 @@
+"""ListingsReplica against the in-memory Firestore stand-in."""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import listings_replica
+from listings_replica import ListingsReplica
+from memory_store import MemoryClient
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def listing(n, **fields):
+    return {"title": f"Listing {n}", "price": 500 + n, "createdAt": T0 + timedelta(days=n), **fields}
+
+
+@pytest.fixture
+def db():
+    client = MemoryClient()
+    for n in range(3):
+        client.collection("listings").document(f"l{n}").set(listing(n))
+    return client
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+@pytest.fixture
+def replica(db, events):
+    replica = ListingsReplica(db.collection("listings"))
+    replica.add_listener(lambda kind, doc_id, data: events.append((kind, doc_id)))
+    replica.start()
+    yield replica
+    replica.stop()
+
+
+def ids(listings):
+    return [item["id"] for item in listings]
+
+
+def test_initial_load(replica, events):
+    assert replica.ready and replica.active
+    assert sorted(ids(replica.select())) == ["l0", "l1", "l2"]
+    assert replica.get("l1") == {**listing(1), "id": "l1"}
+    assert sorted(events) == [("ADDED", "l0"), ("ADDED", "l1"), ("ADDED", "l2")]
+    # Newest first by createdAt
+    assert ids(replica.walk(None, limit=10)) == ["l2", "l1", "l0"]
+
+
+def test_late_listener_sees_current_docs(replica):
+    seen = []
+    replica.add_listener(lambda kind, doc_id, data: seen.append((kind, doc_id)))
+    assert sorted(seen) == [("ADDED", "l0"), ("ADDED", "l1"), ("ADDED", "l2")]
+
+
+def test_added(db, replica, events):
+    db.collection("listings").document("l9").set(listing(9))
+    assert replica.get("l9")["title"] == "Listing 9"
+    assert events[-1] == ("ADDED", "l9")
+    assert ids(replica.walk(None, limit=2)) == ["l9", "l2"]
+
+
+def test_modified(db, replica, events):
+    _, before = replica.get_versioned("l1")
+    db.collection("listings").document("l1").update({"price": 999, "createdAt": T0 + timedelta(days=30)})
+    listing_now, after = replica.get_versioned("l1")
+    assert listing_now["price"] == 999
+    assert after != before
+    assert events[-1] == ("MODIFIED", "l1")
+    # Re-ordered by its new createdAt, and only once
+    assert ids(replica.walk(None, limit=10)) == ["l1", "l2", "l0"]
+
+
+def test_removed(db, replica, events):
+    db.collection("listings").document("l0").delete()
+    assert replica.get("l0") is None
+    assert replica.get_versioned("l0") == (None, None)
+    assert events[-1] == ("REMOVED", "l0")
+    assert ids(replica.walk(None, limit=10)) == ["l2", "l1"]
+
+
+def test_restart_reconciles_changes_missed_while_stopped(db, replica, events):
+    replica.stop()
+    assert not replica.active
+    db.collection("listings").document("l0").delete()
+    db.collection("listings").document("l1").update({"price": 1})
+    db.collection("listings").document("l5").set(listing(5))
+    # Still the old state
+    assert replica.get("l0") is not None and replica.get("l1")["price"] == 501
+
+    replica.restart()
+    assert replica.ready and replica.active
+    assert sorted(ids(replica.select())) == ["l1", "l2", "l5"]
+    assert replica.get("l1")["price"] == 1
+    assert ("REMOVED", "l0") in events
+    assert ids(replica.walk(None, limit=10)) == ["l5", "l2", "l1"]
+
+
+def test_walk_resumes_after_key(replica):
+    walk = replica.walk(lambda data: data["price"] != 501, limit=1)
+    assert ids(walk) == ["l2"]
+    after = (T0 + timedelta(days=2), "l2")
+    assert ids(replica.walk(lambda data: data["price"] != 501, after=after, limit=5)) == ["l0"]
+
+
+class SilentCollection:
+    """A collection whose listener never delivers the initial snapshot."""
+
+    def __init__(self):
+        self.callback = None
+        self.watch = type("Watch", (), {"is_active": True, "unsubscribe": lambda self: None})()
+
+    def on_snapshot(self, callback):
+        self.callback = callback
+        return self.watch
+
+
+class SilentDb:
+    def __init__(self):
+        self.listings = SilentCollection()
+
+    def collection(self, name):
+        return self.listings
+
+
+@pytest.fixture
+def fresh_replica(monkeypatch):
+    monkeypatch.setattr(listings_replica, "REPLICA_ENABLED", True)
+    monkeypatch.setattr(listings_replica, "READY_TIMEOUT", 0.2)
+    monkeypatch.setattr(listings_replica, "_replica", None)
+    monkeypatch.setattr(listings_replica, "_ready_deadline", None)
+    monkeypatch.setattr(listings_replica, "_replica_listeners", [])
+
+
+def test_get_replica_waits_once_then_fails_fast(fresh_replica):
+    db = SilentDb()
+    started = time.monotonic()
+    assert listings_replica.get_replica(db) is None
+    assert time.monotonic() - started >= 0.2
+
+    started = time.monotonic()
+    for _ in range(5):
+        assert listings_replica.get_replica(db) is None
+    assert time.monotonic() - started < 0.1
+
+    # Served from the replica as soon as the snapshot arrives
+    db.listings.callback([], [], None)
+    assert listings_replica.get_replica(db) is listings_replica._replica
+
+
+def test_get_replica_waits_for_a_snapshot_in_time(fresh_replica):
+    db = SilentDb()
+    assert listings_replica.get_replica(db) is None
+    listings_replica._ready_deadline = time.monotonic() + 5
+    threading.Timer(0.05, db.listings.callback, ([], [], None)).start()
+    assert listings_replica.get_replica(db) is listings_replica._replica
@@ -0,0 +1,75 @@
+"""PopularityRecorder.flush when some write chunks fail."""
+import pytest
+from google.api_core import exceptions
+
+from bulk_writes import MAX_BATCH_SIZE
+from memory_store import MemoryClient
+from popularity import COUNTERS, PopularityRecorder
+
+LISTINGS = MAX_BATCH_SIZE + 100
+
+
+class FlakyClient(MemoryClient):
+    """Fails the commit of every batch holding a write to listing-0's counter."""
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+        self.failures = 0
+
+    def batch(self):
+        batch = super().batch()
+        commit = batch.commit
+
+        def flaky_commit(*args, **kwargs):
+            if self.error is not None and any(ref.id.startswith("listing-0_") for _, ref, *_ in batch._writes):
+                self.failures += 1
+                raise self.error
+            return commit(*args, **kwargs)
+
+        batch.commit = flaky_commit
+        return batch
+
+
+def views(db):
+    totals = {}
+    for doc in db.collection(COUNTERS).stream():
+        data = doc.to_dict()
+        totals[data["listingId"]] = totals.get(data["listingId"], 0) + data["views"]
+    return totals
+
+
+def recorder_with_views(db):
+    recorder = PopularityRecorder(db)
+    # Not started: flush() is driven by the test
+    recorder._thread = object()
+    for n in range(LISTINGS):
+        recorder.record(f"listing-{n}", "view")
+    return recorder
+
+
+def test_flush_requeues_only_the_failed_chunk():
+    db = FlakyClient(exceptions.ServiceUnavailable("unavailable"))
+    recorder = recorder_with_views(db)
+    written = recorder.flush(max_workers=0)
+    assert 0 < written < LISTINGS
+    assert recorder.pending() == LISTINGS - written
+    assert db.failures > 1
+
+    db.error = None
+    assert recorder.flush(max_workers=0) == LISTINGS - written
+    assert recorder.pending() == 0
+    # Every view counted exactly once
+    assert views(db) == {f"listing-{n}": 1 for n in range(LISTINGS)}
+
+
+@pytest.mark.parametrize("error", [exceptions.DeadlineExceeded("timeout"), exceptions.InternalServerError("internal")])
+def test_flush_does_not_retry_commits_that_may_have_applied(error):
+    db = FlakyClient(error)
+    recorder = recorder_with_views(db)
+    written = recorder.flush(max_workers=0)
+    # Tried once, then dropped rather than risk counting twice
+    assert db.failures == 1
+    assert recorder.pending() == 0
+    assert "listing-0" not in views(db)
+    assert len(views(db)) == written
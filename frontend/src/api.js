@@ -1,17 +1,55 @@
 const API_BASE = import.meta.env.VITE_API_BASE;
 
+// Dispatched on window when the API rejects the stored session token
+export const SESSION_EXPIRED = "session-expired";
+
 async function request(path, options = {}) {
+  const token = localStorage.getItem("sessionToken");
   const res = await fetch(`${API_BASE}${path}`, {
-    headers: { "Content-Type": "application/json", ...(options.headers || {}) },
     ...options,
+    headers: {
+      "Content-Type": "application/json",
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      ...(options.headers || {}),
+    },
   });
   const data = await res.json().catch(() => ({}));
+  if (res.status === 401 && token) {
+    // The session expired or was revoked; AuthContext logs out
+    localStorage.removeItem("sessionToken");
+    window.dispatchEvent(new Event(SESSION_EXPIRED));
+  }
   if (!res.ok) throw new Error(data?.error || `HTTP ${res.status}`);
   return data;
 }
 
+// Uploaded photo URLs are relative to the API unless photos sit behind a CDN
+export function photoSrc(url) {
+  return url && url.startsWith("/") ? `${API_BASE}${url}` : url;
+}
+
+// The URL of a listing's first photo at `size` ("thumb", "card" or "full")
+export function listingImage(listing, size = "card") {
+  const photo = listing?.photoUrls?.[0];
+  if (!photo) return listing?.imageUrl || listing?.image;
+  return photoSrc(photo.jpg ? photo.jpg[size] : photo.original);
+}
+
+// `fields` (comma-separated) limits each listing to those fields, plus its id
+function pageQuery(cursor, limit, fields) {
+  const params = new URLSearchParams();
+  if (cursor) params.set("cursor", cursor);
+  if (limit) params.set("limit", limit);
+  if (fields) params.set("fields", fields);
+  const qs = params.toString();
+  return qs ? `?${qs}` : "";
+}
+
 export const api = {
-  getListings: () => request("/listings"),
+  // Paginated listing endpoints return { listings, nextCursor }; pass nextCursor
+  // back as `cursor` to fetch the following page.
+  getListings: ({ cursor, limit, fields } = {}) =>
+    request(`/listings${pageQuery(cursor, limit, fields)}`),
   createListing: (payload) =>
     request("/listings", { method: "POST", body: JSON.stringify(payload) }),
   
@@ -36,21 +74,46 @@ export const api = {
     }),
   
   // Messaging endpoints
-  sendMessage: (senderEmail, receiverEmail, text) =>
+  // listingId (optional) counts the message as a contact for that listing
+  sendMessage: (senderEmail, receiverEmail, text, listingId) =>
     request("/messages", {
       method: "POST",
       body: JSON.stringify({
         sender_email: senderEmail,
         receiver_email: receiverEmail,
         text: text,
+        ...(listingId ? { listing_id: listingId } : {}),
       }),
     }),
   
-  getConversation: (senderEmail, receiverEmail) =>
-    request(`/messages?sender=${encodeURIComponent(senderEmail)}&receiver=${encodeURIComponent(receiverEmail)}`),
+  // Returns { messages, before }, oldest first; pass `before` back to load
+  // the page of older messages.
+  getConversation: (senderEmail, receiverEmail, { before, limit } = {}) =>
+    request(
+      `/messages?sender=${encodeURIComponent(senderEmail)}&receiver=${encodeURIComponent(receiverEmail)}` +
+        (before ? `&before=${encodeURIComponent(before)}` : "") +
+        (limit ? `&limit=${limit}` : "")
+    ),
+  
+  // Returns { conversations, nextCursor }
+  // URL for the Server-Sent Events stream of new messages in a conversation.
+  // EventSource can't send headers, so the session token goes in the URL.
+  messageStreamUrl: (senderEmail, receiverEmail) => {
+    const token = localStorage.getItem("sessionToken");
+    return (
+      `${API_BASE}/messages/stream?sender=${encodeURIComponent(senderEmail)}&receiver=${encodeURIComponent(receiverEmail)}` +
+      (token ? `&access_token=${encodeURIComponent(token)}` : "")
+    );
+  },
   
-  getConversations: (userEmail) =>
-    request(`/messages/conversations?user_email=${encodeURIComponent(userEmail)}`),
+  // includeProfiles adds `other_user` ({ email, firstName, lastName, profilepic })
+  // to every entry
+  getConversations: (userEmail, { cursor, limit, includeProfiles } = {}) =>
+    request(
+      `/messages/conversations?user_email=${encodeURIComponent(userEmail)}` +
+        pageQuery(cursor, limit).replace("?", "&") +
+        (includeProfiles ? "&include=profiles" : "")
+    ),
   
   markMessagesRead: (userEmail, otherUserEmail) =>
     request("/messages/read", {
@@ -63,14 +126,18 @@ export const api = {
   
   getUser: (email) => request(`/users/${encodeURIComponent(email)}`),
   
+  // Returns { users: { email: profile }, missing: [emails] }
+  getUsersBatch: (emails) =>
+    request("/users/batch", { method: "POST", body: JSON.stringify({ emails }) }),
+  
   updateUser: (email, data) =>
     request(`/users/${encodeURIComponent(email)}`, {
       method: "PUT",
       body: JSON.stringify(data),
     }),
   
-  getUserListings: (email) =>
-    request(`/listings/user/${encodeURIComponent(email)}`),
+  getUserListings: (email, { cursor, limit, fields } = {}) =>
+    request(`/listings/user/${encodeURIComponent(email)}${pageQuery(cursor, limit, fields)}`),
   
   filterListings: (filters) =>
     request("/listings/filter", {
@@ -78,8 +145,24 @@ export const api = {
       body: JSON.stringify(filters),
     }),
   
+  // Returns { listings, computedAt }, most popular first
+  getPopularListings: (limit) =>
+    request(`/listings/popular${pageQuery(null, limit)}`),
+  
+  // Returns { id, status, photoUrls }; put the id in a listing's `photos`
+  uploadPhoto: (file) =>
+    request("/photos", {
+      method: "POST",
+      body: file,
+      headers: { "Content-Type": file.type || "application/octet-stream" },
+    }),
+  
   getListing: (id) => request(`/listings/${encodeURIComponent(id)}`),
   
+  // Returns { listings: { id: listing }, missing: [ids] }
+  getListingsBatch: (ids) =>
+    request("/listings/batch", { method: "POST", body: JSON.stringify({ ids }) }),
+  
   updateListing: (id, data) =>
     request(`/listings/${encodeURIComponent(id)}`, {
       method: "PUT",
@@ -90,4 +173,25 @@ export const api = {
     request(`/listings/${encodeURIComponent(id)}`, {
       method: "DELETE",
     }),
+  
+  // criteria takes the same fields as filterListings
+  createSavedSearch: (userEmail, name, criteria) =>
+    request("/saved-searches", {
+      method: "POST",
+      body: JSON.stringify({ user_email: userEmail, name, criteria }),
+    }),
+  
+  getSavedSearches: (userEmail) =>
+    request(`/saved-searches?user_email=${encodeURIComponent(userEmail)}`),
+  
+  deleteSavedSearch: (id, userEmail) =>
+    request(`/saved-searches/${encodeURIComponent(id)}?user_email=${encodeURIComponent(userEmail)}`, {
+      method: "DELETE",
+    }),
+  
+  // Returns { notifications, nextCursor }, newest first
+  getNotifications: (userEmail, { cursor, limit } = {}) => {
+    const qs = pageQuery(cursor, limit);
+    return request(`/notifications?user_email=${encodeURIComponent(userEmail)}${qs ? `&${qs.slice(1)}` : ""}`);
+  },
 };
@@ -39,7 +39,9 @@ const ConversationItem = ({ conv, onSelect }) => {
       <div className="flex justify-between items-start">
         <div className="flex-1 min-w-0">
           <h4 className="font-semibold text-sm text-gray-900">
-            {conv.other_user_email || "Unknown User"}
+            {[conv.other_user?.firstName, conv.other_user?.lastName].filter(Boolean).join(" ") ||
+              conv.other_user_email ||
+              "Unknown User"}
           </h4>
           <p className="text-xs text-gray-600 mt-1 truncate">
             {conv.last_message || "No messages"}
@@ -71,6 +73,10 @@ const ChatWidget = () => {
   const [input, setInput] = useState("");
   const [conversations, setConversations] = useState([]);
   const [messages, setMessages] = useState([]);
+  // `before` cursor of the next older page: undefined until one is loaded
+  // (the oldest streamed message's event id is used), null when there is none
+  const [olderCursor, setOlderCursor] = useState(undefined);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const messagesEndRef = useRef(null);
@@ -80,9 +86,11 @@ const ChatWidget = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, []);
 
+  // Follow new messages, but not older ones loaded above them
+  const newestMessageId = messages[messages.length - 1]?.id;
   useEffect(() => {
     scrollToBottom();
-  }, [messages, scrollToBottom]);
+  }, [newestMessageId, scrollToBottom]);
 
   // Load conversations when widget opens
   useEffect(() => {
@@ -91,17 +99,51 @@ const ChatWidget = () => {
     }
   }, [isOpen, currentUserEmail]);
 
-  // Poll for new messages when a conversation is selected
+  // Stream messages for the selected conversation. The first events are the
+  // latest messages; on reconnect the browser sends Last-Event-ID and only
+  // gets the delta. Each event id is also the `before` cursor of older history.
   useEffect(() => {
     if (!selectedConversation || !currentUserEmail) return;
 
-    const interval = setInterval(() => {
-      loadMessages(selectedConversation.other_user_email);
-    }, 3000); // Poll every 3 seconds
-
-    return () => clearInterval(interval);
+    const source = new EventSource(
+      api.messageStreamUrl(currentUserEmail, selectedConversation.other_user_email)
+    );
+    source.addEventListener("message", (e) => {
+      const msg = JSON.parse(e.data);
+      setMessages((prev) => {
+        if (prev.some((m) => m.id === msg.id)) return prev;
+        // Replace the optimistic copy of a message we just sent
+        const tempIndex = prev.findIndex(
+          (m) => String(m.id).startsWith("temp_") && m.sender === msg.sender && m.text === msg.text
+        );
+        const next = tempIndex === -1 ? [...prev] : prev.filter((_, i) => i !== tempIndex);
+        next.push({ id: msg.id, sender: msg.sender, text: msg.text, timestamp: msg.timestamp, cursor: e.lastEventId });
+        return next;
+      });
+    });
+
+    return () => source.close();
   }, [selectedConversation, currentUserEmail]);
 
+  const loadOlderMessages = async () => {
+    const before = olderCursor === undefined ? messages.find((m) => m.cursor)?.cursor : olderCursor;
+    if (!before || !selectedConversation) return;
+    setLoadingOlder(true);
+    try {
+      const data = await api.getConversation(currentUserEmail, selectedConversation.other_user_email, { before });
+      setMessages((prev) => {
+        const known = new Set(prev.map((m) => m.id));
+        return [...(data?.messages || []).filter((m) => !known.has(m.id)), ...prev];
+      });
+      setOlderCursor(data?.before || null);
+    } catch (err) {
+      setError(err.message || "Failed to load older messages");
+      console.error("Error loading older messages:", err);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const loadConversations = async () => {
     if (!currentUserEmail) {
       setError("Please log in to use messaging");
@@ -111,8 +153,8 @@ const ChatWidget = () => {
     setLoading(true);
     setError(null);
     try {
-      const data = await api.getConversations(currentUserEmail);
-      setConversations(data || []);
+      const data = await api.getConversations(currentUserEmail, { includeProfiles: true });
+      setConversations(data?.conversations || []);
     } catch (err) {
       setError(err.message || "Failed to load conversations");
       console.error("Error loading conversations:", err);
@@ -121,28 +163,11 @@ const ChatWidget = () => {
     }
   };
 
-  const loadMessages = async (otherUserEmail) => {
-    if (!currentUserEmail || !otherUserEmail) return;
-
-    try {
-      const data = await api.getConversation(currentUserEmail, otherUserEmail);
-      // Transform backend format to frontend format
-      const transformedMessages = (data || []).map((msg) => ({
-        id: msg.id,
-        sender: msg.sender,
-        text: msg.text,
-        timestamp: msg.timestamp,
-      }));
-      setMessages(transformedMessages);
-    } catch (err) {
-      console.error("Error loading messages:", err);
-    }
-  };
-
   const handleOpenConversation = useCallback(
     async (conv) => {
       setSelectedConversation(conv);
       setMessages([]);
+      setOlderCursor(undefined);
       
       // Mark messages as read
       if (currentUserEmail && conv.other_user_email) {
@@ -155,10 +180,7 @@ const ChatWidget = () => {
         }
       }
       
-      // Load messages for this conversation
-      if (currentUserEmail && conv.other_user_email) {
-        await loadMessages(conv.other_user_email);
-      }
+      // Messages are loaded by the stream opened for the selected conversation
     },
     [currentUserEmail]
   );
@@ -183,9 +205,7 @@ const ChatWidget = () => {
       // Send to backend
       await api.sendMessage(currentUserEmail, otherUserEmail, messageText);
       
-      // Reload messages to get the actual message from backend
-      await loadMessages(otherUserEmail);
-      
+      // The stream replaces the optimistic message with the stored one.
       // Reload conversations to update last message
       await loadConversations();
     } catch (err) {
@@ -223,7 +243,7 @@ const ChatWidget = () => {
         
         // Find and select the new conversation
         const updatedConvs = await api.getConversations(currentUserEmail);
-        const newConv = updatedConvs.find((c) => c.other_user_email === otherUserEmail);
+        const newConv = updatedConvs.conversations.find((c) => c.other_user_email === otherUserEmail);
         
         if (newConv) {
           await handleOpenConversation(newConv);
@@ -395,14 +415,24 @@ const ChatWidget = () => {
                     No messages yet. Start the conversation!
                   </div>
                 ) : (
+                  olderCursor !== null && (
+                    <button
+                      onClick={loadOlderMessages}
+                      disabled={loadingOlder}
+                      className="w-full text-xs text-blue-600 hover:underline disabled:text-gray-400"
+                    >
+                      {loadingOlder ? "Loading..." : "Load older messages"}
+                    </button>
+                  )
+                )}
+                {messages.length > 0 &&
                   messages.map((msg) => (
                     <MessageBubble
                       key={msg.id}
                       msg={msg}
                       currentUserEmail={currentUserEmail}
                     />
-                  ))
-                )}
+                  ))}
                 <div ref={messagesEndRef} />
               </div>
 
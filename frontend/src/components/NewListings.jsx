@@ -1,6 +1,6 @@
 import { useEffect, useState } from "react";
 import { Link } from "react-router-dom";
-import { api } from "../api";
+import { api, listingImage } from "../api";
 
 const fallbackImg =
   "https://images.unsplash.com/photo-1505691938895-1758d7feb511?q=80&w=1200&auto=format&fit=crop";
@@ -28,7 +28,7 @@ export default function NewListings({ listings: propListings }) {
     (async () => {
       try {
         const data = await api.getListings();
-        const sorted = (Array.isArray(data) ? data : []).sort((a, b) => {
+        const sorted = (Array.isArray(data?.listings) ? data.listings : []).sort((a, b) => {
           const ta = new Date(a.createdAt || 0).getTime();
           const tb = new Date(b.createdAt || 0).getTime();
           return tb - ta; // newest first
@@ -67,7 +67,7 @@ export default function NewListings({ listings: propListings }) {
                 className="block bg-white rounded-2x1 shadow-md hover:shadow-lg transition-shadow duration-300 overflow-hidden"
               >
                 <img
-                  src={l.imageUrl || fallbackImg}
+                  src={listingImage(l) || fallbackImg}
                   alt={l.title || "Listing"}
                   className="w-full h-48 object-cover"
                 />
@@ -1,5 +1,6 @@
-import React from "react";
+import React, { useEffect, useState } from "react";
 import { Link } from "react-router-dom";
+import { api, listingImage, photoSrc } from "../api";
 
 const fallbackImg =
   "https://images.unsplash.com/photo-1505691938895-1758d7feb511?q=80&w=1200&auto=format&fit=crop";
@@ -9,8 +10,37 @@ function dollars(v) {
   return `$${Number(v).toLocaleString()}/month`;
 }
 
+// A /listings/popular entry in the shape the default view renders
+function toCard(listing) {
+  return {
+    id: listing.id,
+    title: listing.title || "Untitled",
+    location: listing.address || "Gainesville, FL",
+    price: dollars(listing.price),
+    image: photoSrc(listing.photo) || fallbackImg,
+  };
+}
+
 const PopularListings = ({ listings: propListings }) => {
-  // Use prop listings if provided, otherwise use default hardcoded ones
+  const [popular, setPopular] = useState(null);
+
+  useEffect(() => {
+    if (propListings) return;
+    let cancelled = false;
+    api
+      .getPopularListings(6)
+      .then((data) => {
+        if (!cancelled && data.listings && data.listings.length > 0) {
+          setPopular(data.listings.map(toCard));
+        }
+      })
+      .catch(() => {});
+    return () => {
+      cancelled = true;
+    };
+  }, [propListings]);
+
+  // Use prop listings if provided, then the ranked ones, then the hardcoded ones
   const defaultListings = [
     {
       id: 1,
@@ -62,7 +92,7 @@ const PopularListings = ({ listings: propListings }) => {
     },
   ];
 
-  const listings = propListings || defaultListings;
+  const listings = propListings || popular || defaultListings;
 
   // If filtered listings are provided, show them
   if (propListings) {
@@ -97,7 +127,7 @@ const PopularListings = ({ listings: propListings }) => {
                 className="block bg-white rounded-2x1 shadow-md hover:shadow-lg transition-shadow duration-300 overflow-hidden"
               >
                 <img
-                  src={listing.imageUrl || listing.image || fallbackImg}
+                  src={listingImage(listing) || fallbackImg}
                   alt={listing.title || "Listing"}
                   className="w-full h-48 object-cover"
                 />
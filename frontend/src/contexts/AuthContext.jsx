@@ -1,4 +1,5 @@
 import { createContext, useContext, useState, useEffect } from "react";
+import { SESSION_EXPIRED } from "../api";
 
 const AuthContext = createContext(null);
 
@@ -15,17 +16,26 @@ export function AuthProvider({ children }) {
     setLoading(false);
   }, []);
 
-  const login = (email) => {
+  const login = (email, token) => {
     const userData = { email };
     setUser(userData);
     localStorage.setItem("userEmail", email);
+    // Signed session token sent with every API request
+    if (token) localStorage.setItem("sessionToken", token);
   };
 
   const logout = () => {
     setUser(null);
     localStorage.removeItem("userEmail");
+    localStorage.removeItem("sessionToken");
   };
 
+  // The API rejected the stored token (api.js has already dropped it)
+  useEffect(() => {
+    window.addEventListener(SESSION_EXPIRED, logout);
+    return () => window.removeEventListener(SESSION_EXPIRED, logout);
+  }, []);
+
   const isAuthenticated = !!user;
 
   return (
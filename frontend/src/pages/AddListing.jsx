@@ -19,6 +19,7 @@ export default function AddListing() {
   const [parking, setParking] = useState("");
   const [furnished, setFurnished] = useState(false);
   const [notes, setNotes] = useState("");
+  const [photoFiles, setPhotoFiles] = useState([]);
 
   const [submitting, setSubmitting] = useState(false);
   const [msg, setMsg] = useState("");
@@ -47,6 +48,13 @@ export default function AddListing() {
     setSubmitting(true);
 
     try {
+      // Upload the photos first; the listing stores their IDs
+      const photos = [];
+      for (const file of photoFiles) {
+        const uploaded = await api.uploadPhoto(file);
+        photos.push(uploaded.id);
+      }
+
       const payload = {
         title: title.trim(),
         price: Number(rent) || 0,
@@ -59,6 +67,7 @@ export default function AddListing() {
         parking,
         furnished,
         notes: notes.trim(),
+        photos,
       };
 
       // TEMP logs just to prove it fires (remove later)
@@ -71,7 +80,7 @@ export default function AddListing() {
       // reset
       setTitle(""); setUserName("");
       setAddress(""); setRent(""); setNotes("");
-      setDateRange([null, null]); setParking(""); setFurnished(false);
+      setDateRange([null, null]); setParking(""); setFurnished(false); setPhotoFiles([]);
       setTimeout(() => navigate("/"), 400);
     } catch (e2) {
       setErr(e2.message || "Failed to submit listing");
@@ -171,7 +180,12 @@ export default function AddListing() {
                   value={notes} onChange={(e)=>setNotes(e.target.value)} />
               </div>
 
-              {/* Photos kept in UI; upload handling to come later */}
+              <div className="mb-3">
+                <label htmlFor="photos" className="form-label fw-semibold">Photos:</label>
+                <input type="file" id="photos" className="form-control" multiple
+                  accept="image/jpeg,image/png,image/webp"
+                  onChange={(e)=>setPhotoFiles(Array.from(e.target.files).slice(0, 10))} />
+              </div>
 
               <button type="submit" className="btn btn-primary w-100 mt-3" disabled={submitting}>
                 {submitting ? "Submitting…" : "Submit Listing"}
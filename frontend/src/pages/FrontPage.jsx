@@ -9,9 +9,11 @@ export default function FrontPage() {
   // Filter states
   const [title, setTitle] = useState("");
   const [maxPrice, setMaxPrice] = useState("");
+  const [maxDistance, setMaxDistance] = useState("");
   const [furnished, setFurnished] = useState(false);
   const [startDate, setStartDate] = useState("");
   const [endDate, setEndDate] = useState("");
+  const [wholeStay, setWholeStay] = useState(false);
   const [parking, setParking] = useState("");
 
   // Store filtered results
@@ -21,10 +23,15 @@ export default function FrontPage() {
     const filters = {
       title: title.trim() || undefined,
       maxPrice: maxPrice ? Number(maxPrice) : undefined,
+      // Distance to campus; results then come back nearest first
+      radiusMiles: maxDistance ? Number(maxDistance) : undefined,
       furnished: furnished ? true : undefined,
       parking: parking === "any" ? undefined : parking,
       startDate: startDate || undefined,
       endDate: endDate || undefined,
+      // By default listings that overlap the dates match, longest overlap first
+      availability: wholeStay && (startDate || endDate) ? "covers" : undefined,
+      limit: 100,
     };
 
     // Remove undefined/empty values
@@ -37,7 +44,7 @@ export default function FrontPage() {
     try {
       const data = await api.filterListings(filters);
       console.log("filtered listings:", data);
-      setFilteredListings(data);
+      setFilteredListings(data.listings);
     } catch (err) {
       console.error("Filter request failed:", err);
       alert(`Filter failed: ${err.message}`);
@@ -144,6 +151,20 @@ export default function FrontPage() {
                 />
               </div>
 
+              {/* Distance to campus */}
+              <div>
+                <label className="block font-semibold">Max Distance to Campus (miles)</label>
+                <input
+                  type="number"
+                  min="0"
+                  step="0.5"
+                  className="w-full border p-2 rounded"
+                  placeholder="2"
+                  value={maxDistance}
+                  onChange={(e) => setMaxDistance(e.target.value)}
+                />
+              </div>
+
               {/* Furnished */}
               <div className="flex items-center gap-2">
                 <input
@@ -179,6 +200,19 @@ export default function FrontPage() {
                 />
               </div>
 
+              {/* Whole stay */}
+              <div className="flex items-center gap-2">
+                <input
+                  type="checkbox"
+                  id="wholeStay"
+                  checked={wholeStay}
+                  onChange={(e) => setWholeStay(e.target.checked)}
+                />
+                <label htmlFor="wholeStay" className="font-semibold">
+                  Available for my whole stay
+                </label>
+              </div>
+
               {/* Parking */}
               <div>
                 <label className="block font-semibold mb-1">Parking Availability</label>
@@ -1,6 +1,6 @@
 import { useLocation, useParams, Link, useNavigate } from "react-router-dom";
 import { useState, useEffect } from "react";
-import { api } from "../api";
+import { api, listingImage, photoSrc } from "../api";
 import { useAuth } from "../contexts/AuthContext";
 import DatePicker from "react-datepicker";
 import "react-datepicker/dist/react-datepicker.css";
@@ -91,7 +91,8 @@ export default function ListingDetail() {
   const loadUserListings = async () => {
     if (!user?.email) return;
     try {
-      const listings = await api.getUserListings(user.email);
+      // Only the IDs are needed to check ownership
+      const { listings } = await api.getUserListings(user.email, { limit: 100, fields: "id" });
       setUserListings(listings);
     } catch (err) {
       console.error("Error loading user listings:", err);
@@ -390,12 +391,21 @@ export default function ListingDetail() {
           <div className="md:flex md:gap-6">
             <div className="md:flex-1">
               {/* Images */}
-              {Array.isArray(listing.images) && listing.images.length > 0 ? (
+              {Array.isArray(listing.photoUrls) && listing.photoUrls.length > 0 ? (
                 <div className="grid grid-cols-1 gap-2">
-                  {listing.images.map((src, i) => (
+                  {/* WebP sizes in srcSet; src is the JPEG fallback */}
+                  {listing.photoUrls.map((photo, i) => (
                     <img
                       key={i}
-                      src={src}
+                      src={photoSrc(photo.jpg ? photo.jpg.full : photo.original)}
+                      srcSet={
+                        photo.webp
+                          ? ["thumb", "card", "full"]
+                              .map((size, n) => `${photoSrc(photo.webp[size])} ${[320, 800, 1600][n]}w`)
+                              .join(", ")
+                          : undefined
+                      }
+                      sizes="(min-width: 768px) 50vw, 100vw"
                       alt={`${listing.title || "Listing"}-${i}`}
                       className="w-full rounded-lg object-cover mb-2"
                     />
@@ -404,8 +414,7 @@ export default function ListingDetail() {
               ) : (
                 <img
                   src={
-                    listing.imageUrl ||
-                    listing.image ||
+                    listingImage(listing, "full") ||
                     "https://images.unsplash.com/photo-1505691938895-1758d7feb511?q=80&w=1200&auto=format&fit=crop"
                   }
                   alt={listing.title}
@@ -32,7 +32,7 @@ export default function Login() {
       const res = await api.login(email.trim(), password);
       const userEmail = res?.user?.email || email.trim();
       // Use AuthContext to set user
-      login(userEmail);
+      login(userEmail, res?.token);
       setMsg(`Login OK: ${userEmail}`);
       // Redirect to home after successful login
       setTimeout(() => navigate("/"), 1000);
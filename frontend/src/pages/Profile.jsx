@@ -85,7 +85,10 @@ export default function Profile() {
     if (!user?.email) return;
     
     try {
-      const userListings = await api.getUserListings(user.email);
+      const { listings: userListings } = await api.getUserListings(user.email, {
+        limit: 100,
+        fields: "title,price,image,address,availableFrom,availableTo,createdAt",
+      });
       // Transform listings to match the expected format
       const transformedListings = userListings.map((listing) => ({
         id: listing.id,